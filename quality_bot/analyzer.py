@@ -1,7 +1,19 @@
-import os
 import json
-import httpx
-from typing import Tuple
+import logging
+import re
+from time import perf_counter
+from dataclasses import dataclass
+from typing import Callable, Tuple
+
+from .backends import AnalyzerError, LLMBackend, OpenAIBackend, YandexBackend, YANDEX_URL
+from .config import Config
+from .metrics import LLM_ERRORS, LLM_LATENCY, llm_error_label
+
+logger = logging.getLogger(__name__)
+
+# увеличивать при изменении промптов/нормализации: кэш и сохранённые результаты
+# с другой версией считаются устаревшими
+PROMPT_VERSION = "1"
 
 SYSTEM_PROMPT = """Ты анализируешь корпоративные сообщения.
 Верни СТРОГО JSON без пояснений в формате:
@@ -12,6 +24,18 @@ SYSTEM_PROMPT = """Ты анализируешь корпоративные со
 Если явной проблемы нет — problem="ok".
 """
 
+BATCH_SYSTEM_PROMPT = """Ты анализируешь корпоративные сообщения.
+На вход приходит JSON-массив сообщений вида {"id": <число>, "text": "..."}.
+Оцени КАЖДОЕ сообщение отдельно и верни СТРОГО JSON без пояснений в формате:
+{
+  "results": [
+    {"id": <id сообщения>, "sentiment": "positive|neutral|negative",
+     "problem": "ok|aggressive_tone|toxic|impolite|unclear|off_topic"}
+  ]
+}
+Если явной проблемы нет — problem="ok".
+"""
+
 SENTIMENT_MAP = {"позитивная":"positive","нейтральная":"neutral","негативная":"negative"}
 PROBLEM_MAP = {
     "ок":"ok",
@@ -22,67 +46,233 @@ PROBLEM_MAP = {
     "не по теме":"off_topic",
 }
 
-async def analyze_text(text: str) -> Tuple[str, str]:
-    text = (text or "").strip()
-    if not text:
-        return "neutral", "ok"
-
-    api_key = os.getenv("YANDEX_API_KEY", "").strip()
-    folder_id = os.getenv("YANDEX_FOLDER_ID", "").strip()
-    model = os.getenv("YANDEX_MODEL", "").strip()
-
-    if not api_key or not folder_id or not model:
-        return "neutral", "ok"
-
-    url = "https://llm.api.cloud.yandex.net/v1/chat/completions"
-    headers = {
-        "Authorization": f"Api-Key {api_key}",
-        "Content-Type": "application/json; charset=utf-8",
-        "x-folder-id": folder_id,
-    }
-    payload = {
-        "model": model,
-        "temperature": 0.0,
-        "max_tokens": 120,
-        "messages": [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": text},
-        ],
-        "response_format": {"type": "json_object"},
-    }
-
-    try:
-        async with httpx.AsyncClient(timeout=30) as client:
-            r = await client.post(url, headers=headers, json=payload)
-
-        if r.status_code >= 400:
-            print("AI HTTP:", r.status_code, r.text)
-            return "neutral", "ok"
 
-        data = r.json()
-        content = (data.get("choices", [{}])[0].get("message", {}) or {}).get("content", "")
-        content = (content or "").strip()
+SENTIMENTS = ("positive", "neutral", "negative")
+PROBLEMS = ("ok", "aggressive_tone", "toxic", "impolite", "unclear", "off_topic")
+
+
+def _normalize(obj: dict) -> Tuple[str, str]:
+    sentiment = obj.get("sentiment", "neutral")
+    problem = obj.get("problem", "ok")
+
+    sentiment = SENTIMENT_MAP.get(sentiment, sentiment)
+    problem = PROBLEM_MAP.get(problem, problem)
+
+    if sentiment not in SENTIMENTS:
+        sentiment = "neutral"
+    if problem not in PROBLEMS:
+        problem = "ok"
+
+    return sentiment, problem
+
+
+def _normalize_item(obj) -> Tuple[str, str] | None:
+    # строгая проверка элемента пакетного ответа: неполный или неизвестный ответ
+    # не подменяем на "ok", а отдаём на повторный одиночный анализ
+    if not isinstance(obj, dict) or "sentiment" not in obj or "problem" not in obj:
+        return None
+    sentiment = SENTIMENT_MAP.get(obj["sentiment"], obj["sentiment"])
+    problem = PROBLEM_MAP.get(obj["problem"], obj["problem"])
+    if sentiment not in SENTIMENTS or problem not in PROBLEMS:
+        return None
+    return sentiment, problem
+
+
+def _load_content(data: dict):
+    content = (data.get("choices", [{}])[0].get("message", {}) or {}).get("content", "")
+    content = (content or "").strip()
+
+    if content.startswith("```"):
+        content = content.strip().strip("`").replace("json\n", "", 1).strip()
+
+    return json.loads(content)
+
+
+def _parse_content(data: dict) -> Tuple[str, str]:
+    return _normalize(_load_content(data))
+
 
-        if content.startswith("```"):
-            content = content.strip().strip("`").replace("json\n", "", 1).strip()
+def _parse_batch_content(data: dict, ids: set[int]) -> dict[int, Tuple[str, str]]:
+    obj = _load_content(data)
+    items = obj.get("results", []) if isinstance(obj, dict) else obj
+    results: dict[int, Tuple[str, str]] = {}
+    conflicts: set[int] = set()
+    for item in items if isinstance(items, list) else []:
+        try:
+            item_id = int(item["id"])
+        except (TypeError, KeyError, ValueError):
+            continue
+        parsed = _normalize_item(item)
+        if item_id not in ids or parsed is None:
+            continue
+        # один id с разными ответами — неизвестно, какой верный: отдаём на одиночный анализ
+        if results.setdefault(item_id, parsed) != parsed:
+            conflicts.add(item_id)
+    for item_id in conflicts:
+        del results[item_id]
+    return results
 
-        obj = json.loads(content)
 
-        sentiment = obj.get("sentiment", "neutral")
-        problem = obj.get("problem", "ok")
+# ---------- локальный префильтр ----------
+# Очевидные сообщения (подтверждения, эмодзи, ссылки, явный мат) классифицируются без LLM.
+# Каждое правило имеет уверенность; результат принимается, если она не ниже порога
 
-        sentiment = SENTIMENT_MAP.get(sentiment, sentiment)
-        problem = PROBLEM_MAP.get(problem, problem)
+_URL_RE = re.compile(r"^(?:https?://|www\.)\S+$", re.IGNORECASE)
+_HAS_WORD_RE = re.compile(r"[^\W_]")
+_TOKEN_RE = re.compile(r"[^\W_]+|[+]", re.UNICODE)
+_PROFANITY_RE = re.compile(
+    r"\bх[уy][йяеи]\w*"
+    r"|\w*пизд\w*"
+    r"|\b(?:за|вы|на|у|от|по|до|про|съ|въ|разъ)?еб(?:а|у|л|н)\w*"
+    r"|\bбля(?:д\w*|ть)?\b"
+    r"|\bсук[аи]\b"
+    r"|\bмуда[кч]\w*"
+    r"|\bпид[оа]р\w*",
+    re.IGNORECASE,
+)
+
+# короткие подтверждения: нормализованный текст -> тональность
+ACKNOWLEDGEMENTS = {
+    "ок": "neutral", "ok": "neutral", "окей": "neutral", "okay": "neutral", "+": "neutral",
+    "да": "neutral", "нет": "neutral", "ага": "neutral", "угу": "neutral", "понял": "neutral",
+    "поняла": "neutral", "понятно": "neutral", "принято": "neutral", "принял": "neutral",
+    "приняла": "neutral", "хорошо": "positive", "отлично": "positive", "супер": "positive",
+    "спасибо": "positive", "спс": "positive", "благодарю": "positive", "спасибо большое": "positive",
+    "thanks": "positive", "thank you": "positive", "добрый день": "neutral", "доброе утро": "neutral",
+    "привет": "neutral", "всем привет": "neutral", "сделано": "neutral", "готово": "neutral",
+}
+
+LocalModel = Callable[[str], Tuple[str, str, float] | None]
+
+
+@dataclass
+class PrefilterStats:
+    total: int = 0
+    resolved_ok: int = 0
+    flagged: int = 0
+
+    @property
+    def passed(self) -> int:
+        return self.total - self.resolved_ok - self.flagged
 
-        if sentiment not in ("positive", "neutral", "negative"):
-            sentiment = "neutral"
-        if problem not in ("ok", "aggressive_tone", "toxic", "impolite", "unclear", "off_topic"):
-            problem = "ok"
 
+class Prefilter:
+    def __init__(self, threshold: float = 0.9, max_ack_len: int = 40, model: LocalModel | None = None):
+        self.threshold = threshold
+        self.max_ack_len = max_ack_len
+        # опциональная офлайн-модель: text -> (sentiment, problem, confidence) или None
+        self.model = model
+        self.stats = PrefilterStats()
+
+    def _rules(self, text: str) -> Tuple[str, str, float] | None:
+        if not _HAS_WORD_RE.search(text) and "+" not in text:
+            return "neutral", "ok", 0.99  # эмодзи, пунктуация
+        if _URL_RE.match(text):
+            return "neutral", "ok", 0.95
+        if _PROFANITY_RE.search(text.replace("ё", "е").replace("Ё", "Е")):
+            return "negative", "toxic", 0.9
+        if len(text) <= self.max_ack_len:
+            key = " ".join(_TOKEN_RE.findall(text.lower().replace("ё", "е")))
+            sentiment = ACKNOWLEDGEMENTS.get(key)
+            if sentiment is not None:
+                return sentiment, "ok", 0.95
+        return None
+
+    def classify(self, text: str) -> Tuple[str, str] | None:
+        # None — сообщение нужно отправить в LLM
+        text = (text or "").strip()
+        self.stats.total += 1
+        verdict = self._rules(text)
+        if verdict is None and self.model is not None:
+            verdict = self.model(text)
+        if verdict is None or verdict[2] < self.threshold:
+            return None
+        sentiment, problem, _ = verdict
+        if problem == "ok":
+            self.stats.resolved_ok += 1
+        else:
+            self.stats.flagged += 1
         return sentiment, problem
 
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        print("AI ANALYZE ERROR:", type(e).__name__, e)
-        return "neutral", "ok"
+
+def create_backend(cfg: Config) -> LLMBackend:
+    http = dict(
+        timeout=cfg.llm_timeout,
+        connect_timeout=cfg.llm_connect_timeout,
+        max_connections=cfg.llm_max_connections,
+        max_keepalive=cfg.llm_max_keepalive,
+        http2=cfg.llm_http2,
+    )
+    if cfg.llm_backend == "openai":
+        return OpenAIBackend(cfg.openai_api_key, cfg.openai_model, base_url=cfg.llm_url or None, **http)
+    if cfg.llm_backend == "yandex":
+        return YandexBackend(
+            cfg.yandex_api_key, cfg.yandex_folder_id, cfg.yandex_model, url=cfg.llm_url or YANDEX_URL, **http
+        )
+    raise RuntimeError(f"unknown LLM_BACKEND: {cfg.llm_backend}")
+
+
+class AnalyzerClient:
+    # долгоживущий клиент анализа поверх LLM-бэкенда (Yandex, OpenAI-совместимый, mock);
+    # создаётся в app.main и закрывается при остановке
+    def __init__(self, backend: LLMBackend):
+        self.backend = backend
+
+    @classmethod
+    def from_config(cls, cfg: Config) -> "AnalyzerClient":
+        return cls(create_backend(cfg))
+
+    @property
+    def configured(self) -> bool:
+        return self.backend.configured
+
+    @property
+    def model_version(self) -> str:
+        return f"{self.backend.model}#prompt-{PROMPT_VERSION}"
+
+    async def _complete(self, system_prompt: str, user_content: str, max_tokens: int, kind: str) -> dict:
+        t0 = perf_counter()
+        try:
+            return await self.backend.complete(system_prompt, user_content, max_tokens)
+        except AnalyzerError as e:
+            LLM_ERRORS.labels(llm_error_label(e.status_code)).inc()
+            raise
+        finally:
+            LLM_LATENCY.labels(kind).observe(perf_counter() - t0)
+
+    async def analyze(self, text: str) -> Tuple[str, str]:
+        # HTTP/сетевые ошибки пробрасываются как AnalyzerError, чтобы вызывающий код мог повторить
+        # запрос. Ненастроенный клиент и неразборчивый ответ — тоже ошибка (без повтора): сохранять
+        # вместо результата neutral/ok нельзя, сообщение останется неразобранным
+        text = (text or "").strip()
+        if not text:
+            return "neutral", "ok"
+        if not self.configured:
+            raise AnalyzerError("LLM client is not configured", retryable=False)
+
+        data = await self._complete(SYSTEM_PROMPT, text, 120, "single")
+
+        try:
+            return _parse_content(data)
+        except Exception as e:
+            LLM_ERRORS.labels("bad_response").inc()
+            raise AnalyzerError(f"AI parse error: {type(e).__name__}: {e}", retryable=False) from e
+
+    async def analyze_batch(self, items: list[Tuple[int, str]]) -> dict[int, Tuple[str, str]]:
+        # несколько сообщений в одном запросе; в ответе только элементы, прошедшие проверку,
+        # остальные вызывающий код анализирует по одному
+        items = [(i, (t or "").strip()) for i, t in items]
+        if not self.configured:
+            raise AnalyzerError("LLM client is not configured", retryable=False)
+
+        content = json.dumps([{"id": i, "text": t} for i, t in items], ensure_ascii=False)
+        data = await self._complete(BATCH_SYSTEM_PROMPT, content, 40 + 40 * len(items), "batch")
+
+        try:
+            return _parse_batch_content(data, {i for i, _ in items})
+        except Exception as e:
+            logger.warning("AI batch parse error: %s: %s", type(e).__name__, e)
+            return {}
+
+    async def aclose(self) -> None:
+        await self.backend.aclose()
@@ -1,16 +1,29 @@
 import asyncio
 import logging
+import multiprocessing
+import signal
 
 from aiogram import Router
 from aiogram.types import ErrorEvent
 from aiogram import Bot, Dispatcher, F
 from aiogram.types import Message
 from aiogram.enums import ChatType
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from dotenv import load_dotenv
 
-from .config import load_config
-from .db import create_pool
+from .config import Config, load_config
+from .db import create_pools
 from .repo import Repo
+from .analyzer import AnalyzerClient
+from .ingest import IngestBuffer, IncomingMessage
+from .jobs import AnalyzeJobs
+from .pipeline import create_pipeline
+from .worker import AnalysisWorker, start_workers
+from .metrics import HandlerTimingMiddleware, bind_pool, start_metrics_server
+from .partitions import run_partition_maintenance
+from .reports import ReportScheduler
+from .migrate import migrate
 from .commands import router as commands_router
 
 logging.basicConfig(level=logging.INFO)
@@ -18,60 +31,196 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
-async def main():
-    cfg = load_config()
-    pool = await create_pool(cfg.database_url)
-    repo = Repo(pool)
+# приём сообщений групп — единственный путь записи сообщений в БД
+ingest_router = Router()
 
-    bot = Bot(cfg.bot_token)
+
+@ingest_router.message(F.text & ~F.text.startswith("/"))
+async def collect_messages(message: Message, ingest: IngestBuffer):
+    try:
+        # фильтры
+        if not message.text:
+            return
+        if message.chat.type not in (ChatType.GROUP, ChatType.SUPERGROUP):
+            return
+        if not message.from_user:
+            return
+
+        username = (
+            message.from_user.username
+            or message.from_user.full_name
+            or f"user_{message.from_user.id}"
+        )
+
+        # запись в БД выполняет буфер пачками, хендлер не ждёт round-trip'ов
+        await ingest.put(IncomingMessage(
+            chat_id=message.chat.id,
+            chat_name=message.chat.title or "Group",
+            tg_user_id=message.from_user.id,
+            username=username,
+            role_name="viewer",
+            tg_message_id=message.message_id,
+            text=message.text,
+            created_at=message.date,
+        ))
+
+    except Exception:
+        logger.exception("collect_messages failed")
+        return
+
+
+def build_dispatcher(
+    repo: Repo, ingest: IngestBuffer, analyzer, pipeline, admin_ids: set[int], jobs: AnalyzeJobs | None = None
+) -> Dispatcher:
+    # Dispatcher со всеми роутерами и зависимостями хендлеров (бот и replay-стенд)
     dp = Dispatcher()
 
     dp["repo"] = repo
-    dp["admin_ids"] = cfg.admin_ids
+    dp["analyzer"] = analyzer
+    dp["ingest"] = ingest
+    dp["pipeline"] = pipeline
+    dp["admin_ids"] = admin_ids
+    dp["jobs"] = jobs
+
+    # время хендлеров (в т.ч. из вложенных роутеров) по имени функции
+    dp.message.middleware(HandlerTimingMiddleware())
+    dp.callback_query.middleware(HandlerTimingMiddleware())
 
     dp.include_router(commands_router)
+    dp.include_router(ingest_router)
+    return dp
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot, cfg: Config, stop: asyncio.Event) -> None:
+    # aiohttp-сервер для обновлений от Telegram; хендлеры выполняются в фоне, ответ 200 уходит сразу.
+    # При WEB_WORKERS > 1 процессы слушают один порт (SO_REUSEPORT), соединения распределяет ядро
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, secret_token=cfg.webhook_secret or None
+    ).register(app, path=cfg.webhook_path)
+    setup_application(app, dp, bot=bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, cfg.webhook_host, cfg.webhook_port, reuse_port=cfg.web_workers > 1)
+    await site.start()
+    logger.info("webhook listening on %s:%d%s", cfg.webhook_host, cfg.webhook_port, cfg.webhook_path)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+async def main(instance: int = 0):
+    # instance — номер процесса при WEB_WORKERS > 1 (0 — единственный или первый)
+    cfg = load_config()
+    pool, read_pool = await create_pools(cfg)
+    if cfg.migrate_on_start:
+        await migrate(pool)
+    bind_pool(pool, "writer")
+    bind_pool(read_pool, "reader")
+    # у каждого процесса свой порт метрик: METRICS_PORT + instance
+    start_metrics_server(cfg.metrics_host, cfg.metrics_port + instance if cfg.metrics_port > 0 else 0)
+    repo = Repo(pool, identity_cache_size=cfg.identity_cache_size, read_pool=read_pool)
+    ingest = IngestBuffer(
+        repo,
+        max_items=cfg.ingest_batch_size,
+        flush_interval=cfg.ingest_flush_ms / 1000,
+        max_queue=cfg.ingest_queue_size,
+    )
+    analyzer = AnalyzerClient.from_config(cfg)
+    pipeline = create_pipeline(cfg, repo, analyzer)
+
+    # /analyze выполняется в фоне; слоты LLM делятся между чатами (pipeline)
+    jobs = AnalyzeJobs(repo, pipeline, progress_interval=cfg.analyze_progress_sec)
 
-    @dp.message(F.text & ~F.text.startswith("/"))
-    async def collect_messages(message: Message):
-        try:
-            # фильтры
-            if not message.text:
-                return
-            if message.chat.type not in (ChatType.GROUP, ChatType.SUPERGROUP):
-                return
-            if not message.from_user:
-                return
-
-            chat_name = message.chat.title or "Group"
-            await repo.ensure_chat(message.chat.id, chat_name)
-
-            username = (
-                message.from_user.username
-                or message.from_user.full_name
-                or f"user_{message.from_user.id}"
-            )
-
-            user_id = await repo.ensure_user(
-                tg_user_id=message.from_user.id,
-                username=username,
-                role_name="viewer",
-            )
-
-            await repo.add_message(
-                chat_id=message.chat.id,
-                user_id=user_id,
-                text=message.text,
-                tg_message_id=message.message_id,
-                created_at=message.date,
-            )
-
-        except Exception:
-            logger.exception("collect_messages failed")
-            return
+    bot = Bot(cfg.bot_token)
+    dp = build_dispatcher(repo, ingest, analyzer, pipeline, cfg.admin_ids, jobs)
+
+    # фоновый анализ новых сообщений из analysis_queue
+    stop_workers = asyncio.Event()
+    worker = AnalysisWorker(
+        repo,
+        pipeline,
+        batch_size=cfg.analysis_job_batch,
+        poll_interval=cfg.analysis_poll_interval,
+        max_attempts=cfg.analysis_max_attempts,
+    )
+    worker_tasks = start_workers(worker, cfg.analysis_workers, stop_workers)
+    # секции messages/analysis_results на следующие месяцы
+    worker_tasks.append(asyncio.create_task(
+        run_partition_maintenance(pool, cfg.partitions_ahead, stop_workers)
+    ))
+    # отчёты и дайджесты по расписанию
+    if cfg.report_hour >= 0:
+        scheduler = ReportScheduler(
+            repo,
+            bot,
+            cfg.admin_ids,
+            hour=cfg.report_hour,
+            weekly_day=cfg.report_weekly_day,
+            digest=cfg.report_digest,
+            keep_days=cfg.report_cache_days,
+            cache_days=cfg.analysis_cache_days,
+        )
+        worker_tasks.append(asyncio.create_task(scheduler.run(stop_workers)))
 
     logging.info("Bot started.")
-    await dp.start_polling(bot)
+    ingest.start()
+    try:
+        if cfg.webhook_url:
+            if instance == 0:
+                await bot.set_webhook(
+                    cfg.webhook_url.rstrip("/") + cfg.webhook_path,
+                    secret_token=cfg.webhook_secret or None,
+                    allowed_updates=dp.resolve_used_update_types(),
+                )
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, stop.set)
+            await run_webhook(dp, bot, cfg, stop)
+        else:
+            # getUpdates не работает, пока установлен webhook
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await jobs.stop()
+        await ingest.stop()
+        stop_workers.set()
+        await asyncio.gather(*worker_tasks, return_exceptions=True)
+        await analyzer.aclose()
+        await read_pool.close()
+        await pool.close()
+
+
+def _run_instance(instance: int) -> None:
+    asyncio.run(main(instance))
+
+
+def run() -> None:
+    # polling — один процесс; webhook — WEB_WORKERS процессов на одном порту. Фоновые задачи
+    # (очередь анализа, секции, отчёты) запускаются в каждом и согласуются через Postgres
+    cfg = load_config()
+    workers = cfg.web_workers if cfg.webhook_url else 1
+    if workers <= 1:
+        asyncio.run(main())
+        return
+
+    ctx = multiprocessing.get_context("spawn")
+    procs = [ctx.Process(target=_run_instance, args=(i,), name=f"quality_bot-{i}") for i in range(workers)]
+    for p in procs:
+        p.start()
+
+    def terminate(signum, frame):
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+    for p in procs:
+        p.join()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run()
@@ -0,0 +1,170 @@
+import httpx
+from typing import Protocol
+
+YANDEX_URL = "https://llm.api.cloud.yandex.net/v1/chat/completions"
+
+
+class AnalyzerError(Exception):
+    # ошибка обращения к LLM; status_code=None — сетевая ошибка/таймаут.
+    # retryable=False — повторять сразу бессмысленно (неразборчивый ответ, клиент не настроен)
+    def __init__(
+        self,
+        message: str,
+        status_code: int | None = None,
+        retry_after: float | None = None,
+        retryable: bool | None = None,
+    ):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self._retryable = retryable
+
+    @property
+    def retryable(self) -> bool:
+        if self._retryable is not None:
+            return self._retryable
+        return self.status_code is None or self.status_code == 429 or self.status_code >= 500
+
+
+def _retry_after(headers) -> float | None:
+    value = headers.get("Retry-After", "") if headers is not None else ""
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+class LLMBackend(Protocol):
+    # chat-completions бэкенд: возвращает ответ в формате OpenAI (dict с "choices"),
+    # ошибки транспорта и HTTP пробрасывает как AnalyzerError
+    model: str
+
+    @property
+    def configured(self) -> bool: ...
+
+    async def complete(self, system_prompt: str, user_content: str, max_tokens: int) -> dict: ...
+
+    async def aclose(self) -> None: ...
+
+
+def _payload(model: str, system_prompt: str, user_content: str, max_tokens: int) -> dict:
+    return {
+        "model": model,
+        "temperature": 0.0,
+        "max_tokens": max_tokens,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_content},
+        ],
+        "response_format": {"type": "json_object"},
+    }
+
+
+class YandexBackend:
+    # Yandex Cloud Foundation Models через OpenAI-совместимый endpoint.
+    # Один пул keep-alive соединений (HTTP/2, если доступен) на весь процесс.
+    # url можно направить на локальный mock-сервер (quality_bot.mockllm)
+    def __init__(
+        self,
+        api_key: str,
+        folder_id: str,
+        model: str,
+        url: str = YANDEX_URL,
+        timeout: float = 30.0,
+        connect_timeout: float = 5.0,
+        max_connections: int = 20,
+        max_keepalive: int = 10,
+        keepalive_expiry: float = 60.0,
+        http2: bool = True,
+    ):
+        self.api_key = api_key
+        self.folder_id = folder_id
+        self.model = model
+        self.url = url
+        self._client = httpx.AsyncClient(
+            http2=http2,
+            timeout=httpx.Timeout(timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            headers={
+                "Authorization": f"Api-Key {api_key}",
+                "Content-Type": "application/json; charset=utf-8",
+                "x-folder-id": folder_id,
+            },
+        )
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key and self.folder_id and self.model)
+
+    async def complete(self, system_prompt: str, user_content: str, max_tokens: int) -> dict:
+        try:
+            r = await self._client.post(self.url, json=_payload(self.model, system_prompt, user_content, max_tokens))
+        except httpx.HTTPError as e:
+            raise AnalyzerError(f"{type(e).__name__}: {e}") from e
+
+        if r.status_code >= 400:
+            raise AnalyzerError(f"AI HTTP {r.status_code}: {r.text}", r.status_code, _retry_after(r.headers))
+
+        try:
+            return r.json()
+        except ValueError as e:
+            raise AnalyzerError(f"AI bad response: {e}", r.status_code) from e
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+class OpenAIBackend:
+    # любой OpenAI-совместимый endpoint через SDK openai (base_url задаёт сервер).
+    # Повторы SDK выключены — ими управляет AnalysisPipeline
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        base_url: str | None = None,
+        timeout: float = 30.0,
+        connect_timeout: float = 5.0,
+        max_connections: int = 20,
+        max_keepalive: int = 10,
+        http2: bool = True,
+    ):
+        import openai
+
+        self._openai = openai
+        self.api_key = api_key
+        self.model = model
+        self._client = openai.AsyncOpenAI(
+            api_key=api_key or "none",
+            base_url=base_url or None,
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                http2=http2,
+                timeout=httpx.Timeout(timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+            ),
+        )
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.model)
+
+    async def complete(self, system_prompt: str, user_content: str, max_tokens: int) -> dict:
+        openai = self._openai
+        try:
+            resp = await self._client.chat.completions.create(
+                **_payload(self.model, system_prompt, user_content, max_tokens)
+            )
+        except openai.APIStatusError as e:
+            raise AnalyzerError(
+                f"AI HTTP {e.status_code}: {e.message}", e.status_code, _retry_after(e.response.headers)
+            ) from e
+        except openai.APIConnectionError as e:
+            raise AnalyzerError(f"{type(e).__name__}: {e}") from e
+        return resp.model_dump()
+
+    async def aclose(self) -> None:
+        await self._client.close()
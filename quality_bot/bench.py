@@ -0,0 +1,214 @@
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from dotenv import load_dotenv
+
+from .analyzer import AnalyzerClient, Prefilter
+from .backends import YandexBackend
+from .cache import ResultCache
+from .db import create_pool
+from .ingest import IncomingMessage
+from .mockllm import MockSettings, start_server
+from .partitions import ensure_partitions
+from .pipeline import AnalysisPipeline, _percentile
+from .repo import Repo
+
+logger = logging.getLogger(__name__)
+
+# синтетические чаты и пользователи вне диапазонов Telegram — их можно безопасно удалить
+BENCH_CHAT_BASE = -9_000_000_000_000
+BENCH_USER_BASE = 9_000_000_000_000
+
+SHORT_TEXTS = ["ок", "спасибо", "+", "да", "принято", "👍", "понял", "хорошо", "готово"]
+WORDS = (
+    "отчёт задача срок клиент договор релиз тест сервер встреча созвон бюджет план "
+    "ошибка правка документ согласование презентация макет письмо счёт поставка"
+).split()
+
+
+class QueryCounter:
+    # считает запросы к БД через query logger asyncpg (COPY не учитывается)
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, record) -> None:
+        self.count += 1
+
+    async def init(self, con) -> None:
+        con.add_query_logger(self)
+
+
+def _synthetic_text(rnd: random.Random) -> str:
+    if rnd.random() < 0.35:
+        return rnd.choice(SHORT_TEXTS)
+    words = rnd.choices(WORDS, k=rnd.randint(3, 25))
+    return " ".join(words).capitalize() + rnd.choice([".", "?", "!", ""])
+
+
+def synthetic_messages(chats: int, users: int, messages: int, days: int, seed: int = 1) -> list[IncomingMessage]:
+    # равномерный поток сообщений за последние days дней (используется и в migrate check-plans)
+    rnd = random.Random(seed)
+    start = datetime.now(timezone.utc) - timedelta(days=days)
+    step = days * 86400 / max(1, messages)
+    items = []
+    for i in range(messages):
+        chat = rnd.randrange(chats)
+        user = rnd.randrange(users)
+        items.append(IncomingMessage(
+            chat_id=BENCH_CHAT_BASE - chat,
+            chat_name=f"bench chat {chat}",
+            tg_user_id=BENCH_USER_BASE + user,
+            username=f"bench_user_{user}",
+            role_name="viewer",
+            tg_message_id=i + 1,
+            text=_synthetic_text(rnd),
+            created_at=start + timedelta(seconds=i * step + rnd.random() * step),
+        ))
+    return items
+
+
+async def cleanup(pool) -> None:
+    # сообщения, результаты и очередь удаляются каскадом вместе с чатами
+    async with pool.acquire() as con:
+        async with con.transaction():
+            await con.execute("DELETE FROM public.analysis_rollup_daily WHERE chat_id <= $1", BENCH_CHAT_BASE)
+            await con.execute("DELETE FROM public.response_time_hist_daily WHERE chat_id <= $1", BENCH_CHAT_BASE)
+            await con.execute("DELETE FROM public.report_data_versions WHERE chat_id <= $1", BENCH_CHAT_BASE)
+            await con.execute("DELETE FROM public.report_cache WHERE chat_id <= $1", BENCH_CHAT_BASE)
+            await con.execute("DELETE FROM public.chats WHERE chat_id <= $1", BENCH_CHAT_BASE)
+            await con.execute("DELETE FROM public.users WHERE tg_user_id >= $1", BENCH_USER_BASE)
+
+
+def _line(name: str, count: int, elapsed: float, queries: int, latencies: list[float] | None = None) -> str:
+    rate = count / elapsed if elapsed > 0 else 0.0
+    out = f"{name:<10} {count:>7} msgs  {elapsed:7.2f} s  {rate:9.1f} msg/s  {queries / max(1, count):6.2f} queries/msg"
+    if latencies:
+        out += f"  p50 {_percentile(latencies, 0.5) * 1000:7.1f} ms  p99 {_percentile(latencies, 0.99) * 1000:7.1f} ms"
+    return out
+
+
+async def run(args: argparse.Namespace) -> None:
+    counter = QueryCounter()
+    pool = await create_pool(args.dsn, min_size=1, max_size=args.pool_size, init=counter.init)
+    repo = Repo(pool)
+
+    runner = None
+    llm_url = args.llm_url
+    if not llm_url:
+        runner, base = await start_server(MockSettings(
+            latency=args.latency,
+            jitter=args.latency / 3,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+            retry_after=0.2,
+        ))
+        llm_url = base + "/chat/completions"
+
+    analyzer = AnalyzerClient(YandexBackend("bench", "bench", "bench-mock", url=llm_url, http2=False))
+    pipeline = AnalysisPipeline(
+        repo,
+        analyzer.analyze,
+        analyzer.analyze_batch,
+        concurrency=args.concurrency,
+        rps=args.rps,
+        batch_size=args.batch_size,
+        backoff=0.1,
+        model_version=analyzer.model_version,
+        cache=None if args.no_cache else ResultCache(repo, analyzer.model_version),
+        prefilter=None if args.no_prefilter else Prefilter(),
+    )
+
+    try:
+        await cleanup(pool)
+        await ensure_partitions(pool, months_ahead=1, months_back=args.days // 28 + 1)
+        items = synthetic_messages(args.chats, args.users, args.messages, args.days, args.seed)
+        chat_ids = sorted({it.chat_id for it in items})
+
+        # 1. приём сообщений пачками, как IngestBuffer
+        counter.count = 0
+        t0 = time.monotonic()
+        for i in range(0, len(items), args.ingest_batch):
+            batch = items[i:i + args.ingest_batch]
+            await repo.ingest_messages(batch)
+            await repo.update_response_times(sorted({it.chat_id for it in batch}), horizon_sec=(args.days + 1) * 86400)
+        print(_line("ingest", len(items), time.monotonic() - t0, counter.count))
+
+        # 2. анализ — тот же путь, что и /analyze
+        start = datetime.now(timezone.utc) - timedelta(days=args.days + 1)
+        end = datetime.now(timezone.utc) + timedelta(days=1)
+        counter.count = 0
+        latencies: list[float] = []
+        analyzed = 0
+        t0 = time.monotonic()
+        for chat_id in chat_ids:
+            rows = await repo.list_messages_for_analysis(chat_id, start, end, pipeline.model_version, limit=args.messages)
+            stats = await pipeline.run(rows)
+            analyzed += stats.analyzed
+            latencies += stats.latencies
+        print(_line("analyze", analyzed, time.monotonic() - t0, counter.count, latencies))
+
+        # 3. отчёты — то же, что /report
+        counter.count = 0
+        report_latencies = []
+        t0 = time.monotonic()
+        for _ in range(args.reports):
+            for chat_id in chat_ids:
+                t1 = time.monotonic()
+                await repo.report(chat_id, start, end)
+                await repo.response_time_stats(chat_id, start, end)
+                report_latencies.append(time.monotonic() - t1)
+        elapsed = time.monotonic() - t0
+        print(
+            f"report     {len(report_latencies):>7} runs  {elapsed:7.2f} s  "
+            f"{counter.count / max(1, len(report_latencies)):6.2f} queries/report  "
+            f"p50 {_percentile(report_latencies, 0.5) * 1000:7.1f} ms  "
+            f"p99 {_percentile(report_latencies, 0.99) * 1000:7.1f} ms"
+        )
+    finally:
+        if not args.keep:
+            await cleanup(pool)
+        await analyzer.aclose()
+        if runner is not None:
+            await runner.cleanup()
+        await pool.close()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m quality_bot.bench",
+        description="нагрузочный прогон приёма, анализа и отчётов на локальной БД с mock-LLM",
+    )
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL", ""))
+    parser.add_argument("--chats", type=int, default=5)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--ingest-batch", type=int, default=500)
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--reports", type=int, default=20)
+    parser.add_argument("--llm-url", default="", help="внешний endpoint; по умолчанию поднимается mock-сервер")
+    parser.add_argument("--latency", type=float, default=0.2, help="задержка mock-LLM, сек")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rps", type=float, default=0.0)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--no-prefilter", action="store_true")
+    parser.add_argument("--keep", action="store_true", help="не удалять синтетические данные")
+    return parser
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    load_dotenv()
+    args = build_parser().parse_args()
+    if not args.dsn:
+        raise SystemExit("DATABASE_URL is empty (или --dsn)")
+    asyncio.run(run(args))
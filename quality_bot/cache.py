@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Generic, Hashable, Tuple, TypeVar
+
+if TYPE_CHECKING:
+    from .repo import Repo
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    # "Ок", "ок " и "ОК" — один и тот же ключ кэша
+    return _WS_RE.sub(" ", (text or "").strip().lower().replace("ё", "е"))
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class LRUCache(Generic[K, V]):
+    # ограниченный по размеру кэш с вытеснением давно неиспользованных записей;
+    # ttl <= 0 — записи не устаревают
+    def __init__(self, maxsize: int = 10000, ttl: float = 0.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[K, Tuple[float, V]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        stored_at, value = item
+        if self.ttl > 0 and time.monotonic() - stored_at > self.ttl:
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+
+class ResultCache:
+    # двухуровневый кэш результатов анализа: LRU в процессе + таблица analysis_cache в Postgres.
+    # Ключ — хэш нормализованного текста; версия модели/промпта входит в ключ таблицы,
+    # поэтому смена модели автоматически делает старые записи недействительными.
+    # ttl — срок записей в памяти (сек), max_age_days — в таблице (0 — без ограничения)
+    def __init__(
+        self, repo: Repo, model_version: str, maxsize: int = 10000, ttl: float = 3600.0, max_age_days: int = 0
+    ):
+        self.repo = repo
+        self.model_version = model_version
+        self.max_age_days = max_age_days
+        self._local: LRUCache[str, Tuple[str, str]] = LRUCache(maxsize, ttl)
+        self.hits = 0
+        self.misses = 0
+
+    async def get_many(self, hashes: list[str]) -> dict[str, Tuple[str, str]]:
+        found: dict[str, Tuple[str, str]] = {}
+        missing = []
+        for h in hashes:
+            value = self._local.get(h)
+            if value is None:
+                missing.append(h)
+            else:
+                found[h] = value
+
+        if missing:
+            rows = await self.repo.get_cached_results(missing, self.model_version, self.max_age_days)
+            for r in rows:
+                value = (r["sentiment"], r["detected_problem"])
+                self._local.put(r["text_hash"], value)
+                found[r["text_hash"]] = value
+
+        self.hits += len(found)
+        self.misses += len(hashes) - len(found)
+        return found
+
+    async def put_many(self, results: dict[str, Tuple[str, str]]) -> None:
+        if not results:
+            return
+        for h, value in results.items():
+            self._local.put(h, value)
+        await self.repo.put_cached_results(
+            [(h, sentiment, problem) for h, (sentiment, problem) in results.items()],
+            self.model_version,
+        )
@@ -1,9 +1,21 @@
+import re
+import tempfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
 from aiogram import Router, F
-from aiogram.types import Message
-from aiogram.enums import ChatType
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import CallbackQuery, FSInputFile, InlineKeyboardButton, InlineKeyboardMarkup, Message
 
 from .repo import Repo, date_range_from_args
-from .analyzer import analyze_text
+from .pipeline import AnalysisPipeline
+from .jobs import AnalyzeJobs, runs_text
+from .export import EXPORT_FORMATS, TELEGRAM_FILE_LIMIT, export_filename, export_period
+from .reports import (
+    PROBLEM_RU, SENTIMENT_RU, STANDARD_RANGES, format_report, get_report, split_messages, standard_range,
+)
+from .sampling import DEFAULT_CONFIDENCE, Z_SCORES, parse_percent, sample_size
+from .trends import DEFAULT_DAYS, MAX_HOURLY_DAYS, format_daily, format_hourly, trends_text, user_text
 
 router = Router()
 
@@ -11,21 +23,6 @@ router = Router()
 def _is_admin(message: Message, admin_ids: set[int]) -> bool:
     return bool(message.from_user) and message.from_user.id in admin_ids
 
-SENTIMENT_RU = {
-    "positive": "положительная",
-    "neutral": "нейтральная",
-    "negative": "негативная",
-}
-
-PROBLEM_RU = {
-    "ok": "нет нарушений",
-    "aggressive_tone": "агрессивный тон",
-    "toxic": "токсичность",
-    "impolite": "невежливость",
-    "unclear": "неясное сообщение",
-    "off_topic": "не по теме",
-}
-
 @router.message(F.text.regexp(r"^/start(@\w+)?(\s|$)"))
 async def cmd_start(message: Message, admin_ids: set[int]):
     is_admin = _is_admin(message, admin_ids)
@@ -36,9 +33,14 @@ async def cmd_start(message: Message, admin_ids: set[int]):
         "Команды:\n"
         "/start\n/help\n"
         "/history YYYY-MM-DD YYYY-MM-DD [limit]\n"
-        "/analyze YYYY-MM-DD YYYY-MM-DD [limit]\n"
+        "/analyze YYYY-MM-DD YYYY-MM-DD [limit] [sample=5% | margin=2% [conf=95]]\n"
+        "/jobs, /cancel ID — фоновые запуски /analyze\n"
         "/issues YYYY-MM-DD YYYY-MM-DD [limit]\n"
-        "/report YYYY-MM-DD YYYY-MM-DD"
+        "/report YYYY-MM-DD YYYY-MM-DD | day | week\n"
+        "/trends [YYYY-MM-DD YYYY-MM-DD] [day|hour]\n"
+        "/user @name [YYYY-MM-DD YYYY-MM-DD]\n"
+        "/search запрос [YYYY-MM-DD YYYY-MM-DD] [problem=…] [sentiment=…]\n"
+        "/export YYYY-MM-DD YYYY-MM-DD [csv|parquet]"
     )
 
 
@@ -47,10 +49,133 @@ async def cmd_help(message: Message):
     await message.answer(
         "Команды:\n"
         "/history YYYY-MM-DD YYYY-MM-DD [limit]\n"
-        "/analyze YYYY-MM-DD YYYY-MM-DD [limit]\n"
+        "/analyze YYYY-MM-DD YYYY-MM-DD [limit] [sample=5% | margin=2% [conf=95]]\n"
+        "/jobs, /cancel ID — фоновые запуски /analyze\n"
         "/issues YYYY-MM-DD YYYY-MM-DD [limit]\n"
-        "/report YYYY-MM-DD YYYY-MM-DD"
+        "/report YYYY-MM-DD YYYY-MM-DD | day | week\n"
+        "/trends [YYYY-MM-DD YYYY-MM-DD] [day|hour]\n"
+        "/user @name [YYYY-MM-DD YYYY-MM-DD]\n"
+        "/search запрос [YYYY-MM-DD YYYY-MM-DD] [problem=…] [sentiment=…]\n"
+        "/export YYYY-MM-DD YYYY-MM-DD [csv|parquet]"
+    )
+
+
+# ---------- постраничный вывод /history и /issues ----------
+TEXT_LIMIT = 4000  # Telegram режет сообщения длиннее 4096 символов
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+class PageCb(CallbackData, prefix="pg"):
+    kind: str  # h — история, i — проблемы
+    d1: str  # YYYYMMDD
+    d2: str
+    limit: int
+    back: int
+    ts: int  # created_at граничной строки, мкс от эпохи
+    mid: int  # message_id граничной строки
+
+
+def _format_history_row(r) -> str:
+    return f"{r['created_at']:%Y-%m-%d %H:%M} {r['username']}: {r['message_text'][:200]}"
+
+
+def _format_issue_row(r) -> str:
+    sent_ru = SENTIMENT_RU.get(r["sentiment"], r["sentiment"])
+    prob_ru = PROBLEM_RU.get(r["detected_problem"], r["detected_problem"])
+    return (
+        f"[{r['created_at']:%Y-%m-%d %H:%M}] {r['username']} | "
+        f"{sent_ru} | {prob_ru}\n"
+        f"msg: {r['message_text'][:220]}"
+    )
+
+
+PAGE_KINDS = {
+    "h": (Repo.messages_page, _format_history_row, "\n"),
+    "i": (Repo.issues_page, _format_issue_row, "\n\n"),
+}
+
+
+def _fit_rows(rows: list, fmt, sep: str, backward: bool) -> tuple[list, str, bool]:
+    # сколько строк страницы помещается в одно сообщение; при листании назад
+    # сохраняем строки, ближайшие к курсору
+    ordered = list(reversed(rows)) if backward else list(rows)
+    kept, parts, size = [], [], 0
+    for r in ordered:
+        line = fmt(r)
+        if kept and size + len(sep) + len(line) > TEXT_LIMIT:
+            break
+        kept.append(r)
+        parts.append(line)
+        size += len(line) + len(sep)
+    if backward:
+        kept.reverse()
+        parts.reverse()
+    return kept, sep.join(parts), len(kept) < len(rows)
+
+
+def _page_button(text: str, kind: str, d1: str, d2: str, limit: int, back: bool, row) -> InlineKeyboardButton:
+    ts = (row["created_at"] - EPOCH) // timedelta(microseconds=1)
+    data = PageCb(
+        kind=kind, d1=d1.replace("-", ""), d2=d2.replace("-", ""), limit=limit,
+        back=int(back), ts=ts, mid=int(row["message_id"]),
     )
+    return InlineKeyboardButton(text=text, callback_data=data.pack())
+
+
+async def _render_page(
+    repo: Repo,
+    chat_id: int,
+    kind: str,
+    d1: str,
+    d2: str,
+    limit: int,
+    cursor: tuple[datetime, int] | None = None,
+    backward: bool = False,
+) -> tuple[str | None, InlineKeyboardMarkup | None]:
+    fetch, fmt, sep = PAGE_KINDS[kind]
+    start, end = date_range_from_args(d1, d2)
+
+    # лишняя строка показывает, есть ли продолжение в направлении листания
+    rows = await fetch(repo, chat_id, start, end, limit + 1, cursor, backward)
+    more = len(rows) > limit
+    rows = rows[1:] if backward and more else rows[:limit]
+    if not rows:
+        return None, None
+
+    rows, text, trimmed = _fit_rows(rows, fmt, sep, backward)
+    more = more or trimmed
+    has_prev = more if backward else cursor is not None
+    has_next = True if backward else more
+
+    buttons = []
+    if has_prev:
+        buttons.append(_page_button("◀ Назад", kind, d1, d2, limit, True, rows[0]))
+    if has_next:
+        buttons.append(_page_button("Вперёд ▶", kind, d1, d2, limit, False, rows[-1]))
+    return text, InlineKeyboardMarkup(inline_keyboard=[buttons]) if buttons else None
+
+
+@router.callback_query(PageCb.filter())
+async def on_page(callback: CallbackQuery, callback_data: PageCb, repo: Repo, admin_ids: set[int]):
+    try:
+        if callback.from_user.id not in admin_ids:
+            return await callback.answer("Недостаточно прав.")
+
+        d1 = f"{callback_data.d1[:4]}-{callback_data.d1[4:6]}-{callback_data.d1[6:]}"
+        d2 = f"{callback_data.d2[:4]}-{callback_data.d2[4:6]}-{callback_data.d2[6:]}"
+        cursor = (EPOCH + timedelta(microseconds=callback_data.ts), callback_data.mid)
+        text, kb = await _render_page(
+            repo, callback.message.chat.id, callback_data.kind, d1, d2, callback_data.limit,
+            cursor, bool(callback_data.back),
+        )
+        if text is None:
+            return await callback.answer("Больше нет записей.")
+        await callback.message.edit_text(text, reply_markup=kb)
+        await callback.answer()
+    except Exception:
+        import logging
+        logging.exception("page failed")
+        return await callback.answer("Ошибка. Проверьте логи.")
 
 
 @router.message(F.text.regexp(r"^/history(@\w+)?(\s|$)"))
@@ -65,16 +190,11 @@ async def cmd_history(message: Message, repo: Repo, admin_ids: set[int]):
 
         d1, d2 = parts[1], parts[2]
         limit = int(parts[3]) if len(parts) >= 4 and parts[3].isdigit() else 30
-        start, end = date_range_from_args(d1, d2)
 
-        rows = await repo.list_messages(message.chat.id, start, end, limit=limit)
-        if not rows:
+        text, kb = await _render_page(repo, message.chat.id, "h", d1, d2, limit)
+        if text is None:
             return await message.answer("Сообщений нет за период.")
-
-        out = []
-        for r in rows[-limit:]:
-            out.append(f"{r['created_at']:%Y-%m-%d %H:%M} {r['username']}: {r['message_text'][:200]}")
-        await message.answer("\n".join(out))
+        await message.answer(text, reply_markup=kb)
         
     except Exception:
         import logging
@@ -82,50 +202,108 @@ async def cmd_history(message: Message, repo: Repo, admin_ids: set[int]):
         return await message.answer("Ошибка при выводе истории. Проверьте логи.")
 
 
+ANALYZE_USAGE = "Формат: /analyze YYYY-MM-DD YYYY-MM-DD [limit] [sample=5% | margin=2% [conf=95]]"
+
+
+def _analyze_options(args: list[str]) -> dict[str, str]:
+    # key=value после дат и limit: sample=5%, margin=2%, conf=95
+    opts = {}
+    for a in args:
+        key, sep, value = a.partition("=")
+        if not sep or key not in ("sample", "margin", "conf"):
+            raise ValueError(f"unknown option: {a}")
+        opts[key] = value
+    return opts
+
+
 @router.message(F.text.regexp(r"^/analyze(@\w+)?(\s|$)"))
-async def cmd_analyze(message: Message, repo: Repo, admin_ids: set[int]):
+async def cmd_analyze(
+    message: Message, repo: Repo, pipeline: AnalysisPipeline, jobs: AnalyzeJobs, admin_ids: set[int]
+):
     try:
         if not _is_admin(message, admin_ids):
             return await message.answer("Недостаточно прав.")
     
         parts = message.text.split()
         if len(parts) < 3:
-            return await message.answer("Формат: /analyze YYYY-MM-DD YYYY-MM-DD [limit]")
+            return await message.answer(ANALYZE_USAGE)
     
         d1, d2 = parts[1], parts[2]
-        limit = int(parts[3]) if len(parts) >= 4 and parts[3].isdigit() else 200
+        rest = parts[3:]
+        limit = int(rest.pop(0)) if rest and rest[0].isdigit() else None
+        try:
+            opts = _analyze_options(rest)
+            rate = parse_percent(opts["sample"]) if "sample" in opts else None
+            margin = parse_percent(opts["margin"]) if "margin" in opts else None
+            conf = int(opts.get("conf", DEFAULT_CONFIDENCE))
+        except ValueError:
+            return await message.answer(ANALYZE_USAGE)
+        if conf not in Z_SCORES or (rate is not None and margin is not None):
+            return await message.answer(ANALYZE_USAGE)
         start, end = date_range_from_args(d1, d2)
-    
-        rows = await repo.list_messages(message.chat.id, start, end, limit=limit)
-        if not rows:
-            return await message.answer("Нет сообщений для анализа.")
-    
-        analyzed = 0
-        problems = 0
-    
-        for r in rows:
-            txt = (r["message_text"] or "").strip()
-            if not txt or txt.startswith("/"):
-                continue
-    
-            try:
-                sentiment, problem = await analyze_text(txt)
-                await repo.save_analysis(int(r["message_id"]), sentiment, problem)
-                analyzed += 1
-                if problem != "ok":
-                    problems += 1
-            except Exception:
-                # лог + продолжаем дальше
-                import logging
-                logging.exception("analyze/save failed for message_id=%s", r["message_id"])
-                continue
-        await message.answer(f"Готово. Проанализировано: {analyzed}. Проблем: {problems}.")
+        chat_id = message.chat.id
+
+        async def fetch_rows():
+            # без выборки — первые limit сообщений периода (200 по умолчанию);
+            # margin — объём выборки под заданную погрешность доли проблемных
+            sample_rate, note = rate, ""
+            if margin is not None:
+                total = await repo.count_messages(chat_id, start, end)
+                size = sample_size(total, margin, conf)
+                sample_rate = size / total if total else 1.0
+                note = f"Выборка под ±{100 * margin:g}% при {conf}%: {size} из {total} сообщений.\n"
+            if sample_rate is None:
+                rows = await repo.list_messages_for_analysis(
+                    chat_id, start, end, pipeline.model_version, limit=limit or 200
+                )
+                return rows, note, None
+            rows = await repo.list_messages_sample(
+                chat_id, start, end, pipeline.model_version, sample_rate, limit=limit
+            )
+            return rows, note or f"Выборка {100 * sample_rate:g}% сообщений периода.\n", sample_rate
+
+        # анализ идёт в фоне: ход — в этом сообщении, список запусков — /jobs
+        status = await message.answer("Анализ: подготовка…")
+        jobs.start(chat_id, message.from_user.id, status, fetch_rows, start, end)
     except Exception:
         import logging
         logging.exception("analyze failed")
         return await message.answer("Ошибка при анализе. Проверьте логи.")
 
 
+@router.message(F.text.regexp(r"^/jobs(@\w+)?(\s|$)"))
+async def cmd_jobs(message: Message, repo: Repo, jobs: AnalyzeJobs, admin_ids: set[int]):
+    try:
+        if not _is_admin(message, admin_ids):
+            return await message.answer("Недостаточно прав.")
+
+        rows = await repo.list_analyze_runs(10)
+        await message.answer(runs_text(rows, jobs.stale_after))
+    except Exception:
+        import logging
+        logging.exception("jobs failed")
+        return await message.answer("Ошибка при выводе запусков. Проверьте логи.")
+
+
+@router.message(F.text.regexp(r"^/cancel(@\w+)?(\s|$)"))
+async def cmd_cancel(message: Message, jobs: AnalyzeJobs, admin_ids: set[int]):
+    try:
+        if not _is_admin(message, admin_ids):
+            return await message.answer("Недостаточно прав.")
+
+        parts = message.text.split()
+        if len(parts) < 2 or not parts[1].lstrip("#").isdigit():
+            return await message.answer("Формат: /cancel ID (список — /jobs)")
+        run_id = int(parts[1].lstrip("#"))
+        if not await jobs.cancel(run_id):
+            return await message.answer(f"Запуск #{run_id} не найден или уже завершён.")
+        await message.answer(f"Отмена запуска #{run_id} запрошена.")
+    except Exception:
+        import logging
+        logging.exception("cancel failed")
+        return await message.answer("Ошибка при отмене. Проверьте логи.")
+
+
 @router.message(F.text.regexp(r"^/issues(@\w+)?(\s|$)"))
 async def cmd_issues(message: Message, repo: Repo, admin_ids: set[int]):
     try:
@@ -138,23 +316,11 @@ async def cmd_issues(message: Message, repo: Repo, admin_ids: set[int]):
 
         d1, d2 = parts[1], parts[2]
         limit = int(parts[3]) if len(parts) >= 4 and parts[3].isdigit() else 20
-        start, end = date_range_from_args(d1, d2)
 
-        rows = await repo.list_issues(message.chat.id, start, end, limit=limit)
-        if not rows:
+        text, kb = await _render_page(repo, message.chat.id, "i", d1, d2, limit)
+        if text is None:
             return await message.answer("Проблем не найдено за период (или анализ ещё не запускали).")
-
-        out = []
-        for r in rows:
-            sent_ru = SENTIMENT_RU.get(r["sentiment"], r["sentiment"])
-            prob_ru = PROBLEM_RU.get(r["detected_problem"], r["detected_problem"])
-
-            out.append(
-                f"[{r['analysis_date']:%Y-%m-%d %H:%M}] {r['username']} | "
-                f"{sent_ru} | {prob_ru}\n"
-                f"msg: {r['message_text'][:220]}"
-            )
-        await message.answer("\n\n".join(out))
+        await message.answer(text, reply_markup=kb)
     except Exception:
         import logging
         logging.exception("issues failed")
@@ -167,87 +333,242 @@ async def cmd_report(message: Message, repo: Repo, admin_ids: set[int]):
             return await message.answer("Недостаточно прав.")
 
         parts = message.text.split()
-        if len(parts) < 3:
-            return await message.answer("Формат: /report YYYY-MM-DD YYYY-MM-DD")
+        if len(parts) >= 2 and parts[1] in STANDARD_RANGES:
+            day_from, day_to = standard_range(parts[1])
+        elif len(parts) >= 3:
+            start, end = date_range_from_args(parts[1], parts[2])
+            day_from, day_to = start.date(), end.date()
+        else:
+            return await message.answer("Формат: /report YYYY-MM-DD YYYY-MM-DD | day | week")
+
+        # готовый отчёт берётся из report_cache, если данные за период с тех пор не менялись
+        data, _ = await get_report(repo, message.chat.id, day_from, day_to)
+        await message.answer(format_report(data, day_from, day_to))
+    except Exception:
+        import logging
+        logging.exception("report failed")
+        return await message.answer("Ошибка при формировании отчёта. Проверьте логи.")
+
+def _days_from_args(args: list[str]) -> tuple[datetime, datetime]:
+    # две даты или, без них, последние DEFAULT_DAYS дней включая сегодня
+    if len(args) >= 2:
+        return date_range_from_args(args[0], args[1])
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=DEFAULT_DAYS - 1), today + timedelta(days=1)
+
+
+async def _answer_lines(message: Message, lines: list[str]) -> None:
+    for text in split_messages(lines, sep="\n"):
+        await message.answer(text)
+
+
+@router.message(F.text.regexp(r"^/trends(@\w+)?(\s|$)"))
+async def cmd_trends(message: Message, repo: Repo, admin_ids: set[int]):
+    try:
+        if not _is_admin(message, admin_ids):
+            return await message.answer("Недостаточно прав.")
+
+        args = message.text.split()[1:]
+        hourly = bool(args) and args[-1] == "hour"
+        if args and args[-1] in ("day", "hour"):
+            args = args[:-1]
+        if len(args) == 1:
+            return await message.answer("Формат: /trends [YYYY-MM-DD YYYY-MM-DD] [day|hour]")
+        start, end = _days_from_args(args)
+        day_from, day_to = start.date(), end.date()
+        if hourly and (day_to - day_from).days > MAX_HOURLY_DAYS:
+            return await message.answer(f"По часам — не больше {MAX_HOURLY_DAYS} дней.")
 
-        d1, d2 = parts[1], parts[2]
-        start, end = date_range_from_args(d1, d2)
         chat_id = message.chat.id
-        agg, top = await repo.report(chat_id, start, end)
-        rt = await repo.response_time_stats(chat_id, start, end)
-        responded = int(rt["responded_cnt"] or 0)
-        avg_sec = float(rt["avg_sec"] or 0)
-        median_sec = float(rt["median_sec"] or 0)
-        total = int(agg["total_analyzed"] or 0)
-        problems = int(agg["problems"] or 0)
-
-        lines = [
-            f"Отчёт за {d1} — {d2}",
-            f"Проанализировано: {total}",
-            f"Проблемных: {problems}",
-            "",
-            "Топ проблем:",
-        ]
-
-        if top:
-            for r in top:
-                prob_ru = PROBLEM_RU.get(r["detected_problem"], r["detected_problem"])
-                lines.append(f"- {prob_ru}: {int(r['cnt'])}")
+        if hourly:
+            series = format_hourly(await repo.problem_trend_hourly(chat_id, start, end))
         else:
-            lines.append("- (нет)")
+            series = format_daily(await repo.problem_trend(chat_id, day_from, day_to))
+        sentiments = await repo.distribution(chat_id, day_from, day_to, "sentiment")
+        users = await repo.user_problem_counts(chat_id, day_from, day_to)
+        await _answer_lines(message, trends_text(day_from, day_to, series, sentiments, users, hourly))
+    except Exception:
+        import logging
+        logging.exception("trends failed")
+        return await message.answer("Ошибка при расчёте трендов. Проверьте логи.")
 
-        lines += [
-            "",
-            "Скорость ответа (следующее сообщение от другого пользователя):",
-            f"Ответов найдено: {responded}",
-    ]
 
-        if responded == 0:
-            lines += ["Среднее время ответа: нет данных", "Медиана времени ответа: нет данных"]
-        else:
-            lines += [
-                f"Среднее время ответа: {float(avg_sec):.1f} сек",
-                f"Медиана времени ответа: {float(median_sec):.1f} сек",
-        ]
+@router.message(F.text.regexp(r"^/user(@\w+)?(\s|$)"))
+async def cmd_user(message: Message, repo: Repo, admin_ids: set[int]):
+    try:
+        if not _is_admin(message, admin_ids):
+            return await message.answer("Недостаточно прав.")
 
-        
-        await message.answer("\n".join(lines))
+        args = message.text.split()[1:]
+        if not args or len(args) == 2:
+            return await message.answer("Формат: /user @name [YYYY-MM-DD YYYY-MM-DD]")
+        users = await repo.find_users(args[0])
+        if not users:
+            return await message.answer("Пользователь не найден.")
+        user_ids = [int(u["user_id"]) for u in users]
+
+        start, end = _days_from_args(args[1:])
+        day_from, day_to = start.date(), end.date()
+        chat_id = message.chat.id
+        daily = await repo.problem_trend(chat_id, day_from, day_to, user_ids)
+        sentiments = await repo.distribution(chat_id, day_from, day_to, "sentiment", user_ids)
+        problems = await repo.distribution(chat_id, day_from, day_to, "detected_problem", user_ids)
+        await _answer_lines(message, user_text(users[0]["username"], day_from, day_to, daily, sentiments, problems))
     except Exception:
         import logging
-        logging.exception("report failed")
-        return await message.answer("Ошибка при формировании отчёта. Проверьте логи.")
+        logging.exception("user failed")
+        return await message.answer("Ошибка при выводе статистики пользователя. Проверьте логи.")
 
-@router.message(F.text)
-async def collect_message(message: Message, repo: Repo, admin_ids: set[int]):
-    # сохраняем только группы/супергруппы (как корпоративные чаты)
-    if message.chat.type not in (ChatType.GROUP, ChatType.SUPERGROUP):
-        return
 
-    # игнор системных событий без текста
-    if not message.text:
-        return
+# ---------- /search ----------
+SEARCH_USAGE = "Формат: /search запрос [YYYY-MM-DD YYYY-MM-DD] [problem=toxic] [sentiment=negative]"
+SEARCH_PAGE = 10
+_DATE_RE = re.compile(r"^\d{4}-\d{2}-\d{2}$")
 
-    txt = (message.text or "").strip()
-    if not txt or txt.startswith("/"):
-        return
 
-    # сохраним чат
-    await repo.ensure_chat(message.chat.id, message.chat.title or "Group")
+class SearchCb(CallbackData, prefix="sr"):
+    # ключ последней строки страницы; сам запрос берётся из сообщения /search,
+    # на которое бот ответил (в callback_data помещается только 64 байта)
+    rank: float
+    ts: int
+    mid: int
 
-    # роль по умолчанию user, админа определяем по списку admin_ids
-    role = "admin" if _is_admin(message, admin_ids) else "user"
 
-    # user_id в БД получаем через tg_user_id
-    tg_user_id = message.from_user.id if message.from_user else 0
-    username = (message.from_user.username if message.from_user else "") or ""
+def _parse_search(text: str):
+    # (запрос, start, end, problem, sentiment); без дат — поиск за всё время
+    words, filters = [], {}
+    for a in text.split()[1:]:
+        key, sep, value = a.partition("=")
+        if sep and key in ("problem", "sentiment"):
+            filters[key] = value
+        else:
+            words.append(a)
+    if len(words) >= 3 and all(_DATE_RE.match(w) for w in words[-2:]):
+        start, end = date_range_from_args(words[-2], words[-1])
+        words = words[:-2]
+    else:
+        start, end = EPOCH, datetime.now(timezone.utc) + timedelta(days=1)
+    query = " ".join(words)
+    problem, sentiment = filters.get("problem"), filters.get("sentiment")
+    if not 2 <= len(query) <= 200:
+        raise ValueError("bad query length")
+    if problem is not None and problem not in PROBLEM_RU:
+        raise ValueError(f"unknown problem: {problem}")
+    if sentiment is not None and sentiment not in SENTIMENT_RU:
+        raise ValueError(f"unknown sentiment: {sentiment}")
+    return query, start, end, problem, sentiment
+
+
+def _format_search_row(r) -> str:
+    head = f"[{r['created_at']:%Y-%m-%d %H:%M}] {r['username']}"
+    if r["detected_problem"] is not None:
+        head += (
+            f" | {SENTIMENT_RU.get(r['sentiment'], r['sentiment'])}"
+            f" | {PROBLEM_RU.get(r['detected_problem'], r['detected_problem'])}"
+        )
+    return f"{head}\n{r['message_text'][:220]}"
+
+
+async def _render_search(
+    repo: Repo, chat_id: int, text: str, cursor: tuple[float, datetime, int] | None = None
+) -> tuple[str | None, InlineKeyboardMarkup | None]:
+    query, start, end, problem, sentiment = _parse_search(text)
+    rows = await repo.search_messages(
+        chat_id, query, start, end, SEARCH_PAGE + 1, cursor, problem=problem, sentiment=sentiment
+    )
+    more = len(rows) > SEARCH_PAGE
+    rows = rows[:SEARCH_PAGE]
+    if not rows:
+        return None, None
+
+    rows, body, trimmed = _fit_rows(rows, _format_search_row, "\n\n", False)
+    if not (more or trimmed):
+        return body, None
+    last = rows[-1]
+    data = SearchCb(
+        rank=float(last["rank"]),
+        ts=(last["created_at"] - EPOCH) // timedelta(microseconds=1),
+        mid=int(last["message_id"]),
+    )
+    kb = InlineKeyboardMarkup(inline_keyboard=[[InlineKeyboardButton(text="Ещё ▶", callback_data=data.pack())]])
+    return body, kb
 
-    user_id = await repo.ensure_user(tg_user_id=tg_user_id, username=username, role_name=role)
 
-    # message_id телеги сохраняем отдельно как tg_message_id
-    await repo.add_message(
-        chat_id=message.chat.id,
-        user_id=user_id,
-        text=message.text,
-        tg_message_id=message.message_id,
-        created_at=message.date,
-    )
+@router.message(F.text.regexp(r"^/search(@\w+)?(\s|$)"))
+async def cmd_search(message: Message, repo: Repo, admin_ids: set[int]):
+    try:
+        if not _is_admin(message, admin_ids):
+            return await message.answer("Недостаточно прав.")
+
+        try:
+            text, kb = await _render_search(repo, message.chat.id, message.text)
+        except ValueError:
+            return await message.answer(SEARCH_USAGE)
+        if text is None:
+            return await message.answer("Ничего не найдено.")
+        # ответ на сообщение с запросом: по нему листаются следующие страницы
+        await message.reply(text, reply_markup=kb)
+    except Exception:
+        import logging
+        logging.exception("search failed")
+        return await message.answer("Ошибка при поиске. Проверьте логи.")
+
+
+@router.callback_query(SearchCb.filter())
+async def on_search_page(callback: CallbackQuery, callback_data: SearchCb, repo: Repo, admin_ids: set[int]):
+    try:
+        if callback.from_user.id not in admin_ids:
+            return await callback.answer("Недостаточно прав.")
+
+        original = callback.message.reply_to_message
+        if original is None or not original.text:
+            return await callback.answer("Запрос не найден, повторите /search.")
+        cursor = (callback_data.rank, EPOCH + timedelta(microseconds=callback_data.ts), callback_data.mid)
+        text, kb = await _render_search(repo, callback.message.chat.id, original.text, cursor)
+        await callback.message.edit_reply_markup(reply_markup=None)
+        if text is None:
+            return await callback.answer("Больше нет результатов.")
+        await callback.message.answer(text, reply_to_message_id=original.message_id, reply_markup=kb)
+        await callback.answer()
+    except Exception:
+        import logging
+        logging.exception("search page failed")
+        return await callback.answer("Ошибка. Проверьте логи.")
+
+
+@router.message(F.text.regexp(r"^/export(@\w+)?(\s|$)"))
+async def cmd_export(message: Message, repo: Repo, admin_ids: set[int]):
+    try:
+        if not _is_admin(message, admin_ids):
+            return await message.answer("Недостаточно прав.")
+
+        parts = message.text.split()
+        fmt = parts[3].lower() if len(parts) >= 4 else "csv"
+        if len(parts) < 3 or fmt not in EXPORT_FORMATS:
+            return await message.answer("Формат: /export YYYY-MM-DD YYYY-MM-DD [csv|parquet]")
+
+        start, end = date_range_from_args(parts[1], parts[2])
+        chat_id = message.chat.id
+        await message.answer("Готовлю выгрузку…")
+
+        # файл пишется потоково во временный каталог и удаляется после отправки
+        with tempfile.TemporaryDirectory(prefix="quality_bot_export_") as tmp:
+            path = Path(tmp) / export_filename(chat_id, start, end, fmt)
+            try:
+                rows = await export_period(repo, path, fmt, chat_id, start, end)
+            except ImportError:
+                return await message.answer("Для parquet нужен пакет pyarrow. Попробуйте csv.")
+            if not rows:
+                return await message.answer("Сообщений нет за период.")
+            if path.stat().st_size > TELEGRAM_FILE_LIMIT:
+                return await message.answer(
+                    "Файл больше 50 МБ — Telegram его не примет. Сузьте период или выгрузите через "
+                    "python -m quality_bot.manage export."
+                )
+            await message.answer_document(
+                FSInputFile(path, filename=path.name), caption=f"Сообщений: {rows}"
+            )
+    except Exception:
+        import logging
+        logging.exception("export failed")
+        return await message.answer("Ошибка при выгрузке. Проверьте логи.")
@@ -9,20 +9,175 @@ def _parse_admin_ids(value: str) -> set[int]:
         return set()
     return {int(x.strip()) for x in value.split(",") if x.strip().isdigit()}
 
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name, "").strip()
+    return int(value) if value else default
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name, "").strip().lower()
+    return value in ("1", "true", "yes", "on") if value else default
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name, "").strip()
+    return float(value) if value else default
+
 @dataclass(frozen=True)
 class Config:
     bot_token: str
     database_url: str
     admin_ids: set[int]
+    # пулы соединений: запись (DATABASE_URL) и чтение для отчётов (реплика или та же база)
+    database_read_url: str = ""
+    db_pool_min: int = 1
+    db_pool_max: int = 10
+    db_read_pool_min: int = 1
+    db_read_pool_max: int = 5
+    db_statement_cache_size: int = 100
+    db_command_timeout: float = 0.0  # 0 — без ограничения (миграции при старте идут через этот пул)
+    db_read_command_timeout: float = 60.0
+    # LLM: yandex | openai (любой OpenAI-совместимый endpoint)
+    llm_backend: str = "yandex"
+    llm_url: str = ""
+    yandex_api_key: str = ""
+    yandex_folder_id: str = ""
+    yandex_model: str = ""
+    openai_api_key: str = ""
+    openai_model: str = ""
+    llm_timeout: float = 30.0
+    llm_connect_timeout: float = 5.0
+    llm_max_connections: int = 20
+    llm_max_keepalive: int = 10
+    llm_http2: bool = True
+    # параллельный анализ
+    analyze_concurrency: int = 8
+    analyze_rps: float = 10.0
+    analyze_burst: float = 0.0  # 0 — равно analyze_rps
+    analyze_retries: int = 3
+    analyze_batch_size: int = 20
+    analyze_batch_max_chars: int = 300
+    # как часто фоновый /analyze обновляет статусное сообщение и строку analyze_runs, сек
+    analyze_progress_sec: float = 5.0
+    # circuit breaker: после стольких сбоев LLM подряд запросы приостанавливаются
+    circuit_failure_threshold: int = 5
+    circuit_reset_sec: float = 30.0
+    circuit_max_reset_sec: float = 300.0
+    # кэш результатов анализа (in-process LRU; постоянный уровень — таблица analysis_cache)
+    analysis_cache_size: int = 10000
+    analysis_cache_ttl: float = 3600.0
+    analysis_cache_days: int = 30  # срок записей analysis_cache (0 — без ограничения)
+    # локальный префильтр перед LLM
+    prefilter_enabled: bool = True
+    prefilter_threshold: float = 0.9
+    # буфер записи входящих сообщений
+    ingest_batch_size: int = 500
+    ingest_flush_ms: int = 200
+    ingest_queue_size: int = 10000
+    identity_cache_size: int = 10000
+    # фоновые воркеры очереди анализа (0 — только отдельным процессом quality_bot.worker)
+    analysis_workers: int = 2
+    analysis_poll_interval: float = 2.0
+    analysis_job_batch: int = 50
+    analysis_max_attempts: int = 5
+
+    # применять миграции sql/migrations при старте бота и воркера
+    migrate_on_start: bool = True
+
+    # месячные секции messages/analysis_results: сколько создавать вперёд и сколько хранить
+    partitions_ahead: int = 2
+    retention_months: int = 0  # 0 — хранить всё
+    retention_mode: str = "detach"  # detach | drop
+    archive_dir: str = ""  # выгрузка секций в csv.gz перед отсоединением
+
+    # отчёты за вчера и за неделю: расчёт заранее и дайджест админам в report_hour UTC (-1 — выключено)
+    report_hour: int = 3
+    report_weekly_day: int = 0  # 0 — понедельник
+    report_digest: bool = True
+    report_cache_days: int = 30
+
+    # webhook вместо polling: публичный адрес (пусто — polling), локальный адрес сервера и число процессов
+    webhook_url: str = ""
+    webhook_path: str = "/webhook"
+    webhook_secret: str = ""
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8080
+    web_workers: int = 1
+
+    # /metrics для Prometheus (0 — выключено)
+    metrics_host: str = "127.0.0.1"
+    metrics_port: int = 9108
 
-def load_config() -> Config:
+def load_config(require_bot_token: bool = True) -> Config:
     bot_token = os.getenv("BOT_TOKEN", "").strip()
     db_url = os.getenv("DATABASE_URL", "").strip()
     admin_ids = _parse_admin_ids(os.getenv("ADMIN_IDS", ""))
 
-    if not bot_token:
+    if require_bot_token and not bot_token:
         raise RuntimeError("BOT_TOKEN is empty")
     if not db_url:
         raise RuntimeError("DATABASE_URL is empty")
 
-    return Config(bot_token=bot_token, database_url=db_url, admin_ids=admin_ids)
\ No newline at end of file
+    return Config(
+        bot_token=bot_token,
+        database_url=db_url,
+        database_read_url=os.getenv("DATABASE_READ_URL", "").strip(),
+        db_pool_min=_env_int("DB_POOL_MIN", 1),
+        db_pool_max=_env_int("DB_POOL_MAX", 10),
+        db_read_pool_min=_env_int("DB_READ_POOL_MIN", 1),
+        db_read_pool_max=_env_int("DB_READ_POOL_MAX", 5),
+        db_statement_cache_size=_env_int("DB_STATEMENT_CACHE_SIZE", 100),
+        db_command_timeout=_env_float("DB_COMMAND_TIMEOUT", 0.0),
+        db_read_command_timeout=_env_float("DB_READ_COMMAND_TIMEOUT", 60.0),
+        admin_ids=admin_ids,
+        llm_backend=os.getenv("LLM_BACKEND", "yandex").strip().lower(),
+        llm_url=os.getenv("LLM_URL", "").strip(),
+        yandex_api_key=os.getenv("YANDEX_API_KEY", "").strip(),
+        yandex_folder_id=os.getenv("YANDEX_FOLDER_ID", "").strip(),
+        yandex_model=os.getenv("YANDEX_MODEL", "").strip(),
+        openai_api_key=os.getenv("OPENAI_API_KEY", "").strip(),
+        openai_model=os.getenv("OPENAI_MODEL", "").strip(),
+        llm_timeout=_env_float("LLM_TIMEOUT", 30.0),
+        llm_connect_timeout=_env_float("LLM_CONNECT_TIMEOUT", 5.0),
+        llm_max_connections=_env_int("LLM_MAX_CONNECTIONS", 20),
+        llm_max_keepalive=_env_int("LLM_MAX_KEEPALIVE", 10),
+        llm_http2=_env_bool("LLM_HTTP2", True),
+        analyze_concurrency=_env_int("ANALYZE_CONCURRENCY", 8),
+        analyze_rps=_env_float("ANALYZE_RPS", 10.0),
+        analyze_burst=_env_float("ANALYZE_BURST", 0.0),
+        analyze_retries=_env_int("ANALYZE_RETRIES", 3),
+        analyze_batch_size=_env_int("ANALYZE_BATCH_SIZE", 20),
+        analyze_batch_max_chars=_env_int("ANALYZE_BATCH_MAX_CHARS", 300),
+        analyze_progress_sec=_env_float("ANALYZE_PROGRESS_SEC", 5.0),
+        circuit_failure_threshold=_env_int("CIRCUIT_FAILURE_THRESHOLD", 5),
+        circuit_reset_sec=_env_float("CIRCUIT_RESET_SEC", 30.0),
+        circuit_max_reset_sec=_env_float("CIRCUIT_MAX_RESET_SEC", 300.0),
+        analysis_cache_size=_env_int("ANALYSIS_CACHE_SIZE", 10000),
+        analysis_cache_ttl=_env_float("ANALYSIS_CACHE_TTL", 3600.0),
+        analysis_cache_days=_env_int("ANALYSIS_CACHE_DAYS", 30),
+        prefilter_enabled=_env_bool("PREFILTER_ENABLED", True),
+        prefilter_threshold=_env_float("PREFILTER_THRESHOLD", 0.9),
+        ingest_batch_size=_env_int("INGEST_BATCH_SIZE", 500),
+        ingest_flush_ms=_env_int("INGEST_FLUSH_MS", 200),
+        ingest_queue_size=_env_int("INGEST_QUEUE_SIZE", 10000),
+        identity_cache_size=_env_int("IDENTITY_CACHE_SIZE", 10000),
+        analysis_workers=_env_int("ANALYSIS_WORKERS", 2),
+        analysis_poll_interval=_env_float("ANALYSIS_POLL_INTERVAL", 2.0),
+        analysis_job_batch=_env_int("ANALYSIS_JOB_BATCH", 50),
+        analysis_max_attempts=_env_int("ANALYSIS_MAX_ATTEMPTS", 5),
+        migrate_on_start=_env_bool("MIGRATE_ON_START", True),
+        partitions_ahead=_env_int("PARTITIONS_AHEAD", 2),
+        retention_months=_env_int("RETENTION_MONTHS", 0),
+        retention_mode=os.getenv("RETENTION_MODE", "detach").strip().lower() or "detach",
+        archive_dir=os.getenv("ARCHIVE_DIR", "").strip(),
+        report_hour=_env_int("REPORT_HOUR", 3),
+        report_weekly_day=_env_int("REPORT_WEEKLY_DAY", 0),
+        report_digest=_env_bool("REPORT_DIGEST", True),
+        report_cache_days=_env_int("REPORT_CACHE_DAYS", 30),
+        webhook_url=os.getenv("WEBHOOK_URL", "").strip(),
+        webhook_path=os.getenv("WEBHOOK_PATH", "/webhook").strip() or "/webhook",
+        webhook_secret=os.getenv("WEBHOOK_SECRET", "").strip(),
+        webhook_host=os.getenv("WEBHOOK_HOST", "0.0.0.0").strip() or "0.0.0.0",
+        webhook_port=_env_int("WEBHOOK_PORT", 8080),
+        web_workers=_env_int("WEB_WORKERS", 1),
+        metrics_host=os.getenv("METRICS_HOST", "127.0.0.1").strip() or "127.0.0.1",
+        metrics_port=_env_int("METRICS_PORT", 9108),
+    )
\ No newline at end of file
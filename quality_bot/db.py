@@ -1,4 +1,49 @@
+from contextlib import asynccontextmanager
+
 import asyncpg
 
-async def create_pool(database_url: str) -> asyncpg.Pool:
-    return await asyncpg.create_pool(dsn=database_url, min_size=1, max_size=10)
\ No newline at end of file
+from .config import Config
+
+
+class SingleConnection:
+    # «пул» из одного соединения для методов Repo: всё идёт в транзакции вызывающего
+    # (миграции, EXPLAIN в plancheck с откатом в конце)
+    def __init__(self, con: asyncpg.Connection):
+        self._con = con
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self._con
+
+
+async def create_pool(database_url: str, **kwargs) -> asyncpg.Pool:
+    kwargs.setdefault("min_size", 1)
+    kwargs.setdefault("max_size", 10)
+    return await asyncpg.create_pool(dsn=database_url, **kwargs)
+
+
+async def create_pools(cfg: Config) -> tuple[asyncpg.Pool, asyncpg.Pool]:
+    # (запись, чтение). Пул чтения — к реплике DATABASE_READ_URL или, без неё, отдельные
+    # соединения к основной базе: отчёты не ждут соединений, занятых приёмом сообщений, и наоборот.
+    # command_timeout — таймаут каждого запроса; statement_cache_size=0 — для pgbouncer в режиме transaction
+    writer = await create_pool(
+        cfg.database_url,
+        min_size=cfg.db_pool_min,
+        max_size=cfg.db_pool_max,
+        statement_cache_size=cfg.db_statement_cache_size,
+        command_timeout=cfg.db_command_timeout or None,
+    )
+    try:
+        reader = await create_pool(
+            cfg.database_read_url or cfg.database_url,
+            min_size=cfg.db_read_pool_min,
+            max_size=cfg.db_read_pool_max,
+            statement_cache_size=cfg.db_statement_cache_size,
+            command_timeout=cfg.db_read_command_timeout or None,
+            # случайная запись через пул чтения — ошибка, а не тихая запись в основную базу
+            server_settings={"default_transaction_read_only": "on"},
+        )
+    except BaseException:
+        await writer.close()
+        raise
+    return writer, reader
@@ -0,0 +1,87 @@
+import gzip
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from .repo import Repo
+
+EXPORT_FORMATS = ("csv", "parquet")
+# Bot API не принимает документы больше 50 МБ
+TELEGRAM_FILE_LIMIT = 50 * 1024 * 1024
+
+
+def export_filename(chat_id: int | None, date_from: datetime, date_to: datetime, fmt: str) -> str:
+    last = date_to - timedelta(days=1)
+    scope = f"chat{chat_id}" if chat_id is not None else "all"
+    suffix = "csv.gz" if fmt == "csv" else "parquet"
+    return f"export_{scope}_{date_from:%Y%m%d}_{last:%Y%m%d}.{suffix}"
+
+
+def _parquet_schema(pa):
+    return pa.schema([
+        ("message_id", pa.int64()),
+        ("chat_id", pa.int64()),
+        ("tg_message_id", pa.int64()),
+        ("created_at", pa.timestamp("us", tz="UTC")),
+        ("user_id", pa.int64()),
+        ("tg_user_id", pa.int64()),
+        ("username", pa.string()),
+        ("message_text", pa.string()),
+        ("response_sec", pa.float64()),
+        ("sentiment", pa.string()),
+        ("detected_problem", pa.string()),
+        ("model_version", pa.string()),
+        ("analysis_date", pa.timestamp("us", tz="UTC")),
+    ])
+
+
+async def _export_csv(repo: Repo, path: Path, chat_id, date_from, date_to) -> int:
+    with gzip.open(path, "wb") as f:
+        async def write(chunk: bytes) -> None:
+            f.write(chunk)
+
+        return await repo.copy_export_csv(write, chat_id, date_from, date_to)
+
+
+async def _export_parquet(repo: Repo, path: Path, chat_id, date_from, date_to, chunk_rows: int) -> int:
+    # пакет pyarrow нужен только для parquet
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _parquet_schema(pa)
+    rows = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        # каждая пачка курсора — отдельная row group
+        async for batch in repo.iter_export(chat_id, date_from, date_to, chunk_rows):
+            writer.write_table(pa.Table.from_pylist([dict(r) for r in batch], schema=schema))
+            rows += len(batch)
+    return rows
+
+
+async def export_period(
+    repo: Repo,
+    path: Path,
+    fmt: str,
+    chat_id: int | None,
+    date_from: datetime,
+    date_to: datetime,
+    chunk_rows: int = 10000,
+) -> int:
+    # выгрузка messages ⋈ users ⋈ analysis_results за [date_from, date_to) в сжатый файл:
+    # csv — COPY в csv.gz, parquet — серверный курсор пачками по chunk_rows (zstd).
+    # Память не зависит от размера периода; файл появляется только после полной выгрузки.
+    # Возвращает число строк
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"unknown export format: {fmt}")
+    path = Path(path)
+    tmp = path.with_name(path.name + ".part")
+    try:
+        if fmt == "csv":
+            rows = await _export_csv(repo, tmp, chat_id, date_from, date_to)
+        else:
+            rows = await _export_parquet(repo, tmp, chat_id, date_from, date_to, chunk_rows)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    os.replace(tmp, path)
+    return rows
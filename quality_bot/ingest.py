@@ -0,0 +1,105 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+
+from .metrics import INGEST_DROPPED, INGESTED
+from .repo import Repo
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class IncomingMessage:
+    chat_id: int
+    chat_name: str
+    tg_user_id: int
+    username: str
+    role_name: str
+    tg_message_id: int
+    text: str
+    created_at: datetime | None
+
+
+class IngestBuffer:
+    # write-behind буфер входящих сообщений: хендлер только кладёт сообщение в очередь,
+    # фоновая задача пишет их в БД пачками (не реже flush_interval и не больше max_items за раз).
+    # Очередь ограничена: когда БД не успевает, put() ждёт — это и есть backpressure
+    def __init__(
+        self,
+        repo: Repo,
+        max_items: int = 500,
+        flush_interval: float = 0.2,
+        max_queue: int = 10000,
+        retries: int = 3,
+    ):
+        self.repo = repo
+        self.max_items = max_items
+        self.flush_interval = flush_interval
+        self.retries = retries
+        self._queue: asyncio.Queue[IncomingMessage | None] = asyncio.Queue(maxsize=max_queue)
+        self._task: asyncio.Task | None = None
+        self._closed = False
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def put(self, msg: IncomingMessage) -> None:
+        if self._closed:
+            raise RuntimeError("ingest buffer is closed")
+        await self._queue.put(msg)
+
+    async def stop(self) -> None:
+        # дописываем всё, что уже в очереди, и останавливаем фоновую задачу
+        if self._closed:
+            return
+        self._closed = True
+        if self._task is None:
+            return
+        await self._queue.put(None)
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.max_items:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[IncomingMessage]) -> None:
+        for attempt in range(self.retries + 1):
+            try:
+                await self.repo.ingest_messages(batch)
+                INGESTED.inc(len(batch))
+                break
+            except Exception:
+                if attempt >= self.retries:
+                    logger.exception("ingest flush failed, dropped %d messages", len(batch))
+                    INGEST_DROPPED.inc(len(batch))
+                    return
+                logger.warning("ingest flush failed, retry %d", attempt + 1, exc_info=True)
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+        # время ответа для новых сообщений считается сразу после записи
+        try:
+            await self.repo.update_response_times(sorted({it.chat_id for it in batch}))
+        except Exception:
+            logger.exception("response time update failed")
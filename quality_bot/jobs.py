@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import Message
+
+from .locks import advisory_lock
+from .pipeline import AnalysisPipeline, PipelineStats
+from .repo import Repo
+
+logger = logging.getLogger(__name__)
+
+# запуск, не обновлявший heartbeat дольше стольких отчётов о ходе, считается прерванным
+STALE_INTERVALS = 5
+
+STATUS_RU = {
+    "running": "выполняется",
+    "done": "завершён",
+    "cancelled": "отменён",
+    "interrupted": "прерван",
+    "failed": "ошибка",
+}
+
+
+def _duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} сек"
+    if seconds < 3600:
+        return f"{seconds // 60} мин {seconds % 60} сек"
+    return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+
+
+def progress_text(run_id: int, total: int, stats: PipelineStats) -> str:
+    done = stats.processed
+    elapsed = time.monotonic() - stats.started if stats.started else 0.0
+    rate = done / elapsed if elapsed > 0 else 0.0
+    eta = _duration((total - done) / rate) if rate > 0 and done < total else "—"
+    lines = [
+        f"Анализ #{run_id}: {done}/{total} ({100.0 * done / max(1, total):.0f}%)",
+        f"Проблем: {stats.problems}, ошибок: {stats.failed}",
+        f"Скорость: {rate:.1f} сообщ./сек, осталось ≈ {eta}",
+        f"Отменить: /cancel {run_id}",
+    ]
+    return "\n".join(lines)
+
+
+def runs_text(rows, stale_after: float) -> str:
+    if not rows:
+        return "Запусков анализа не было."
+    lines = []
+    for r in rows:
+        status = r["status"]
+        if status == "running" and float(r["heartbeat_age"]) > stale_after:
+            status = "interrupted"
+        line = (
+            f"#{r['run_id']} {r['chat_name']} — {STATUS_RU.get(status, status)}: "
+            f"{r['processed']}/{r['total']}, проблем {r['problems']}"
+        )
+        if r["status"] == "running" and r["cancel_requested"]:
+            line += " (отмена запрошена)"
+        lines.append(line + f", начат {r['started_at']:%Y-%m-%d %H:%M} UTC")
+    return "\n".join(lines)
+
+
+class AnalyzeJobs:
+    # /analyze в фоне: хендлер сразу отвечает статусным сообщением, запуск идёт отдельной задачей
+    # и раз в progress_interval сек обновляет это сообщение и строку analyze_runs.
+    # Отмена (/cancel) — флаг в analyze_runs: его видит процесс, выполняющий запуск, при следующем
+    # отчёте о ходе; запуск в этом же процессе отменяется сразу
+    def __init__(self, repo: Repo, pipeline: AnalysisPipeline, progress_interval: float = 5.0):
+        self.repo = repo
+        self.pipeline = pipeline
+        self.progress_interval = progress_interval
+        self._tasks: set[asyncio.Task] = set()
+        self._runs: dict[int, asyncio.Task] = {}
+
+    @property
+    def stale_after(self) -> float:
+        return self.progress_interval * STALE_INTERVALS
+
+    def start(
+        self,
+        chat_id: int,
+        started_by: int,
+        status: Message,
+        fetch_rows: Callable[[], Awaitable[tuple[list, str, float | None]]],
+        date_from: datetime | None = None,
+        date_to: datetime | None = None,
+    ) -> asyncio.Task:
+        # fetch_rows -> (сообщения, пояснение к выборке для статуса, доля выборки или None);
+        # вызывается уже под локом чата. Период и доля выборки сохраняются в analyze_runs для /report
+        task = asyncio.create_task(
+            self._run(chat_id, started_by, status, fetch_rows, date_from, date_to)
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def cancel(self, run_id: int) -> bool:
+        # False — запуск не найден или уже завершён
+        if not await self.repo.request_analyze_cancel(run_id):
+            return False
+        task = self._runs.get(run_id)
+        if task is not None:
+            task.cancel()
+        return True
+
+    async def stop(self) -> None:
+        # остановка бота: запуски этого процесса прерываются (status = interrupted)
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _edit(self, status: Message, text: str) -> None:
+        try:
+            await status.edit_text(text)
+        except TelegramAPIError as e:
+            # в т.ч. «message is not modified», если ход не изменился
+            logger.debug("status edit failed: %s", e)
+
+    async def _run(self, chat_id, started_by, status, fetch_rows, date_from, date_to) -> None:
+        try:
+            # один анализ чата за раз на все экземпляры бота
+            async with advisory_lock(self.repo.pool, "analyze", chat_id) as locked:
+                if not locked:
+                    return await self._edit(status, "Анализ этого чата уже выполняется.")
+                # уже проанализированные текущей версией модели сообщения пропускаются
+                rows, note, sample_rate = await fetch_rows()
+                if not rows:
+                    return await self._edit(status, "Нет новых сообщений для анализа.")
+                run_id = await self.repo.create_analyze_run(
+                    chat_id, started_by, len(rows), date_from, date_to, sample_rate
+                )
+                await self._execute(run_id, chat_id, status, rows, note)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("analyze run failed for chat_id=%s", chat_id)
+            await self._edit(status, "Ошибка при анализе. Проверьте логи.")
+
+    async def _execute(self, run_id: int, chat_id: int, status: Message, rows: list, note: str) -> None:
+        total = len(rows)
+        stats = PipelineStats(chat_id=chat_id)
+        run = asyncio.create_task(self.pipeline.run(rows, stats))
+        self._runs[run_id] = run
+        outcome = "failed"
+        try:
+            await self._edit(status, note + progress_text(run_id, total, stats))
+            while True:
+                done, _ = await asyncio.wait({run}, timeout=self.progress_interval)
+                if done:
+                    break
+                if await self.repo.update_analyze_run(run_id, stats.processed, stats.problems, stats.failed):
+                    run.cancel()
+                    continue
+                await self._edit(status, note + progress_text(run_id, total, stats))
+            try:
+                await run
+                outcome = "done"
+            except asyncio.CancelledError:
+                # отменён запуск (/cancel), а не эта задача
+                outcome = "cancelled"
+        except asyncio.CancelledError:
+            # остановка бота
+            outcome = "interrupted"
+            raise
+        finally:
+            if not run.done():
+                # остановка бота или ошибка отчёта о ходе (БД, Telegram): анализ не должен
+                # продолжаться после того, как _run отпустит лок чата
+                run.cancel()
+                await asyncio.gather(run, return_exceptions=True)
+            self._runs.pop(run_id, None)
+            await asyncio.shield(self._finish(run_id, status, total, stats, outcome, note))
+
+    async def _finish(
+        self, run_id: int, status: Message, total: int, stats: PipelineStats, outcome: str, note: str
+    ) -> None:
+        stats.elapsed = time.monotonic() - stats.started if stats.started else 0.0
+        try:
+            await self.repo.finish_analyze_run(run_id, outcome, stats.processed, stats.problems, stats.failed)
+            # неразобранные (ошибка LLM или открытая цепь) дорабатывают фоновые воркеры;
+            # не дошедшие до анализа при отмене сообщения остаются в очереди с приёма
+            retry_in = self.pipeline.breaker.retry_after if self.pipeline.breaker is not None else 0
+            await self.repo.defer_analysis(stats.failed_ids + stats.deferred_ids, "analyze command failed", retry_in)
+        except Exception:
+            logger.exception("finishing analyze run %s failed", run_id)
+        if outcome == "done":
+            text = f"Анализ #{run_id}\n{note}{stats.summary()}"
+        else:
+            text = (
+                f"Анализ #{run_id} {STATUS_RU[outcome]}: обработано {stats.processed} из {total}, "
+                f"проблем {stats.problems}."
+            )
+        await self._edit(status, text)
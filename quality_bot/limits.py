@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Callable
+
+from .backends import AnalyzerError
+from .metrics import LLM_CIRCUIT_REJECTED, LLM_CIRCUIT_STATE
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    # rate запросов в секунду в среднем и не больше burst подряд; rate <= 0 — без ограничения.
+    # Ожидающие обслуживаются по очереди. pause() — общий стоп для всех (429 с Retry-After)
+    def __init__(self, rate: float, burst: float | None = None, clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = max(1.0, burst if burst else rate)
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = self._clock()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        now = self._clock()
+        self._refill(now)
+        self._tokens = 0.0
+        self._paused_until = max(self._paused_until, now + seconds)
+
+
+class FairScheduler:
+    # slots одновременных запросов к LLM на все запуски процесса. Когда слотов не хватает,
+    # освободившийся слот получает следующий по кругу ключ (чат запуска), а не тот, кто раньше
+    # встал в очередь: большой чат не занимает все слоты, пока ждут другие
+    def __init__(self, slots: int):
+        self.slots = max(1, slots)
+        self._busy = 0
+        self._waiters: dict[object, deque[asyncio.Future]] = {}
+        self._order: deque = deque()  # ключи с ожидающими, по кругу
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._waiters.values())
+
+    @asynccontextmanager
+    async def slot(self, key: object = None):
+        await self._acquire(key)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, key: object) -> None:
+        if self._busy < self.slots and not self._order:
+            self._busy += 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        queue = self._waiters.get(key)
+        if queue is None:
+            queue = self._waiters[key] = deque()
+            self._order.append(key)
+        queue.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # слот уже передан этой задаче — отдаём следующему
+                self._release()
+            else:
+                self._discard(key, fut)
+            raise
+
+    def _discard(self, key: object, fut: asyncio.Future) -> None:
+        # отменённое ожидание могло быть уже снято с очереди в _release (future отменён до выдачи слота)
+        queue = self._waiters.get(key)
+        if queue is None or fut not in queue:
+            return
+        queue.remove(fut)
+        if not queue:
+            del self._waiters[key]
+            if key in self._order:
+                self._order.remove(key)
+
+    def _release(self) -> None:
+        # слот переходит первому ожидающему следующего ключа, счётчик занятых не меняется
+        while self._order:
+            key = self._order.popleft()
+            queue = self._waiters[key]
+            fut = queue.popleft()
+            if queue:
+                self._order.append(key)
+            else:
+                del self._waiters[key]
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._busy -= 1
+
+
+class CircuitOpenError(AnalyzerError):
+    # запрос не отправлялся: LLM считается недоступным ещё retry_after секунд
+    def __init__(self, retry_after: float):
+        super().__init__(f"LLM circuit open, retry in {retry_after:.0f}s", retry_after=retry_after, retryable=False)
+
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    # после failure_threshold сбоев подряд (сеть, 5xx, 429) запросы не отправляются reset_timeout сек,
+    # затем пропускается один пробный запрос (half-open): успех закрывает цепь, сбой снова открывает
+    # её с удвоенным таймаутом (не больше max_reset_timeout)
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        max_reset_timeout: float = 300.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max(reset_timeout, max_reset_timeout)
+        self._clock = clock
+        self._state = CLOSED
+        self._failures = 0
+        self._timeout = reset_timeout
+        self._opened_until = 0.0
+        self._probe_in_flight = False
+        LLM_CIRCUIT_STATE.set(_STATE_VALUES[CLOSED])
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and self._clock() >= self._opened_until:
+            return HALF_OPEN
+        return self._state
+
+    @property
+    def retry_after(self) -> float:
+        return max(0.0, self._opened_until - self._clock())
+
+    def available(self) -> bool:
+        # можно ли сейчас отправить запрос (закрыта или пора пробовать)
+        return self.state == CLOSED or (self.state == HALF_OPEN and not self._probe_in_flight)
+
+    def _set_state(self, state: str) -> None:
+        if state != self._state:
+            logger.warning("LLM circuit %s -> %s", self._state, state)
+        self._state = state
+        LLM_CIRCUIT_STATE.set(_STATE_VALUES[state])
+
+    def before_call(self) -> bool:
+        # бросает CircuitOpenError, если запрос отправлять нельзя;
+        # True — этот вызов и есть пробный запрос (half-open)
+        if self._state == CLOSED:
+            return False
+        if self._state == OPEN:
+            if self._clock() < self._opened_until:
+                LLM_CIRCUIT_REJECTED.inc()
+                raise CircuitOpenError(self.retry_after)
+            self._set_state(HALF_OPEN)
+        if self._probe_in_flight:
+            LLM_CIRCUIT_REJECTED.inc()
+            raise CircuitOpenError(self.reset_timeout)
+        self._probe_in_flight = True
+        return True
+
+    def on_success(self) -> None:
+        # в том числе ответы с ошибкой клиента (4xx, неразборчивый JSON): сервис отвечает
+        self._failures = 0
+        self._probe_in_flight = False
+        if self._state != CLOSED:
+            self._timeout = self.reset_timeout
+            self._set_state(CLOSED)
+
+    def release(self) -> None:
+        # пробный запрос прерван без результата (отмена задачи): пробовать можно снова
+        self._probe_in_flight = False
+
+    def on_failure(self) -> None:
+        self._failures += 1
+        probe_failed = self._state == HALF_OPEN
+        self._probe_in_flight = False
+        if probe_failed:
+            self._timeout = min(self._timeout * 2, self.max_reset_timeout)
+        if probe_failed or (self._state == CLOSED and self._failures >= self.failure_threshold):
+            self._opened_until = self._clock() + self._timeout
+            self._set_state(OPEN)
@@ -0,0 +1,55 @@
+import hashlib
+import logging
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+
+def lock_key(namespace: str, key: object = "") -> int:
+    # ключ advisory-лока (bigint) из имени и параметра: ("analyze", chat_id), ("job", "reports") и т.п.
+    digest = hashlib.blake2b(f"quality_bot:{namespace}:{key}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+@asynccontextmanager
+async def advisory_lock(pool: asyncpg.Pool, namespace: str, key: object = ""):
+    # сессионный pg_try_advisory_lock на отдельном соединении пула, которое занято до выхода из блока;
+    # отдаёт True, если лок взят, и False, если его держит другой процесс или экземпляр бота.
+    # При обрыве соединения Postgres снимает лок сам
+    k = lock_key(namespace, key)
+    async with pool.acquire() as con:
+        locked = await con.fetchval("SELECT pg_try_advisory_lock($1)", k)
+        try:
+            yield locked
+        finally:
+            if locked:
+                await con.execute("SELECT pg_advisory_unlock($1)", k)
+
+
+async def run_exclusive(
+    pool: asyncpg.Pool, job: str, run_key: str, fn: Callable[[], Awaitable[object]]
+) -> bool:
+    # запуск задачи по расписанию ровно одним экземпляром: лок не даёт выполнять её одновременно,
+    # а запись в scheduled_runs — повторно тем экземплярам, чьи часы сработали позже.
+    # Возвращает True, если задача выполнена этим процессом
+    async with advisory_lock(pool, "job", job) as locked:
+        if not locked:
+            logger.info("job %s/%s is running elsewhere, skipped", job, run_key)
+            return False
+        async with pool.acquire() as con:
+            done = await con.fetchval(
+                "SELECT 1 FROM public.scheduled_runs WHERE job = $1 AND run_key = $2", job, run_key
+            )
+        if done:
+            logger.info("job %s/%s already done", job, run_key)
+            return False
+        await fn()
+        async with pool.acquire() as con:
+            await con.execute(
+                "INSERT INTO public.scheduled_runs(job, run_key) VALUES ($1, $2) ON CONFLICT DO NOTHING",
+                job, run_key,
+            )
+        return True
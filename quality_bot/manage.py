@@ -0,0 +1,135 @@
+import argparse
+import asyncio
+import logging
+
+from dotenv import load_dotenv
+
+from . import partitions
+from .config import Config, load_config
+from .db import create_pool
+from .export import EXPORT_FORMATS, export_filename, export_period
+from .reports import ReportScheduler
+from .repo import Repo, date_range_from_args
+
+logger = logging.getLogger(__name__)
+
+
+async def cmd_rebuild_rollups(repo: Repo, args: argparse.Namespace, cfg: Config) -> None:
+    rows = await repo.rebuild_rollups(args.chat_id)
+    logger.info("rollups rebuilt: %d rows", rows)
+
+
+async def cmd_rebuild_response_times(repo: Repo, args: argparse.Namespace, cfg: Config) -> None:
+    await repo.rebuild_response_times(args.chat_id)
+    logger.info("response times rebuilt")
+
+
+async def cmd_partitions(repo: Repo, args: argparse.Namespace, cfg: Config) -> None:
+    # создать секции вперёд и применить срок хранения (удобно запускать из cron раз в сутки)
+    ahead = cfg.partitions_ahead if args.ahead is None else args.ahead
+    retention = cfg.retention_months if args.retention_months is None else args.retention_months
+    mode = args.mode or cfg.retention_mode
+    export_dir = cfg.archive_dir if args.export_dir is None else args.export_dir
+
+    if not args.dry_run:
+        created = await partitions.ensure_partitions(repo.pool, ahead, args.back)
+        logger.info("partitions ensured: %s", ", ".join(created))
+    months = await partitions.apply_retention(repo.pool, retention, mode, export_dir, args.dry_run)
+    verb = "would " + mode if args.dry_run else mode
+    for month in months:
+        logger.info("%s %s", verb, month.strftime("%Y-%m"))
+    if not months:
+        logger.info("nothing to %s (retention: %s months)", mode, retention or "unlimited")
+
+
+async def cmd_precompute_reports(repo: Repo, args: argparse.Namespace, cfg: Config) -> None:
+    # то же, что ежедневный запуск планировщика в боте, но без рассылки дайджестов
+    scheduler = ReportScheduler(
+        repo, None, set(), digest=False, keep_days=cfg.report_cache_days, cache_days=cfg.analysis_cache_days
+    )
+    chats = await scheduler.run_once()
+    logger.info("reports precomputed for %d chat(s)", chats)
+
+
+async def cmd_export(repo: Repo, args: argparse.Namespace, cfg: Config) -> None:
+    start, end = date_range_from_args(args.date_from, args.date_to)
+    out = args.out or export_filename(args.chat_id, start, end, args.format)
+    rows = await export_period(repo, out, args.format, args.chat_id, start, end, args.chunk_rows)
+    logger.info("exported %d rows to %s", rows, out)
+
+
+async def cmd_failed_jobs(repo: Repo, args: argparse.Namespace, cfg: Config) -> None:
+    # задачи analysis_queue, исчерпавшие ANALYSIS_MAX_ATTEMPTS: показать, вернуть в работу или удалить
+    if args.requeue:
+        logger.info("requeued %d failed analysis job(s)", await repo.requeue_failed_analysis_jobs(args.chat_id))
+    elif args.purge:
+        logger.info("purged %d failed analysis job(s)", await repo.purge_failed_analysis_jobs(args.chat_id))
+    else:
+        rows = await repo.failed_analysis_jobs_summary(args.chat_id)
+        for r in rows:
+            logger.info(
+                "%d job(s), %s .. %s: %s",
+                r["cnt"], r["first_failed"].strftime("%Y-%m-%d %H:%M"), r["last_failed"].strftime("%Y-%m-%d %H:%M"),
+                r["last_error"] or "-",
+            )
+        if not rows:
+            logger.info("no failed analysis jobs")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m quality_bot.manage")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("rebuild-rollups", help="пересчитать analysis_rollup_daily из analysis_results")
+    p.add_argument("--chat-id", type=int, default=None, help="только для одного чата")
+    p.set_defaults(func=cmd_rebuild_rollups)
+
+    p = sub.add_parser("rebuild-response-times", help="пересчитать время ответа и дневные гистограммы")
+    p.add_argument("--chat-id", type=int, default=None, help="только для одного чата")
+    p.set_defaults(func=cmd_rebuild_response_times)
+
+    p = sub.add_parser("partitions", help="создать месячные секции и применить срок хранения")
+    p.add_argument("--ahead", type=int, default=None, help="месяцев вперёд (PARTITIONS_AHEAD)")
+    p.add_argument("--back", type=int, default=0, help="создать секции и на столько месяцев назад")
+    p.add_argument("--retention-months", type=int, default=None, help="хранить месяцев (RETENTION_MONTHS, 0 — всё)")
+    p.add_argument("--mode", choices=["detach", "drop"], default=None, help="RETENTION_MODE")
+    p.add_argument("--export-dir", default=None, help="выгрузить секции в csv.gz перед удалением (ARCHIVE_DIR)")
+    p.add_argument("--dry-run", action="store_true", help="только показать, какие месяцы будут удалены")
+    p.set_defaults(func=cmd_partitions)
+
+    p = sub.add_parser("export", help="выгрузить сообщения и результаты анализа за период в csv.gz/parquet")
+    p.add_argument("date_from", help="YYYY-MM-DD")
+    p.add_argument("date_to", help="YYYY-MM-DD (включительно)")
+    p.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    p.add_argument("--chat-id", type=int, default=None, help="только один чат (по умолчанию все)")
+    p.add_argument("--out", default=None, help="путь к файлу (по умолчанию export_<чат>_<период>.<формат>)")
+    p.add_argument("--chunk-rows", type=int, default=10000, help="строк в пачке курсора для parquet")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser("failed-jobs", help="задачи анализа, исчерпавшие ANALYSIS_MAX_ATTEMPTS")
+    p.add_argument("--chat-id", type=int, default=None, help="только для одного чата")
+    action = p.add_mutually_exclusive_group()
+    action.add_argument("--requeue", action="store_true", help="вернуть в очередь с нуля попыток")
+    action.add_argument("--purge", action="store_true", help="удалить из очереди")
+    p.set_defaults(func=cmd_failed_jobs)
+
+    p = sub.add_parser("precompute-reports", help="посчитать отчёты за вчера и за неделю в report_cache")
+    p.set_defaults(func=cmd_precompute_reports)
+
+    return parser
+
+
+async def main(argv: list[str] | None = None):
+    args = build_parser().parse_args(argv)
+    cfg = load_config(require_bot_token=False)
+    pool = await create_pool(cfg.database_url)
+    try:
+        await args.func(Repo(pool), args, cfg)
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    asyncio.run(main())
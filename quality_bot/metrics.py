@@ -0,0 +1,112 @@
+import functools
+import logging
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import Any, Awaitable, Callable
+
+import asyncpg
+from aiogram import BaseMiddleware
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+# границы подобраны под запросы к БД (доли мс) и к LLM (секунды)
+FAST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SLOW_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+
+LLM_LATENCY = Histogram(
+    "quality_bot_llm_request_seconds", "Длительность запроса к LLM", ["kind"], buckets=SLOW_BUCKETS
+)
+LLM_ERRORS = Counter(
+    "quality_bot_llm_errors_total", "Ошибки LLM по HTTP-статусу (network — сеть/таймаут)", ["status"]
+)
+DB_LATENCY = Histogram(
+    "quality_bot_db_method_seconds", "Длительность методов Repo (вместе с ожиданием пула)", ["method"],
+    buckets=FAST_BUCKETS,
+)
+POOL_WAIT = Histogram(
+    "quality_bot_db_pool_wait_seconds", "Ожидание свободного соединения asyncpg", ["pool"], buckets=FAST_BUCKETS
+)
+POOL_IN_USE = Gauge("quality_bot_db_pool_in_use", "Занятые соединения пула", ["pool"])
+POOL_SIZE = Gauge("quality_bot_db_pool_size", "Открытые соединения пула", ["pool"])
+POOL_MAX_SIZE = Gauge("quality_bot_db_pool_max_size", "Максимальный размер пула", ["pool"])
+# имя пула (writer/reader) для метки; пулы, не переданные в bind_pool, считаются writer
+_POOL_NAMES: dict[int, str] = {}
+HANDLER_LATENCY = Histogram(
+    "quality_bot_handler_seconds", "Длительность хендлеров aiogram", ["handler"], buckets=FAST_BUCKETS
+)
+LLM_CIRCUIT_STATE = Gauge(
+    "quality_bot_llm_circuit_state", "Состояние circuit breaker LLM: 0 closed, 1 half-open, 2 open"
+)
+LLM_CIRCUIT_REJECTED = Counter(
+    "quality_bot_llm_circuit_rejected_total", "Запросы к LLM, не отправленные из-за открытой цепи"
+)
+INGESTED = Counter("quality_bot_ingested_messages_total", "Сообщения, записанные в БД")
+INGEST_DROPPED = Counter("quality_bot_ingest_dropped_messages_total", "Сообщения, потерянные после повторов")
+ANALYSIS_JOBS_FAILED = Gauge(
+    "quality_bot_analysis_jobs_failed", "Задачи analysis_queue, исчерпавшие ANALYSIS_MAX_ATTEMPTS"
+)
+ANALYSIS_OUTCOMES = Counter(
+    "quality_bot_analysis_results_total", "Сохранённые результаты анализа по detected_problem", ["problem"]
+)
+
+
+def observe_db(fn: Callable[..., Awaitable]):
+    # декоратор для методов Repo: время метода целиком, метка — имя метода
+    hist = DB_LATENCY.labels(fn.__name__)
+
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        t0 = perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            hist.observe(perf_counter() - t0)
+
+    return wrapper
+
+
+@asynccontextmanager
+async def acquire(pool: asyncpg.Pool):
+    # pool.acquire() с замером ожидания соединения
+    t0 = perf_counter()
+    async with pool.acquire() as con:
+        POOL_WAIT.labels(_POOL_NAMES.get(id(pool), "writer")).observe(perf_counter() - t0)
+        yield con
+
+
+def bind_pool(pool: asyncpg.Pool, name: str = "writer") -> None:
+    # значения снимаются в момент запроса /metrics
+    _POOL_NAMES[id(pool)] = name
+    POOL_IN_USE.labels(name).set_function(lambda: pool.get_size() - pool.get_idle_size())
+    POOL_SIZE.labels(name).set_function(pool.get_size)
+    POOL_MAX_SIZE.labels(name).set_function(pool.get_max_size)
+
+
+def llm_error_label(status_code: int | None) -> str:
+    return str(status_code) if status_code is not None else "network"
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    # inner-middleware: вызывается только для сработавшего хендлера, метка — имя функции
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: dict[str, Any],
+    ) -> Any:
+        handler_obj = data.get("handler")
+        name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+        t0 = perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            HANDLER_LATENCY.labels(name).observe(perf_counter() - t0)
+
+
+def start_metrics_server(host: str, port: int) -> None:
+    # /metrics в отдельном потоке prometheus_client; port=0 — выключено
+    if port <= 0:
+        return
+    start_http_server(port, addr=host)
+    logger.info("metrics on http://%s:%d/metrics", host, port)
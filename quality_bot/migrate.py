@@ -0,0 +1,187 @@
+import argparse
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+import asyncpg
+from dotenv import load_dotenv
+
+from .config import load_config
+from .db import create_pool
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "sql" / "migrations"
+# один мигратор на базу: бот, воркеры и ручной запуск могут стартовать одновременно
+LOCK_KEY = 7_340_115_001
+
+_NAME_RE = re.compile(r"^(?P<version>\d{4})_(?P<name>\w+)\.(?P<kind>sql|py)$")
+# первая строка SQL-миграции, которую нельзя выполнять в транзакции (CREATE INDEX CONCURRENTLY);
+# такой файл должен содержать один оператор — несколько операторов Postgres всё равно выполнит в транзакции
+NO_TRANSACTION = "-- migrate: no-transaction"
+
+SCHEMA_VERSION_DDL = """
+CREATE TABLE IF NOT EXISTS public.schema_version (
+  version    INT PRIMARY KEY,
+  name       TEXT NOT NULL,
+  checksum   TEXT NOT NULL,
+  applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+)
+"""
+
+
+@dataclass(frozen=True)
+class Migration:
+    # sql/migrations/NNNN_name.sql — SQL-скрипт; NNNN_name.py — модуль с async def upgrade(con)
+    version: int
+    name: str
+    path: Path
+
+    @property
+    def checksum(self) -> str:
+        return hashlib.sha256(self.path.read_bytes()).hexdigest()
+
+    @property
+    def transactional(self) -> bool:
+        if self.path.suffix != ".sql":
+            return True
+        return not self.path.read_text(encoding="utf-8").lstrip().startswith(NO_TRANSACTION)
+
+    async def apply(self, con: asyncpg.Connection) -> None:
+        if self.path.suffix == ".sql":
+            await con.execute(self.path.read_text(encoding="utf-8"))
+            return
+        spec = importlib.util.spec_from_file_location(f"quality_bot_migration_{self.version:04d}", self.path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        await module.upgrade(con)
+
+
+def discover(directory: Path = MIGRATIONS_DIR) -> list[Migration]:
+    migrations = {}
+    for path in sorted(directory.iterdir()):
+        m = _NAME_RE.match(path.name)
+        if not m:
+            continue
+        version = int(m["version"])
+        if version in migrations:
+            raise RuntimeError(f"duplicate migration version {version}: {path.name}")
+        migrations[version] = Migration(version, m["name"], path)
+    return [migrations[v] for v in sorted(migrations)]
+
+
+async def applied_versions(con: asyncpg.Connection) -> dict[int, str]:
+    await con.execute(SCHEMA_VERSION_DDL)
+    rows = await con.fetch("SELECT version, checksum FROM public.schema_version")
+    return {int(r["version"]): r["checksum"] for r in rows}
+
+
+async def migrate(pool: asyncpg.Pool, target: int | None = None, directory: Path = MIGRATIONS_DIR) -> list[Migration]:
+    # применяет недостающие миграции по порядку, каждую в своей транзакции вместе с записью
+    # в schema_version; возвращает применённые
+    done = []
+    async with pool.acquire() as con:
+        await con.execute("SELECT pg_advisory_lock($1)", LOCK_KEY)
+        try:
+            applied = await applied_versions(con)
+            for m in discover(directory):
+                if target is not None and m.version > target:
+                    break
+                if m.version in applied:
+                    if applied[m.version] != m.checksum:
+                        logger.warning("migration %04d_%s changed after it was applied", m.version, m.name)
+                    continue
+                logger.info("applying migration %04d_%s", m.version, m.name)
+                record = (
+                    "INSERT INTO public.schema_version(version, name, checksum) VALUES ($1, $2, $3)",
+                    m.version, m.name, m.checksum,
+                )
+                if m.transactional:
+                    async with con.transaction():
+                        await m.apply(con)
+                        await con.execute(*record)
+                else:
+                    await m.apply(con)
+                    await con.execute(*record)
+                done.append(m)
+        finally:
+            await con.execute("SELECT pg_advisory_unlock($1)", LOCK_KEY)
+    return done
+
+
+async def cmd_up(pool: asyncpg.Pool, args: argparse.Namespace) -> int:
+    done = await migrate(pool, args.target)
+    logger.info("applied %d migration(s)", len(done))
+    return 0
+
+
+async def cmd_status(pool: asyncpg.Pool, args: argparse.Namespace) -> int:
+    async with pool.acquire() as con:
+        applied = await applied_versions(con)
+    for m in discover():
+        if m.version not in applied:
+            state = "pending"
+        elif applied[m.version] != m.checksum:
+            state = "applied (changed)"
+        else:
+            state = "applied"
+        print(f"{m.version:04d}  {m.name:<30} {state}")
+    return 0
+
+
+async def cmd_check_plans(pool: asyncpg.Pool, args: argparse.Namespace) -> int:
+    from .plancheck import check_plans
+
+    problems = await check_plans(
+        pool, messages=args.messages, chats=args.chats, days=args.days, min_rows=args.min_rows
+    )
+    for method, relation, rows in problems:
+        print(f"FAIL {method}: Seq Scan on {relation} (~{rows:.0f} rows)")
+    if not problems:
+        print("OK: no seq scans on large tables")
+    return 1 if problems else 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m quality_bot.migrate")
+    sub = parser.add_subparsers(dest="command")
+    parser.set_defaults(func=cmd_up, target=None)
+
+    p = sub.add_parser("up", help="применить недостающие миграции (по умолчанию)")
+    p.add_argument("--target", type=int, default=None, help="остановиться на этой версии")
+    p.set_defaults(func=cmd_up)
+
+    p = sub.add_parser("status", help="список миграций и их состояние")
+    p.set_defaults(func=cmd_status)
+
+    p = sub.add_parser(
+        "check-plans",
+        help="EXPLAIN горячих запросов Repo на синтетических данных; ошибка при Seq Scan по большим таблицам",
+    )
+    p.add_argument("--messages", type=int, default=50000)
+    p.add_argument("--chats", type=int, default=20)
+    p.add_argument("--days", type=int, default=60)
+    p.add_argument("--min-rows", type=int, default=5000, help="таблица считается большой от стольких строк")
+    p.set_defaults(func=cmd_check_plans)
+
+    return parser
+
+
+async def main(argv: list[str] | None = None) -> int:
+    args = build_parser().parse_args(argv)
+    cfg = load_config(require_bot_token=False)
+    pool = await create_pool(cfg.database_url)
+    try:
+        return await args.func(pool, args)
+    finally:
+        await pool.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    raise SystemExit(asyncio.run(main()))
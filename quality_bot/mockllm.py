@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import random
+from dataclasses import dataclass
+
+from aiohttp import web
+
+from .analyzer import PROBLEMS, SENTIMENTS
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class MockSettings:
+    latency: float = 0.3  # средняя задержка ответа, сек
+    jitter: float = 0.1  # разброс задержки, сек
+    error_rate: float = 0.0  # доля ответов 500
+    rate_limit_rate: float = 0.0  # доля ответов 429
+    retry_after: float = 1.0
+    problem_rate: float = 0.1  # доля «проблемных» сообщений в ответах
+
+
+def _verdict(text: str, problem_rate: float) -> dict:
+    # детерминированный ответ по хэшу текста: одинаковый текст — одинаковый результат
+    h = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    if (h % 10000) / 10000 < problem_rate:
+        problem = PROBLEMS[1 + (h >> 16) % (len(PROBLEMS) - 1)]
+        sentiment = "negative"
+    else:
+        problem = "ok"
+        sentiment = SENTIMENTS[(h >> 16) % len(SENTIMENTS)]
+    return {"sentiment": sentiment, "problem": problem}
+
+
+def create_app(settings: MockSettings) -> web.Application:
+    # локальная замена OpenAI-совместимого chat-completions endpoint для нагрузочных тестов
+    stats = {"requests": 0, "errors": 0, "rate_limited": 0}
+
+    async def completions(request: web.Request) -> web.Response:
+        stats["requests"] += 1
+        payload = await request.json()
+        await asyncio.sleep(max(0.0, random.gauss(settings.latency, settings.jitter)))
+
+        roll = random.random()
+        if roll < settings.rate_limit_rate:
+            stats["rate_limited"] += 1
+            return web.json_response(
+                {"error": "rate limited"}, status=429, headers={"Retry-After": str(settings.retry_after)}
+            )
+        if roll < settings.rate_limit_rate + settings.error_rate:
+            stats["errors"] += 1
+            return web.json_response({"error": "internal"}, status=500)
+
+        user = payload["messages"][-1]["content"]
+        try:
+            items = json.loads(user)
+        except ValueError:
+            items = None
+        if isinstance(items, list):
+            content = {"results": [{"id": it["id"], **_verdict(it["text"], settings.problem_rate)} for it in items]}
+        else:
+            content = _verdict(user, settings.problem_rate)
+
+        return web.json_response({
+            "id": f"mock-{stats['requests']}",
+            "object": "chat.completion",
+            "model": payload.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": json.dumps(content, ensure_ascii=False)},
+            }],
+        })
+
+    async def get_stats(request: web.Request) -> web.Response:
+        return web.json_response(stats)
+
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_post("/v1/chat/completions", completions)
+    app.router.add_post("/chat/completions", completions)
+    app.router.add_get("/stats", get_stats)
+    return app
+
+
+async def start_server(settings: MockSettings, host: str = "127.0.0.1", port: int = 0) -> tuple[web.AppRunner, str]:
+    # возвращает runner и базовый URL (port=0 — свободный порт)
+    runner = web.AppRunner(create_app(settings), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    actual_port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{actual_port}/v1"
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m quality_bot.mockllm")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--problem-rate", type=float, default=0.1)
+    return parser
+
+
+def settings_from_args(args: argparse.Namespace) -> MockSettings:
+    return MockSettings(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        problem_rate=args.problem_rate,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = build_parser().parse_args()
+    web.run_app(create_app(settings_from_args(args)), host=args.host, port=args.port)
@@ -0,0 +1,262 @@
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import date, datetime, timezone
+from pathlib import Path
+
+import asyncpg
+
+from .locks import lock_key
+
+logger = logging.getLogger(__name__)
+
+# секционированные таблицы; у analysis_results секции совпадают с секциями messages
+PARENTS = ("messages", "analysis_results")
+BASELINE_SQL = Path(__file__).resolve().parent.parent / "sql" / "migrations" / "0001_init.sql"
+
+_PART_RE = re.compile(r"^(?P<parent>\w+)_p(?P<year>\d{4})(?P<month>\d{2})$")
+
+
+def month_start(d: date) -> date:
+    return date(d.year, d.month, 1)
+
+
+def add_months(d: date, n: int) -> date:
+    y, m = divmod(d.month - 1 + n, 12)
+    return date(d.year + y, m + 1, 1)
+
+
+def month_ts(month: date) -> datetime:
+    # граница секции: полночь первого дня месяца по UTC
+    return datetime(month.year, month.month, 1, tzinfo=timezone.utc)
+
+
+def _today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+async def is_partitioned(con: asyncpg.Connection, table: str = "messages") -> bool:
+    kind = await con.fetchval(
+        "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE n.nspname = 'public' AND c.relname = $1",
+        table,
+    )
+    return kind == "p"
+
+
+async def ensure_partitions(pool: asyncpg.Pool, months_ahead: int = 2, months_back: int = 0) -> list[str]:
+    # секции с months_back месяцев назад по months_ahead вперёд (уже существующие пропускаются).
+    # Несколько экземпляров бота создают секции по очереди: CREATE TABLE IF NOT EXISTS
+    # при одновременном вызове может упасть на уже созданной соседом таблице
+    current = month_start(_today())
+    months = [add_months(current, i) for i in range(-months_back, months_ahead + 1)]
+    q = """
+    SELECT public.create_month_partition(p, m)
+    FROM unnest($1::date[]) AS m, unnest($2::text[]) AS p
+    ORDER BY m, p
+    """
+    async with pool.acquire() as con:
+        async with con.transaction():
+            await con.execute("SELECT pg_advisory_xact_lock($1)", lock_key("partitions"))
+            rows = await con.fetch(q, months, list(PARENTS))
+    return [r[0] for r in rows]
+
+
+async def run_partition_maintenance(
+    pool: asyncpg.Pool, months_ahead: int, stop: asyncio.Event, interval: float = 12 * 3600
+) -> None:
+    # фоновая задача бота: секции следующих месяцев создаются заранее, до первой записи в них.
+    # Удаление старых секций — только явно: python -m quality_bot.manage partitions
+    while not stop.is_set():
+        try:
+            await ensure_partitions(pool, months_ahead)
+        except Exception:
+            logger.exception("partition maintenance failed")
+        try:
+            await asyncio.wait_for(stop.wait(), interval)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def list_partitions(con: asyncpg.Connection, parent: str) -> dict[date, str]:
+    # присоединённые месячные секции: {первый день месяца: имя}
+    rows = await con.fetch(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = ('public.' || $1)::regclass",
+        parent,
+    )
+    out = {}
+    for r in rows:
+        m = _PART_RE.match(r["relname"])
+        if m and m["parent"] == parent:
+            out[date(int(m["year"]), int(m["month"]), 1)] = r["relname"]
+    return out
+
+
+async def export_table(con: asyncpg.Connection, table: str, export_dir: str) -> Path:
+    # COPY секции в <export_dir>/<table>.csv.gz; файл появляется только после полной выгрузки
+    Path(export_dir).mkdir(parents=True, exist_ok=True)
+    path = Path(export_dir) / f"{table}.csv.gz"
+    tmp = path.with_suffix(".gz.part")
+    with gzip.open(tmp, "wb") as f:
+        async def write(chunk: bytes) -> None:
+            f.write(chunk)
+
+        await con.copy_from_table(table, schema_name="public", output=write, format="csv", header=True)
+    os.replace(tmp, path)
+    return path
+
+
+async def apply_retention(
+    pool: asyncpg.Pool,
+    retention_months: int,
+    mode: str = "detach",
+    export_dir: str = "",
+    dry_run: bool = False,
+) -> list[date]:
+    # месяцы, целиком старше retention_months полных месяцев до текущего, отсоединяются
+    # (detach — таблица остаётся в БД) или удаляются (drop). Дневные агрегаты отчётов не трогаем
+    if retention_months <= 0:
+        return []
+    if mode not in ("detach", "drop"):
+        raise ValueError(f"unknown retention mode: {mode}")
+    cutoff = add_months(month_start(_today()), -retention_months)
+
+    async with pool.acquire() as con:
+        messages = await list_partitions(con, "messages")
+        results = await list_partitions(con, "analysis_results")
+        months = sorted(m for m in messages if add_months(m, 1) <= cutoff)
+        if dry_run:
+            return months
+
+        for month in months:
+            m_part = messages[month]
+            ar_part = results.get(month)
+            if export_dir:
+                for table in (m_part, ar_part):
+                    if table:
+                        path = await export_table(con, table, export_dir)
+                        logger.info("exported %s -> %s", table, path)
+
+            async with con.transaction():
+                # ссылки на секцию messages должны исчезнуть до её отсоединения
+                await con.execute(
+                    "DELETE FROM public.analysis_queue WHERE created_at >= $1 AND created_at < $2",
+                    month_ts(month),
+                    month_ts(add_months(month, 1)),
+                )
+                if ar_part:
+                    await con.execute(f'ALTER TABLE public.analysis_results DETACH PARTITION public."{ar_part}"')
+                    await con.execute(
+                        f'ALTER TABLE public."{ar_part}" DROP CONSTRAINT IF EXISTS fk_analysis_results_message'
+                    )
+                await con.execute(f'ALTER TABLE public.messages DETACH PARTITION public."{m_part}"')
+                if mode == "drop":
+                    if ar_part:
+                        await con.execute(f'DROP TABLE public."{ar_part}"')
+                    await con.execute(f'DROP TABLE public."{m_part}"')
+            logger.info("retention: %s %s", mode, m_part)
+    return months
+
+
+# переименование таблиц до секционирования: их индексы, внешние ключи и последовательности
+# освобождают имена. Ссылки analysis_queue на старые messages (в базе из sql/init.sql их нет,
+# но могли появиться вручную) снимаются — новое ограничение добавляется после копирования
+_LEGACY_RENAME = """
+DO $$
+DECLARE r record;
+BEGIN
+  FOR r IN
+    SELECT conname FROM pg_constraint
+    WHERE conrelid = 'public.analysis_queue'::regclass AND contype = 'f'
+      AND confrelid = 'public.messages'::regclass
+  LOOP
+    EXECUTE format('ALTER TABLE public.analysis_queue DROP CONSTRAINT %I', r.conname);
+  END LOOP;
+END $$;
+ALTER TABLE public.analysis_results RENAME TO analysis_results_legacy;
+ALTER TABLE public.messages RENAME TO messages_legacy;
+ALTER SEQUENCE IF EXISTS public.messages_message_id_seq RENAME TO messages_legacy_message_id_seq;
+ALTER SEQUENCE IF EXISTS public.analysis_results_analysis_id_seq RENAME TO analysis_results_legacy_analysis_id_seq;
+DO $$
+DECLARE r record;
+BEGIN
+  FOR r IN
+    SELECT i.relname
+    FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+    WHERE x.indrelid IN ('public.messages_legacy'::regclass, 'public.analysis_results_legacy'::regclass)
+  LOOP
+    EXECUTE format('ALTER INDEX public.%I RENAME TO %I', r.relname, left(r.relname, 50) || '_legacy');
+  END LOOP;
+  FOR r IN
+    SELECT conrelid::regclass AS tbl, conname
+    FROM pg_constraint
+    WHERE conrelid IN ('public.messages_legacy'::regclass, 'public.analysis_results_legacy'::regclass)
+      AND contype = 'f'
+  LOOP
+    EXECUTE format('ALTER TABLE %s RENAME CONSTRAINT %I TO %I', r.tbl, r.conname, left(r.conname, 50) || '_legacy');
+  END LOOP;
+END $$;
+"""
+
+_LEGACY_COPY = """
+INSERT INTO public.messages(message_id, chat_id, user_id, tg_message_id, message_text, created_at, response_sec)
+SELECT message_id, chat_id, user_id, tg_message_id, message_text, created_at, response_sec
+FROM public.messages_legacy;
+
+INSERT INTO public.analysis_results(
+  analysis_id, message_id, created_at, sentiment, detected_problem, analysis_date, model_version
+)
+SELECT ar.analysis_id, ar.message_id, m.created_at, ar.sentiment, ar.detected_problem,
+       ar.analysis_date, ar.model_version
+FROM public.analysis_results_legacy ar
+JOIN public.messages_legacy m ON m.message_id = ar.message_id;
+
+UPDATE public.analysis_queue q
+SET created_at = m.created_at
+FROM public.messages_legacy m
+WHERE m.message_id = q.message_id;
+
+DELETE FROM public.analysis_queue WHERE created_at IS NULL;
+ALTER TABLE public.analysis_queue ALTER COLUMN created_at SET NOT NULL;
+ALTER TABLE public.analysis_queue
+  ADD CONSTRAINT fk_analysis_queue_message FOREIGN KEY (message_id, created_at)
+  REFERENCES public.messages(message_id, created_at) ON DELETE CASCADE;
+
+SELECT setval('public.messages_message_id_seq', GREATEST((SELECT MAX(message_id) FROM public.messages), 1));
+SELECT setval(
+  'public.analysis_results_analysis_id_seq', GREATEST((SELECT MAX(analysis_id) FROM public.analysis_results), 1)
+);
+"""
+
+
+async def migrate_to_partitioned(con: asyncpg.Connection, keep_legacy: bool = False) -> bool:
+    # перевод базы до секционирования на секционированные messages/analysis_results
+    # (миграция sql/migrations/0002_partition_messages.py, выполняется внутри её транзакции):
+    # старые таблицы переименовываются в *_legacy, схема создаётся заново из базовой миграции,
+    # под весь диапазон данных создаются секции и данные копируются. False — уже секционировано
+    if await is_partitioned(con):
+        return False
+    await con.execute(
+        "LOCK TABLE public.messages, public.analysis_results, public.analysis_queue IN ACCESS EXCLUSIVE MODE"
+    )
+    await con.execute(_LEGACY_RENAME)
+    await con.execute(BASELINE_SQL.read_text(encoding="utf-8"))
+
+    lo, hi = await con.fetchrow(
+        "SELECT MIN(created_at AT TIME ZONE 'UTC')::date, MAX(created_at AT TIME ZONE 'UTC')::date "
+        "FROM public.messages_legacy"
+    )
+    if lo is not None:
+        month, last = month_start(lo), month_start(hi)
+        while month <= last:
+            for parent in PARENTS:
+                await con.execute("SELECT public.create_month_partition($1, $2)", parent, month)
+            month = add_months(month, 1)
+
+    await con.execute(_LEGACY_COPY)
+    if not keep_legacy:
+        await con.execute("DROP TABLE public.analysis_results_legacy, public.messages_legacy")
+    return True
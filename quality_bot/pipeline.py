@@ -0,0 +1,329 @@
+import asyncio
+import logging
+import random
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Iterable, Tuple
+
+from .analyzer import AnalyzerClient, AnalyzerError, Prefilter
+from .cache import ResultCache, text_hash
+from .config import Config
+from .limits import CircuitBreaker, CircuitOpenError, FairScheduler, TokenBucket
+from .metrics import ANALYSIS_OUTCOMES
+from .repo import Repo
+
+logger = logging.getLogger(__name__)
+
+AnalyzeFn = Callable[[str], Awaitable[Tuple[str, str]]]
+BatchAnalyzeFn = Callable[[list[Tuple[int, str]]], Awaitable[dict[int, Tuple[str, str]]]]
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    k = (len(s) - 1) * q
+    lo = int(k)
+    hi = min(lo + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+@dataclass
+class PipelineStats:
+    analyzed: int = 0
+    problems: int = 0
+    skipped: int = 0
+    failed: int = 0
+    retries: int = 0
+    requests: int = 0
+    batched: int = 0
+    fallbacks: int = 0
+    cached: int = 0
+    duplicates: int = 0
+    local: int = 0
+    # не отправлены в LLM из-за открытой цепи — будут проанализированы позже
+    deferred: int = 0
+    started: float = 0.0  # time.monotonic() начала запуска
+    elapsed: float = 0.0
+    latencies: list[float] = field(default_factory=list)
+    failed_ids: list[int] = field(default_factory=list)
+    deferred_ids: list[int] = field(default_factory=list)
+    # чат запуска — ключ справедливого распределения слотов LLM (None — фоновые воркеры)
+    chat_id: int | None = None
+
+    @property
+    def processed(self) -> int:
+        return self.analyzed + self.skipped + self.failed + self.deferred
+
+    @property
+    def rate(self) -> float:
+        return self.analyzed / self.elapsed if self.elapsed > 0 else 0.0
+
+    def percentile(self, q: float) -> float:
+        return _percentile(self.latencies, q)
+
+    def summary(self) -> str:
+        lines = [f"Готово. Проанализировано: {self.analyzed}. Проблем: {self.problems}."]
+        if self.failed:
+            lines.append(f"Ошибок: {self.failed}.")
+        if self.deferred:
+            lines.append(f"LLM недоступен, отложено: {self.deferred}.")
+        if self.failed or self.deferred:
+            lines.append("Неразобранные сообщения поставлены в очередь на повторный анализ.")
+        lines.append(
+            f"Время: {self.elapsed:.1f} сек, скорость: {self.rate:.1f} сообщ./сек, "
+            f"запросов к LLM: {self.requests}, повторов: {self.retries}."
+        )
+        if self.batched:
+            lines.append(f"Пакетно: {self.batched}, повторно по одному: {self.fallbacks}.")
+        if self.local:
+            lines.append(f"Определено локально, без LLM: {self.local}.")
+        if self.cached or self.duplicates:
+            lines.append(f"Из кэша: {self.cached}, повторяющихся текстов: {self.duplicates}.")
+        if self.latencies:
+            lines.append(
+                "Задержка LLM p50/p90/p99: "
+                f"{self.percentile(0.5):.2f} / {self.percentile(0.9):.2f} / {self.percentile(0.99):.2f} сек"
+            )
+        return "\n".join(lines)
+
+
+def _text(row) -> str:
+    return (row["message_text"] or "").strip()
+
+
+@dataclass
+class AnalysisPipeline:
+    repo: Repo
+    analyze: AnalyzeFn
+    analyze_batch: BatchAnalyzeFn | None = None
+    concurrency: int = 8
+    rps: float = 10.0
+    # сколько запросов можно отправить подряд после простоя; 0 — равно rps
+    burst: float = 0.0
+    retries: int = 3
+    backoff: float = 0.5
+    # пакетный режим: короткие сообщения (до batch_max_chars) уходят в LLM по batch_size штук
+    batch_size: int = 0
+    batch_max_chars: int = 300
+    model_version: str = ""
+    cache: ResultCache | None = None
+    prefilter: Prefilter | None = None
+    breaker: CircuitBreaker | None = None
+
+    def __post_init__(self):
+        # лимит и слоты общие для всех запусков, чтобы параллельные /analyze и воркеры не превышали квоту;
+        # слоты делятся между чатами по очереди
+        self._limiter = TokenBucket(self.rps, self.burst or None)
+        self._slots = FairScheduler(self.concurrency)
+
+    async def _admit(self) -> bool:
+        # при открытой цепи отказ сразу, без ожидания токена; True — запрос пробный (half-open)
+        if self.breaker is not None and not self.breaker.available():
+            self.breaker.before_call()
+        await self._limiter.acquire()
+        if self.breaker is not None:
+            return self.breaker.before_call()
+        return False
+
+    async def _call_with_retry(self, fn, arg, stats: PipelineStats):
+        attempt = 0
+        while True:
+            # слот занят только на время запроса: во время паузы перед повтором он нужен другим
+            async with self._slots.slot(stats.chat_id):
+                probe = await self._admit()
+                stats.requests += 1
+                t0 = time.monotonic()
+                try:
+                    result = await fn(arg)
+                    error = None
+                except AnalyzerError as e:
+                    error = e
+                except BaseException:
+                    # слот пробного запроса освобождает только сам пробный запрос
+                    if probe:
+                        self.breaker.release()
+                    raise
+            if error is None:
+                if self.breaker is not None:
+                    self.breaker.on_success()
+                stats.latencies.append(time.monotonic() - t0)
+                return result
+
+            # 4xx и неразборчивый ответ — сервис жив, цепь не открываем
+            if self.breaker is not None and error.retryable:
+                self.breaker.on_failure()
+            elif self.breaker is not None:
+                self.breaker.on_success()
+            if error.status_code == 429 and error.retry_after:
+                # квота исчерпана для всех запросов, а не только для этого
+                self._limiter.pause(error.retry_after)
+            if not error.retryable or attempt >= self.retries:
+                raise error
+            delay = error.retry_after or self.backoff * (2 ** attempt) * (1 + random.random())
+            logger.warning("LLM error (%s), retry %d in %.1fs", error.status_code, attempt + 1, delay)
+            stats.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _defer(self, groups: list[list], stats: PipelineStats) -> None:
+        for g in groups:
+            stats.deferred += len(g)
+            stats.deferred_ids += [int(r["message_id"]) for r in g]
+
+    # group — сообщения с одинаковым нормализованным текстом; в LLM уходит первое из них,
+    # результат записывается всем
+    async def _store(
+        self, groups: list[list], results: list[Tuple[str, str]], stats: PipelineStats, remember: bool = True
+    ) -> int:
+        items = [(int(r["message_id"]), s, p) for g, (s, p) in zip(groups, results) for r in g]
+        await self.repo.save_analyses(items, self.model_version)
+        if remember and self.cache is not None:
+            try:
+                await self.cache.put_many({text_hash(_text(g[0])): res for g, res in zip(groups, results)})
+            except Exception:
+                logger.exception("analysis cache write failed")
+        stats.analyzed += len(items)
+        stats.problems += sum(1 for _, _, problem in items if problem != "ok")
+        for problem, cnt in Counter(problem for _, _, problem in items).items():
+            ANALYSIS_OUTCOMES.labels(problem).inc(cnt)
+        return len(items)
+
+    async def _process(self, group: list, stats: PipelineStats) -> None:
+        try:
+            result = await self._call_with_retry(self.analyze, _text(group[0]), stats)
+            await self._store([group], [result], stats)
+        except CircuitOpenError:
+            self._defer([group], stats)
+        except Exception:
+            logger.exception("analyze/save failed for message_id=%s", group[0]["message_id"])
+            stats.failed += len(group)
+            stats.failed_ids += [int(r["message_id"]) for r in group]
+
+    async def _process_batch(self, groups: list[list], stats: PipelineStats) -> None:
+        items = [(int(g[0]["message_id"]), _text(g[0])) for g in groups]
+        try:
+            results = await self._call_with_retry(self.analyze_batch, items, stats)
+        except CircuitOpenError:
+            self._defer(groups, stats)
+            return
+        except Exception:
+            logger.exception("batch analyze failed, falling back to single calls")
+            results = {}
+
+        done = [g for g in groups if int(g[0]["message_id"]) in results]
+        try:
+            stats.batched += await self._store(done, [results[int(g[0]["message_id"])] for g in done], stats)
+        except Exception:
+            logger.exception("batch save failed")
+            done = []
+
+        # элементы, которые модель не вернула или вернула некорректно
+        for g in groups:
+            if not any(g is d for d in done):
+                stats.fallbacks += 1
+                await self._process(g, stats)
+
+    def _units(self, groups: list[list], stats: PipelineStats):
+        batch: list = []
+        for group in groups:
+            if self.analyze_batch is None or self.batch_size < 2 or len(_text(group[0])) > self.batch_max_chars:
+                yield self._process(group, stats)
+                continue
+            batch.append(group)
+            if len(batch) >= self.batch_size:
+                yield self._process_batch(batch, stats)
+                batch = []
+        if batch:
+            yield self._process_batch(batch, stats)
+
+    async def _apply_prefilter(self, groups: dict[str, list], stats: PipelineStats) -> None:
+        resolved = {}
+        for h, group in groups.items():
+            verdict = self.prefilter.classify(_text(group[0]))
+            if verdict is not None:
+                resolved[h] = verdict
+        if not resolved:
+            return
+        try:
+            keys = list(resolved)
+            stats.local += await self._store(
+                [groups[h] for h in keys], [resolved[h] for h in keys], stats, remember=False
+            )
+        except Exception:
+            logger.exception("saving locally classified results failed")
+            return
+        for h in resolved:
+            del groups[h]
+
+    async def _apply_cache(self, groups: dict[str, list], stats: PipelineStats) -> None:
+        try:
+            hits = await self.cache.get_many(list(groups))
+            if hits:
+                keys = list(hits)
+                stats.cached += await self._store(
+                    [groups[h] for h in keys], [hits[h] for h in keys], stats, remember=False
+                )
+        except Exception:
+            logger.exception("analysis cache lookup failed")
+            return
+        for h in hits:
+            del groups[h]
+
+    async def run(self, rows: Iterable, stats: PipelineStats | None = None) -> PipelineStats:
+        # stats можно передать заранее, чтобы следить за ходом запуска (фоновые задачи /analyze)
+        stats = stats if stats is not None else PipelineStats()
+        started = time.monotonic()
+        stats.started = started
+
+        groups: dict[str, list] = {}
+        for row in rows:
+            txt = _text(row)
+            if not txt or txt.startswith("/"):
+                stats.skipped += 1
+                continue
+            groups.setdefault(text_hash(txt), []).append(row)
+        stats.duplicates = sum(len(g) - 1 for g in groups.values())
+
+        # дешёвые стадии до обращения к LLM: локальные правила, затем кэш
+        if self.prefilter is not None and groups:
+            await self._apply_prefilter(groups, stats)
+        if self.cache is not None and groups:
+            await self._apply_cache(groups, stats)
+
+        units = self._units(list(groups.values()), stats)
+
+        async def worker():
+            for unit in units:
+                await unit
+
+        await asyncio.gather(*(worker() for _ in range(max(1, self.concurrency))))
+        stats.elapsed = time.monotonic() - started
+        return stats
+
+
+def create_pipeline(cfg: Config, repo: Repo, analyzer: AnalyzerClient) -> AnalysisPipeline:
+    return AnalysisPipeline(
+        repo,
+        analyzer.analyze,
+        analyzer.analyze_batch,
+        concurrency=cfg.analyze_concurrency,
+        rps=cfg.analyze_rps,
+        burst=cfg.analyze_burst,
+        retries=cfg.analyze_retries,
+        batch_size=cfg.analyze_batch_size,
+        batch_max_chars=cfg.analyze_batch_max_chars,
+        model_version=analyzer.model_version,
+        cache=ResultCache(
+            repo,
+            analyzer.model_version,
+            maxsize=cfg.analysis_cache_size,
+            ttl=cfg.analysis_cache_ttl,
+            max_age_days=cfg.analysis_cache_days,
+        ),
+        prefilter=Prefilter(cfg.prefilter_threshold) if cfg.prefilter_enabled else None,
+        breaker=CircuitBreaker(
+            cfg.circuit_failure_threshold, cfg.circuit_reset_sec, cfg.circuit_max_reset_sec
+        ),
+    )
@@ -0,0 +1,142 @@
+import json
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+
+import asyncpg
+
+from .bench import cleanup, synthetic_messages
+from .db import SingleConnection
+from .ingest import IncomingMessage
+from .partitions import ensure_partitions
+from .repo import Repo
+
+logger = logging.getLogger(__name__)
+
+# таблицы, по которым Seq Scan недопустим (секции messages_pYYYYMM сводятся к родителю)
+LARGE_TABLES = ("messages", "analysis_results", "analysis_queue", "analysis_rollup_daily", "response_time_hist_daily")
+MODEL_VERSION = "plancheck"
+
+
+def _base_table(relation: str) -> str:
+    for name in LARGE_TABLES:
+        if relation == name or relation.startswith(name + "_p"):
+            return name
+    return relation
+
+
+def _seq_scans(plan: dict):
+    if plan.get("Node Type") == "Seq Scan" and plan.get("Relation Name"):
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", ()):
+        yield from _seq_scans(child)
+
+
+def _explainable(query: str) -> bool:
+    head = query.lstrip().split(None, 1)[0].upper() if query.strip() else ""
+    return head in ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+async def _seed(repo: Repo, pool, messages: int, chats: int, days: int) -> list[IncomingMessage]:
+    await ensure_partitions(pool, months_ahead=1, months_back=days // 28 + 1)
+    items = synthetic_messages(chats, max(10, chats * 5), messages, days)
+    for i in range(0, len(items), 1000):
+        await repo.ingest_messages(items[i:i + 1000])
+
+    # результаты анализа для большей части сообщений, ~5% — с проблемой
+    rnd = random.Random(2)
+    async with pool.acquire() as con:
+        ids = [int(r["message_id"]) for r in await con.fetch(
+            "SELECT message_id FROM public.messages WHERE chat_id = ANY($1::bigint[])",
+            sorted({it.chat_id for it in items}),
+        )]
+    analyses = [
+        (mid, "negative", "impolite") if rnd.random() < 0.05 else (mid, "neutral", "ok")
+        for mid in ids if rnd.random() < 0.8
+    ]
+    for i in range(0, len(analyses), 5000):
+        await repo.save_analyses(analyses[i:i + 5000], MODEL_VERSION)
+    await repo.update_response_times(sorted({it.chat_id for it in items}), horizon_sec=(days + 1) * 86400)
+
+    async with pool.acquire() as con:
+        for table in LARGE_TABLES:
+            await con.execute(f"ANALYZE public.{table}")
+    return items
+
+
+async def _hot_calls(repo: Repo, items: list[IncomingMessage]):
+    # горячие методы Repo с типичными аргументами: неделя переписки одного чата
+    chat_id = items[len(items) // 2].chat_id
+    mid = items[len(items) // 2].created_at
+    d1, d2 = mid - timedelta(days=3), mid + timedelta(days=4)
+    yield "messages_page", repo.messages_page(chat_id, d1, d2, 30)
+    yield "messages_page(backward)", repo.messages_page(chat_id, d1, d2, 30, backward=True)
+    yield "issues_page", repo.issues_page(chat_id, d1, d2, 20)
+    yield "list_messages_for_analysis", repo.list_messages_for_analysis(chat_id, d1, d2, "other-model", 200)
+    yield "list_messages_sample", repo.list_messages_sample(chat_id, d1, d2, "other-model", 0.05)
+    yield "report", repo.report(chat_id, d1, d2)
+    yield "response_time_stats", repo.response_time_stats(chat_id, d1, d2)
+    yield "sample_strata", repo.sample_strata(chat_id, d1, d2)
+    yield "covering_sample_rate", repo.covering_sample_rate(chat_id, d1, d2)
+    yield "get_cached_report", repo.get_cached_report(chat_id, d1.date(), d2.date())
+    yield "problem_trend", repo.problem_trend(chat_id, d1.date(), d2.date())
+    yield "problem_trend_hourly", repo.problem_trend_hourly(chat_id, d1, d1 + timedelta(days=1))
+    yield "user_problem_counts", repo.user_problem_counts(chat_id, d1.date(), d2.date())
+    word = items[len(items) // 2].text.split()[0]
+    yield "search_messages", repo.search_messages(chat_id, word, d1, d2, 11)
+    yield "claim_analysis_jobs", repo.claim_analysis_jobs(50, 300, 5)
+    yield "count_failed_analysis_jobs", repo.count_failed_analysis_jobs()
+    yield "get_cached_results", repo.get_cached_results(["0" * 64], MODEL_VERSION)
+    yield "save_analyses", repo.save_analyses([(1, "neutral", "ok")], MODEL_VERSION)
+    yield "update_response_times", repo.update_response_times([chat_id])
+    now = datetime.now(timezone.utc)
+    new = IncomingMessage(chat_id, "plancheck", items[0].tg_user_id, items[0].username, "viewer", 10**9, "новое", now)
+    yield "ingest_messages", repo.ingest_messages([new])
+
+
+async def check_plans(
+    pool: asyncpg.Pool, messages: int = 50000, chats: int = 20, days: int = 60, min_rows: int = 5000
+) -> list[tuple[str, str, float]]:
+    # наполняет базу синтетическими данными (в транзакции, которая откатывается), выполняет горячие
+    # методы Repo, перехватывает их запросы и проверяет EXPLAIN (FORMAT JSON) каждого.
+    # Возвращает [(метод, таблица, оценка строк)] для Seq Scan по большим таблицам
+    problems = []
+    async with pool.acquire() as con:
+        await cleanup(pool)
+        tx = con.transaction()
+        await tx.start()
+        try:
+            single = SingleConnection(con)
+            repo = Repo(single)
+            items = await _seed(repo, single, messages, chats, days)
+
+            sizes = {
+                r["relname"]: float(r["reltuples"])
+                for r in await con.fetch("SELECT relname, reltuples FROM pg_class WHERE relkind = 'r'")
+            }
+
+            captured = []
+            log = captured.append
+            con.add_query_logger(log)
+            try:
+                calls = []
+                async for method, coro in _hot_calls(repo, items):
+                    start = len(captured)
+                    await coro
+                    calls.append((method, captured[start:]))
+            finally:
+                con.remove_query_logger(log)
+
+            for method, records in calls:
+                for record in records:
+                    if record.exception is not None or not _explainable(record.query):
+                        continue
+                    raw = await con.fetchval("EXPLAIN (FORMAT JSON) " + record.query, *record.args)
+                    plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+                    for relation in _seq_scans(plan):
+                        rows = sizes.get(relation, 0.0)
+                        if _base_table(relation) in LARGE_TABLES and rows >= min_rows:
+                            problems.append((method, relation, rows))
+        finally:
+            await tx.rollback()
+    return problems
@@ -0,0 +1,351 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Chat, Message, Update
+from dotenv import load_dotenv
+from prometheus_client import REGISTRY
+
+from .app import build_dispatcher
+from .bench import BENCH_CHAT_BASE, BENCH_USER_BASE, QueryCounter, _synthetic_text, cleanup
+from .db import create_pool
+from .ingest import IngestBuffer
+from .metrics import bind_pool
+from .partitions import ensure_partitions
+from .pipeline import _percentile
+from .repo import Repo
+
+logger = logging.getLogger(__name__)
+
+# команды админа в синтетическом потоке: чтение из БД и ответ через Bot
+ADMIN_COMMANDS = ("/report day", "/report week", "/trends", "/help")
+ADMIN_USER = BENCH_USER_BASE + 999_999
+
+
+class FakeSession(BaseSession):
+    # сессия Bot без сети: запросы к Bot API только считаются, отправка сообщения
+    # возвращает правдоподобный Message
+    def __init__(self):
+        super().__init__()
+        self.calls: Counter[str] = Counter()
+        self._message_id = 0
+
+    async def make_request(self, bot: Bot, method, timeout: int | None = None):
+        self.calls[type(method).__name__] += 1
+        if method.__returning__ is Message and getattr(method, "chat_id", None) is not None:
+            self._message_id += 1
+            return Message(
+                message_id=self._message_id,
+                date=datetime.now(timezone.utc),
+                chat=Chat(id=method.chat_id, type="supergroup"),
+                text=getattr(method, "text", None),
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self) -> None:
+        pass
+
+
+class LatencyRecorder(BaseMiddleware):
+    # inner-middleware: длительность каждого вызова хендлера по имени функции
+    def __init__(self):
+        self.samples: dict[str, list[float]] = defaultdict(list)
+
+    async def __call__(
+        self,
+        handler: Callable[[Any, dict[str, Any]], Awaitable[Any]],
+        event: Any,
+        data: dict[str, Any],
+    ) -> Any:
+        name = getattr(getattr(data.get("handler"), "callback", None), "__name__", "unknown")
+        t0 = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.samples[name].append(time.perf_counter() - t0)
+
+
+class PoolSampler:
+    # занятость пула раз в interval: пик, среднее и доля замеров с полностью занятым пулом
+    def __init__(self, pool, interval: float = 0.005):
+        self.pool = pool
+        self.interval = interval
+        self.samples: list[int] = []
+
+    async def run(self, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            self.samples.append(self.pool.get_size() - self.pool.get_idle_size())
+            try:
+                await asyncio.wait_for(stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def summary(self) -> str:
+        if not self.samples:
+            return "pool: no samples"
+        size = self.pool.get_max_size()
+        full = sum(1 for s in self.samples if s >= size)
+        return (
+            f"pool: peak {max(self.samples)}/{size}, mean {sum(self.samples) / len(self.samples):.1f}, "
+            f"saturated {100.0 * full / len(self.samples):.1f}% of time"
+        )
+
+
+def _pool_wait() -> tuple[float, float]:
+    # сумма и число ожиданий соединения из гистограммы quality_bot_db_pool_wait_seconds
+    labels = {"pool": "writer"}
+    total = REGISTRY.get_sample_value("quality_bot_db_pool_wait_seconds_sum", labels) or 0.0
+    count = REGISTRY.get_sample_value("quality_bot_db_pool_wait_seconds_count", labels) or 0.0
+    return total, count
+
+
+def synthetic_updates(
+    chats: int, users: int, count: int, seed: int = 1, command_rate: float = 0.0, start_id: int = 1
+) -> list[dict]:
+    # Update в формате Bot API (как тело webhook / элемент getUpdates); время — в момент подачи
+    rnd = random.Random(seed + start_id)
+    now = int(time.time())
+    updates = []
+    for i in range(start_id, start_id + count):
+        chat = rnd.randrange(chats)
+        if rnd.random() < command_rate:
+            sender = {"id": ADMIN_USER, "is_bot": False, "first_name": "admin", "username": "bench_admin"}
+            text = rnd.choice(ADMIN_COMMANDS)
+        else:
+            user = rnd.randrange(users)
+            sender = {"id": BENCH_USER_BASE + user, "is_bot": False, "first_name": f"user {user}",
+                      "username": f"bench_user_{user}"}
+            text = _synthetic_text(rnd)
+        updates.append({
+            "update_id": i,
+            "message": {
+                "message_id": i,
+                "date": now,
+                "chat": {"id": BENCH_CHAT_BASE - chat, "type": "supergroup", "title": f"bench chat {chat}"},
+                "from": sender,
+                "text": text,
+            },
+        })
+    return updates
+
+
+def load_updates(path: Path) -> list[dict]:
+    # записанные обновления; id чатов и пользователей переносятся в синтетический диапазон,
+    # чтобы прогон не смешивался с настоящими данными и удалялся cleanup
+    chats: dict[int, int] = {}
+    users: dict[int, int] = {}
+    updates = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            upd = json.loads(line)
+            for key in ("message", "edited_message", "callback_query"):
+                obj = upd.get(key)
+                if not obj:
+                    continue
+                msg = obj.get("message", obj) if key == "callback_query" else obj
+                if "chat" in msg:
+                    msg["chat"]["id"] = chats.setdefault(msg["chat"]["id"], BENCH_CHAT_BASE - len(chats))
+                for holder in (obj, msg):
+                    if holder.get("from"):
+                        holder["from"]["id"] = users.setdefault(holder["from"]["id"], BENCH_USER_BASE + len(users))
+            updates.append(upd)
+    return updates
+
+
+def _stored_key(upd: dict) -> tuple[int, int] | None:
+    # (chat_id, message_id) сообщения, которое должно попасть в messages, иначе None
+    msg = upd.get("message")
+    if not msg or not msg.get("from") or msg["chat"]["type"] not in ("group", "supergroup"):
+        return None
+    text = msg.get("text") or ""
+    if not text or text.startswith("/"):
+        return None
+    return msg["chat"]["id"], msg["message_id"]
+
+
+async def _count_stored(pool) -> tuple[int, int]:
+    # (строк, уникальных (chat_id, tg_message_id)) среди синтетических чатов
+    async with pool.acquire() as con:
+        row = await con.fetchrow(
+            "SELECT count(*) AS total, count(DISTINCT (chat_id, tg_message_id)) AS uniq "
+            "FROM public.messages WHERE chat_id <= $1",
+            BENCH_CHAT_BASE,
+        )
+    return int(row["total"]), int(row["uniq"])
+
+
+async def replay_stage(
+    dp, bot: Bot, repo: Repo, args, updates: list[dict], rate: float, counter: QueryCounter, seen: set
+) -> None:
+    # подаёт updates в dp.feed_update пачками по burst штук со средней скоростью rate (0 — без пауз),
+    # каждое обновление — отдельной задачей, как в polling и webhook
+    ingest = IngestBuffer(
+        repo, max_items=args.ingest_batch, flush_interval=args.flush_ms / 1000, max_queue=args.queue_size
+    )
+    dp["ingest"] = ingest
+    recorder = dp["replay_recorder"]
+    recorder.samples.clear()
+    sampler = PoolSampler(repo.pool)
+    stop_sampler = asyncio.Event()
+    sampler_task = asyncio.create_task(sampler.run(stop_sampler))
+    wait_sum0, wait_cnt0 = _pool_wait()
+    stored0, _ = await _count_stored(repo.pool)
+
+    dispatch: list[float] = []
+    inflight = asyncio.Semaphore(args.max_inflight)
+
+    async def feed(raw: dict) -> None:
+        try:
+            update = Update.model_validate(raw, context={"bot": bot})
+            t1 = time.perf_counter()
+            await dp.feed_update(bot, update)
+            dispatch.append(time.perf_counter() - t1)
+        finally:
+            inflight.release()
+
+    counter.count = 0
+    ingest.start()
+    t0 = time.monotonic()
+    tasks = []
+    burst = max(1, args.burst)
+    for i in range(0, len(updates), burst):
+        if rate > 0:
+            delay = t0 + i / rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        for raw in updates[i:i + burst]:
+            await inflight.acquire()
+            tasks.append(asyncio.create_task(feed(raw)))
+    await asyncio.gather(*tasks)
+    fed = time.monotonic() - t0
+    # остаток буфера дописывается в БД — время до полной записи
+    await ingest.stop()
+    total = time.monotonic() - t0
+    queries = counter.count
+    stop_sampler.set()
+    await sampler_task
+
+    stored, uniq = await _count_stored(repo.pool)
+    wait_sum, wait_cnt = _pool_wait()
+    # новыми должны стать только сообщения, которых не было в предыдущих ступенях
+    keys = {k for k in map(_stored_key, updates) if k is not None}
+    expected = len(keys - seen)
+    seen |= keys
+    label = f"{rate:g}/s" if rate > 0 else "max"
+    print(
+        f"rate {label:<8} {len(updates):>7} updates  fed {fed:6.2f} s ({len(updates) / max(fed, 1e-9):8.1f} upd/s)"
+        f"  stored {stored - stored0:>7}/{expected} in {total:6.2f} s ({(stored - stored0) / max(total, 1e-9):8.1f} msg/s)"
+        f"  {queries / max(1, len(updates)):5.2f} queries/update"
+    )
+    print(
+        f"  dispatch p50 {_percentile(dispatch, 0.5) * 1000:7.2f} ms  p99 {_percentile(dispatch, 0.99) * 1000:7.2f} ms"
+        f"  max {max(dispatch, default=0) * 1000:7.1f} ms"
+    )
+    for name, samples in sorted(recorder.samples.items()):
+        print(
+            f"  {name:<18} {len(samples):>7}  p50 {_percentile(samples, 0.5) * 1000:7.2f} ms"
+            f"  p90 {_percentile(samples, 0.9) * 1000:7.2f} ms  p99 {_percentile(samples, 0.99) * 1000:7.2f} ms"
+        )
+    waits = wait_cnt - wait_cnt0
+    print(f"  {sampler.summary()}, mean acquire wait {(wait_sum - wait_sum0) / max(1, waits) * 1000:.2f} ms")
+    if stored != uniq:
+        print(f"  DUPLICATES: {stored - uniq} message(s) stored more than once")
+    if stored - stored0 != expected:
+        print(f"  MISMATCH: expected {expected} new message(s), stored {stored - stored0}")
+
+
+async def run(args: argparse.Namespace) -> None:
+    counter = QueryCounter()
+    pool = await create_pool(args.dsn, min_size=1, max_size=args.pool_size, init=counter.init)
+    bind_pool(pool, "writer")
+    repo = Repo(pool)
+    bot = Bot("42:replay", session=FakeSession())
+    dp = build_dispatcher(repo, None, None, None, {ADMIN_USER})
+    recorder = LatencyRecorder()
+    dp["replay_recorder"] = recorder
+    dp.message.middleware(recorder)
+    dp.callback_query.middleware(recorder)
+
+    rates = [float(r) for r in args.rate.split(",")]
+    if args.input:
+        recorded = load_updates(Path(args.input))
+        stages = [(rate, recorded) for rate in rates]
+        oldest = min((u["message"]["date"] for u in recorded if u.get("message")), default=time.time())
+    else:
+        stages, next_id = [], 1
+        for rate in rates:
+            batch = synthetic_updates(args.chats, args.users, args.updates, args.seed, args.command_rate, next_id)
+            stages.append((rate, batch))
+            next_id += len(batch)
+        oldest = time.time()
+        if args.save:
+            with open(args.save, "w", encoding="utf-8") as f:
+                for _, batch in stages:
+                    for upd in batch:
+                        f.write(json.dumps(upd, ensure_ascii=False) + "\n")
+
+    try:
+        await cleanup(pool)
+        months_back = int((time.time() - oldest) // (28 * 86400)) + 1
+        await ensure_partitions(pool, months_ahead=1, months_back=months_back)
+        seen: set = set()
+        for rate, updates in stages:
+            # повтор записанного потока на следующей ступени проверяет идемпотентность:
+            # новых строк быть не должно
+            await replay_stage(dp, bot, repo, args, updates, rate, counter, seen)
+        calls = dict(bot.session.calls)
+        if calls:
+            print(f"bot api calls: {calls}")
+    finally:
+        if not args.keep:
+            await cleanup(pool)
+        await pool.close()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="python -m quality_bot.replay",
+        description="прогон обновлений Telegram через Dispatcher бота с фиктивным Bot и локальной БД",
+    )
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL", ""))
+    parser.add_argument("--input", default="", help="JSONL с Update (по одному на строку); без него — синтетика")
+    parser.add_argument("--save", default="", help="записать синтетический поток в JSONL")
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=20000, help="обновлений на каждую ступень --rate")
+    parser.add_argument("--command-rate", type=float, default=0.0, help="доля команд админа в потоке")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--rate", default="0", help="обновлений/сек через запятую — ступени; 0 — без ограничения")
+    parser.add_argument("--burst", type=int, default=1, help="обновлений, подаваемых одновременно")
+    parser.add_argument("--max-inflight", type=int, default=10000, help="обработка обновлений одновременно")
+    parser.add_argument("--pool-size", type=int, default=10)
+    parser.add_argument("--ingest-batch", type=int, default=500)
+    parser.add_argument("--flush-ms", type=int, default=200)
+    parser.add_argument("--queue-size", type=int, default=10000)
+    parser.add_argument("--keep", action="store_true", help="не удалять синтетические данные")
+    return parser
+
+
+if __name__ == "__main__":
+    load_dotenv()
+    args = build_parser().parse_args()
+    # app настраивает логирование на INFO при импорте
+    logging.getLogger().setLevel(logging.WARNING)
+    if not args.dsn:
+        raise SystemExit("DATABASE_URL is empty (или --dsn)")
+    asyncio.run(run(args))
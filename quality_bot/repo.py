@@ -2,7 +2,16 @@ from __future__ import annotations
 
 import asyncpg
 from dataclasses import dataclass
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, time, timedelta, timezone
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable
+
+from .cache import LRUCache
+from .locks import lock_key
+from .metrics import acquire, observe_db
+from .sketch import BUCKETS_PER_E, MAX_BUCKET, Histogram
+
+if TYPE_CHECKING:
+    from .ingest import IncomingMessage
 
 UTC = timezone.utc
 
@@ -19,54 +28,110 @@ def date_range_from_args(d1: str, d2: str):
     return start, end
 
 
+def _day_bounds(date_from: datetime, date_to: datetime) -> tuple[date, date]:
+    # [date_from, date_to) -> полуинтервал дней UTC для дневных агрегатов;
+    # неполный последний день включается целиком
+    day_from = date_from.astimezone(UTC).date()
+    end = date_to.astimezone(UTC)
+    day_to = end.date() if end.time() == time(0) else end.date() + timedelta(days=1)
+    return day_from, day_to
+
+
 @dataclass
 class Repo:
+    # pool — запись и всё, что должно видеть только что записанное; read_pool — отчёты и выборки
+    # (реплика или отдельный пул к основной базе, чтобы тяжёлые отчёты не занимали соединения приёма)
     pool: asyncpg.Pool
+    identity_cache_size: int = 10000
+    read_pool: asyncpg.Pool | None = None
+
+    def __post_init__(self):
+        self.reader = self.read_pool or self.pool
+        # кэш справочников: в БД пишем только когда значение действительно изменилось
+        self._roles: LRUCache[str, int] = LRUCache(256)
+        self._users: LRUCache[int, tuple[int, str, int]] = LRUCache(self.identity_cache_size)
+        self._chats: LRUCache[int, str] = LRUCache(self.identity_cache_size)
+
+    def invalidate_identity(
+        self, tg_user_id: int | None = None, chat_id: int | None = None, role_name: str | None = None
+    ) -> None:
+        # вызывать после ручных изменений users/chats/user_role; без аргументов — сброс всего
+        if tg_user_id is None and chat_id is None and role_name is None:
+            self._users.clear()
+            self._chats.clear()
+            self._roles.clear()
+            return
+        if tg_user_id is not None:
+            self._users.pop(tg_user_id)
+        if chat_id is not None:
+            self._chats.pop(chat_id)
+        if role_name is not None:
+            self._roles.pop(role_name)
+            self._users.clear()
 
     # ---------- справочники ----------
+    @observe_db
     async def get_role_id(self, role_name: str) -> int:
+        cached = self._roles.get(role_name)
+        if cached is not None:
+            return cached
+
         q_sel = "SELECT role_id FROM public.user_role WHERE role_name=$1"
-        q_ins = "INSERT INTO public.user_role(role_name) VALUES($1) RETURNING role_id"
+        q_ins = """
+        INSERT INTO public.user_role(role_name) VALUES($1)
+        ON CONFLICT (role_name) DO UPDATE SET role_name = EXCLUDED.role_name
+        RETURNING role_id
+        """
 
-        async with self.pool.acquire() as con:
-            row = await con.fetchrow(q_sel, role_name)
-            if row:
-                return int(row["role_id"])
-            row2 = await con.fetchrow(q_ins, role_name)
-            return int(row2["role_id"])
+        async with acquire(self.pool) as con:
+            row = await con.fetchrow(q_sel, role_name) or await con.fetchrow(q_ins, role_name)
+        role_id = int(row["role_id"])
+        self._roles.put(role_name, role_id)
+        return role_id
 
     # ---------- сущности ----------
+    @observe_db
     async def ensure_chat(self, chat_id: int, chat_name: str) -> None:
+        chat_name = chat_name or "Unnamed chat"
+        if self._chats.get(chat_id) == chat_name:
+            return
+
         q = """
         INSERT INTO public.chats(chat_id, chat_name)
         VALUES($1, $2)
         ON CONFLICT (chat_id) DO UPDATE
             SET chat_name = EXCLUDED.chat_name
+            WHERE chats.chat_name IS DISTINCT FROM EXCLUDED.chat_name
         """
 
-        async with self.pool.acquire() as con:
-            await con.execute(q, chat_id, chat_name or "Unnamed chat")
+        async with acquire(self.pool) as con:
+            await con.execute(q, chat_id, chat_name)
+        self._chats.put(chat_id, chat_name)
 
+    @observe_db
     async def ensure_user(self, tg_user_id: int, username: str | None, role_name: str = "viewer") -> int:
         role_id = await self.get_role_id(role_name)
+        username = username or ""
 
-        q_sel = "SELECT user_id FROM public.users WHERE tg_user_id=$1"
-        q_upd = "UPDATE public.users SET username=$2, role_id=$3 WHERE user_id=$1"
-        q_ins = """
+        cached = self._users.get(tg_user_id)
+        if cached is not None and cached[1:] == (username, role_id):
+            return cached[0]
+
+        q = """
         INSERT INTO public.users(tg_user_id, username, role_id)
         VALUES ($1, $2, $3)
+        ON CONFLICT (tg_user_id) DO UPDATE
+            SET username = EXCLUDED.username, role_id = EXCLUDED.role_id
         RETURNING user_id
         """
 
-        async with self.pool.acquire() as con:
-            row = await con.fetchrow(q_sel, tg_user_id)
-            if row:
-                await con.execute(q_upd, int(row["user_id"]), username or "", role_id)
-                return int(row["user_id"])
-
-            row2 = await con.fetchrow(q_ins, tg_user_id, username or "", role_id)
-            return int(row2["user_id"])
+        async with acquire(self.pool) as con:
+            row = await con.fetchrow(q, tg_user_id, username, role_id)
+        user_id = int(row["user_id"])
+        self._users.put(tg_user_id, (user_id, username, role_id))
+        return user_id
 
+    @observe_db
     async def add_message(
         self,
         chat_id: int,
@@ -75,20 +140,128 @@ class Repo:
         tg_message_id: int,
         created_at: datetime | None = None,
     ) -> int:
+        # новое (или изменённое) сообщение сразу попадает в очередь анализа
         q = """
-        INSERT INTO public.messages(chat_id, user_id, message_text, tg_message_id, created_at)
-        VALUES ($1, $2, $3, $4, COALESCE($5, now()))
-        ON CONFLICT (chat_id, tg_message_id)
-        DO UPDATE SET
-            message_text = EXCLUDED.message_text,
-            created_at = EXCLUDED.created_at
-        RETURNING message_id
+        WITH ins AS (
+          INSERT INTO public.messages(chat_id, user_id, message_text, tg_message_id, created_at)
+          VALUES ($1, $2, $3, $4, COALESCE($5, now()))
+          ON CONFLICT (chat_id, tg_message_id, created_at)
+          DO UPDATE SET message_text = EXCLUDED.message_text
+          RETURNING message_id, created_at, message_text
+        ), q AS (
+          INSERT INTO public.analysis_queue(message_id, created_at)
+          SELECT message_id, created_at FROM ins WHERE message_text NOT LIKE '/%'
+          ON CONFLICT (message_id) DO UPDATE
+              SET available_at = now(), attempts = 0, last_error = NULL, failed_at = NULL
+        )
+        SELECT message_id FROM ins
         """
-        async with self.pool.acquire() as con:
+        async with acquire(self.pool) as con:
             row = await con.fetchrow(q, chat_id, user_id, text, tg_message_id, created_at)
             return int(row["message_id"])
 
+    @observe_db
+    async def ingest_messages(self, items: list[IncomingMessage]) -> None:
+        # пакетная запись входящих сообщений в одной транзакции. Чаты и пользователи
+        # upsert'ятся только если их нет в кэше или они изменились; в установившемся режиме
+        # это COPY во временную staging-таблицу и один INSERT в messages
+        if not items:
+            return
+        role_ids = {name: await self.get_role_id(name) for name in {it.role_name for it in items}}
+
+        # последнее значение в пачке побеждает (как при последовательной записи)
+        chats = {it.chat_id: it.chat_name or "Unnamed chat" for it in items}
+        users = {it.tg_user_id: (it.username or "", role_ids[it.role_name]) for it in items}
+        chats = {cid: name for cid, name in chats.items() if self._chats.get(cid) != name}
+        known_users = {}
+        for tg_id, value in list(users.items()):
+            cached = self._users.get(tg_id)
+            if cached is not None and cached[1:] == value:
+                known_users[tg_id] = cached[0]
+                del users[tg_id]
+
+        q_chats = """
+        INSERT INTO public.chats(chat_id, chat_name)
+        SELECT * FROM unnest($1::bigint[], $2::text[])
+        ON CONFLICT (chat_id) DO UPDATE
+            SET chat_name = EXCLUDED.chat_name
+            WHERE chats.chat_name IS DISTINCT FROM EXCLUDED.chat_name
+        """
+        q_users = """
+        INSERT INTO public.users(tg_user_id, username, role_id)
+        SELECT * FROM unnest($1::bigint[], $2::text[], $3::bigint[])
+        ON CONFLICT (tg_user_id) DO UPDATE
+            SET username = EXCLUDED.username, role_id = EXCLUDED.role_id
+        RETURNING tg_user_id, user_id
+        """
+        q_staging = """
+        CREATE TEMP TABLE IF NOT EXISTS ingest_staging (
+          chat_id       BIGINT,
+          user_id       BIGINT,
+          tg_message_id BIGINT,
+          message_text  TEXT,
+          created_at    TIMESTAMPTZ
+        ) ON COMMIT DELETE ROWS
+        """
+        # DISTINCT ON: ON CONFLICT DO UPDATE не может обновить одну строку дважды за запрос
+        q_messages = """
+        WITH ins AS (
+          INSERT INTO public.messages(chat_id, user_id, message_text, tg_message_id, created_at)
+          SELECT DISTINCT ON (chat_id, tg_message_id)
+                 chat_id, user_id, message_text, tg_message_id, created_at
+          FROM ingest_staging
+          ORDER BY chat_id, tg_message_id, created_at DESC
+          ON CONFLICT (chat_id, tg_message_id, created_at)
+          DO UPDATE SET message_text = EXCLUDED.message_text
+          RETURNING message_id, created_at, message_text
+        )
+        INSERT INTO public.analysis_queue(message_id, created_at)
+        SELECT message_id, created_at FROM ins WHERE message_text NOT LIKE '/%'
+        ON CONFLICT (message_id) DO UPDATE
+            SET available_at = now(), attempts = 0, last_error = NULL, failed_at = NULL
+        """
+
+        now = datetime.now(UTC)
+        try:
+            async with acquire(self.pool) as con:
+                async with con.transaction():
+                    if chats:
+                        await con.execute(q_chats, list(chats), list(chats.values()))
+                    new_users = {}
+                    if users:
+                        rows = await con.fetch(
+                            q_users,
+                            list(users),
+                            [u for u, _ in users.values()],
+                            [r for _, r in users.values()],
+                        )
+                        new_users = {int(r["tg_user_id"]): int(r["user_id"]) for r in rows}
+                    user_ids = {**known_users, **new_users}
+
+                    await con.execute(q_staging)
+                    await con.copy_records_to_table(
+                        "ingest_staging",
+                        records=[
+                            (it.chat_id, user_ids[it.tg_user_id], it.tg_message_id, it.text, it.created_at or now)
+                            for it in items
+                        ],
+                        columns=["chat_id", "user_id", "tg_message_id", "message_text", "created_at"],
+                    )
+                    await con.execute(q_messages)
+        except asyncpg.ForeignKeyViolationError:
+            # кэш разошёлся с БД (пользователя/чат удалили вручную) — сбрасываем, буфер повторит запись
+            self.invalidate_identity()
+            raise
+
+        # кэш обновляем только после успешного коммита
+        for cid, name in chats.items():
+            self._chats.put(cid, name)
+        for tg_id, user_id in new_users.items():
+            username, role_id = users[tg_id]
+            self._users.put(tg_id, (user_id, username, role_id))
+
     # ---------- выборки ----------
+    @observe_db
     async def list_messages(self, chat_id: int, date_from: datetime, date_to: datetime, limit: int = 200):
         q = """
         SELECT m.message_id, m.message_text, m.created_at, u.username
@@ -98,29 +271,613 @@ class Repo:
         ORDER BY m.created_at ASC
         LIMIT $4
         """
-        async with self.pool.acquire() as con:
+        async with acquire(self.reader) as con:
             return await con.fetch(q, chat_id, date_from, date_to, limit)
 
+    # ---------- постраничные выборки (keyset по (created_at, message_id)) ----------
+    # cursor — (created_at, message_id) граничной строки предыдущей страницы (не включается);
+    # backward=True — страница перед курсором. Строки всегда возвращаются по возрастанию времени
+    async def _keyset_page(
+        self,
+        q_where: str,
+        select: str,
+        args: tuple,
+        date_from: datetime,
+        date_to: datetime,
+        limit: int,
+        cursor: tuple[datetime, int] | None,
+        backward: bool,
+    ):
+        if cursor is None:
+            cursor = (date_to, 0) if backward else (date_from, 0)
+        op, order = ("<", "DESC") if backward else (">", "ASC")
+        n = len(args)
+        q = f"""
+        {select}
+        WHERE {q_where}
+          AND m.created_at >= ${n + 1} AND m.created_at < ${n + 2}
+          AND (m.created_at, m.message_id) {op} (${n + 3}, ${n + 4})
+        ORDER BY m.created_at {order}, m.message_id {order}
+        LIMIT ${n + 5}
+        """
+        async with acquire(self.reader) as con:
+            rows = await con.fetch(q, *args, date_from, date_to, cursor[0], int(cursor[1]), limit)
+        return rows[::-1] if backward else rows
+
+    @observe_db
+    async def messages_page(
+        self,
+        chat_id: int,
+        date_from: datetime,
+        date_to: datetime,
+        limit: int = 30,
+        cursor: tuple[datetime, int] | None = None,
+        backward: bool = False,
+    ):
+        select = """
+        SELECT m.message_id, m.message_text, m.created_at, u.username
+        FROM public.messages m
+        JOIN public.users u ON u.user_id = m.user_id
+        """
+        return await self._keyset_page(
+            "m.chat_id=$1", select, (chat_id,), date_from, date_to, limit, cursor, backward
+        )
+
+    @observe_db
+    async def issues_page(
+        self,
+        chat_id: int,
+        date_from: datetime,
+        date_to: datetime,
+        limit: int = 20,
+        cursor: tuple[datetime, int] | None = None,
+        backward: bool = False,
+    ):
+        select = """
+        SELECT m.message_id, ar.analysis_date, ar.sentiment, ar.detected_problem,
+               m.message_text, m.created_at, u.username
+        FROM public.messages m
+        JOIN public.analysis_results ar ON ar.message_id = m.message_id AND ar.created_at = m.created_at
+        JOIN public.users u ON u.user_id = m.user_id
+        """
+        where = "m.chat_id=$1 AND ar.detected_problem <> '' AND ar.detected_problem <> 'ok'"
+        return await self._keyset_page(where, select, (chat_id,), date_from, date_to, limit, cursor, backward)
+
+    async def iter_messages(
+        self, chat_id: int, date_from: datetime, date_to: datetime, page_size: int = 500
+    ) -> AsyncIterator[list]:
+        # потоковая выдача периода страницами, без загрузки всего в память
+        cursor = None
+        while True:
+            rows = await self.messages_page(chat_id, date_from, date_to, page_size, cursor)
+            if not rows:
+                return
+            yield rows
+            if len(rows) < page_size:
+                return
+            cursor = (rows[-1]["created_at"], rows[-1]["message_id"])
+
+    async def iter_issues(
+        self, chat_id: int, date_from: datetime, date_to: datetime, page_size: int = 500
+    ) -> AsyncIterator[list]:
+        cursor = None
+        while True:
+            rows = await self.issues_page(chat_id, date_from, date_to, page_size, cursor)
+            if not rows:
+                return
+            yield rows
+            if len(rows) < page_size:
+                return
+            cursor = (rows[-1]["created_at"], rows[-1]["message_id"])
+
+    # ---------- поиск (/search) ----------
+    @observe_db
+    async def search_messages(
+        self,
+        chat_id: int,
+        query: str,
+        date_from: datetime,
+        date_to: datetime,
+        limit: int = 10,
+        cursor: tuple[float, datetime, int] | None = None,
+        problem: str | None = None,
+        sentiment: str | None = None,
+    ):
+        # совпадение — полнотекстовое (text_tsv, GIN) или нечёткое по триграммам (word_similarity,
+        # GIN gin_trgm_ops): находит опечатки и формы слов, которых не знает словарь.
+        # Ранг — ts_rank_cd + word_similarity; страницы — keyset по (rank, created_at, message_id)
+        # по убыванию, cursor — ключ последней строки предыдущей страницы (не включается)
+        q = """
+        WITH hits AS (
+          SELECT m.message_id, m.created_at, m.message_text, m.user_id,
+                 (ts_rank_cd(m.text_tsv, websearch_to_tsquery('russian', $2))
+                  + word_similarity($2, m.message_text))::float8 AS rank
+          FROM public.messages m
+          WHERE m.chat_id = $1 AND m.created_at >= $3 AND m.created_at < $4
+            AND (m.text_tsv @@ websearch_to_tsquery('russian', $2) OR $2 <% m.message_text)
+        )
+        SELECT h.message_id, h.created_at, h.message_text, h.rank, u.username,
+               ar.sentiment, ar.detected_problem
+        FROM hits h
+        JOIN public.users u ON u.user_id = h.user_id
+        LEFT JOIN public.analysis_results ar ON ar.message_id = h.message_id AND ar.created_at = h.created_at
+        WHERE ($5::text IS NULL OR ar.detected_problem = $5)
+          AND ($6::text IS NULL OR ar.sentiment = $6)
+          AND ($7::float8 IS NULL OR (h.rank, h.created_at, h.message_id) < ($7, $8::timestamptz, $9::bigint))
+        ORDER BY h.rank DESC, h.created_at DESC, h.message_id DESC
+        LIMIT $10
+        """
+        rank, ts, mid = cursor if cursor is not None else (None, None, None)
+        async with acquire(self.reader) as con:
+            return await con.fetch(
+                q, chat_id, query, date_from, date_to, problem, sentiment, rank, ts, mid, limit
+            )
+
+    # ---------- выгрузка (/export, manage export) ----------
+    # сообщения периода вместе с автором и результатом анализа (если он есть); chat_id NULL — все чаты
+    _EXPORT_QUERY = """
+    SELECT m.message_id, m.chat_id, m.tg_message_id, m.created_at, m.user_id, u.tg_user_id, u.username,
+           m.message_text, m.response_sec, ar.sentiment, ar.detected_problem, ar.model_version, ar.analysis_date
+    FROM public.messages m
+    JOIN public.users u ON u.user_id = m.user_id
+    LEFT JOIN public.analysis_results ar ON ar.message_id = m.message_id AND ar.created_at = m.created_at
+    WHERE ($1::bigint IS NULL OR m.chat_id = $1) AND m.created_at >= $2 AND m.created_at < $3
+    ORDER BY m.created_at, m.message_id
+    """
+
+    async def copy_export_csv(
+        self, output: Callable[[bytes], Awaitable], chat_id: int | None, date_from: datetime, date_to: datetime
+    ) -> int:
+        # COPY … TO STDOUT: сервер сам формирует CSV, куски по мере готовности уходят в output
+        async with acquire(self.reader) as con:
+            status = await con.copy_from_query(
+                self._EXPORT_QUERY, chat_id, date_from, date_to, output=output, format="csv", header=True
+            )
+        return int(status.split()[-1])
+
+    async def iter_export(
+        self, chat_id: int | None, date_from: datetime, date_to: datetime, chunk_size: int = 10000
+    ) -> AsyncIterator[list]:
+        # серверный курсор: в памяти не больше chunk_size строк, соединение занято до конца выгрузки
+        async with acquire(self.reader) as con:
+            async with con.transaction(isolation="repeatable_read", readonly=True):
+                cur = await con.cursor(self._EXPORT_QUERY, chat_id, date_from, date_to)
+                while True:
+                    rows = await cur.fetch(chunk_size)
+                    if not rows:
+                        return
+                    yield rows
+
+    @observe_db
+    async def list_messages_for_analysis(
+        self, chat_id: int, date_from: datetime, date_to: datetime, model_version: str, limit: int = 200
+    ):
+        # только сообщения без анализа или с анализом от другой версии модели/промпта
+        q = """
+        SELECT m.message_id, m.message_text, m.created_at, u.username
+        FROM public.messages m
+        JOIN public.users u ON u.user_id = m.user_id
+        LEFT JOIN public.analysis_results ar ON ar.message_id = m.message_id AND ar.created_at = m.created_at
+        WHERE m.chat_id=$1 AND m.created_at >= $2 AND m.created_at < $3
+          AND (ar.message_id IS NULL OR ar.model_version <> $4)
+        ORDER BY m.created_at ASC
+        LIMIT $5
+        """
+        async with acquire(self.pool) as con:
+            return await con.fetch(q, chat_id, date_from, date_to, model_version, limit)
+
+    @observe_db
+    async def list_messages_sample(
+        self,
+        chat_id: int,
+        date_from: datetime,
+        date_to: datetime,
+        model_version: str,
+        rate: float,
+        limit: int | None = None,
+    ):
+        # стратифицированная выборка: слой — день UTC × автор, из слоя с N сообщениями берётся
+        # floor(N * rate + u) первых по хешу message_id, где u — псевдослучайный сдвиг слоя из [0, 1).
+        # Вероятность попасть в выборку у каждого сообщения ровно rate, а каждый слой представлен
+        # пропорционально. Выборка детерминирована: повтор с той же долей берёт те же сообщения
+        # (уже проанализированные пропускаются), а с большей долей — расширяет прежнюю.
+        # limit отрезает случайную часть выборки, а не начало периода
+        q = """
+        WITH s AS (
+          SELECT m.message_id, m.message_text, m.created_at, m.user_id,
+                 row_number() OVER (PARTITION BY m.user_id, date_trunc('day', m.created_at, 'UTC')
+                                    ORDER BY hashint8(m.message_id), m.message_id) AS rn,
+                 count(*) OVER (PARTITION BY m.user_id, date_trunc('day', m.created_at, 'UTC')) AS cnt,
+                 (hashtext(m.user_id::text || ':' || date_trunc('day', m.created_at, 'UTC')::date::text)
+                  & 2147483647) / 2147483648.0 AS shift
+          FROM public.messages m
+          WHERE m.chat_id=$1 AND m.created_at >= $2 AND m.created_at < $3
+        )
+        SELECT s.message_id, s.message_text, s.created_at, u.username
+        FROM s
+        JOIN public.users u ON u.user_id = s.user_id
+        LEFT JOIN public.analysis_results ar ON ar.message_id = s.message_id AND ar.created_at = s.created_at
+        WHERE s.rn <= floor(s.cnt * $5::float8 + s.shift)
+          AND (ar.message_id IS NULL OR ar.model_version <> $4)
+        ORDER BY hashint8(s.message_id), s.message_id
+        LIMIT $6
+        """
+        async with acquire(self.pool) as con:
+            return await con.fetch(q, chat_id, date_from, date_to, model_version, float(rate), limit)
+
+    @observe_db
+    async def count_messages(self, chat_id: int, date_from: datetime, date_to: datetime) -> int:
+        q = "SELECT count(*) FROM public.messages WHERE chat_id=$1 AND created_at >= $2 AND created_at < $3"
+        async with acquire(self.reader) as con:
+            return int(await con.fetchval(q, chat_id, date_from, date_to))
+
     # ---------- анализ ----------
-    async def save_analysis(self, message_id: int, sentiment: str, detected_problem: str) -> None:
+    @observe_db
+    async def save_analysis(
+        self, message_id: int, sentiment: str, detected_problem: str, model_version: str = ""
+    ) -> None:
+        await self.save_analyses([(message_id, sentiment, detected_problem)], model_version)
+
+    @observe_db
+    async def save_analyses(self, items: list[tuple[int, str, str]], model_version: str = "") -> None:
+        # пакетная запись: [(message_id, sentiment, detected_problem), ...].
+        # Тем же запросом обновляются дневные агрегаты analysis_rollup_daily:
+        # +1 новому результату и -1 предыдущему, если сообщение анализировалось повторно,
+        # и версии данных затронутых дней (кэш отчётов за эти дни становится неактуальным).
+        # Сообщения с результатом снимаются с analysis_queue: иначе после /analyze их повторно
+        # отправили бы в LLM фоновые воркеры.
+        # Первая запись результата не находит строки для FOR UPDATE: без advisory-локов на сообщения
+        # два одновременных сохранения (воркер очереди и /analyze) оба прибавили бы +1 в агрегаты
+        q = """
+        WITH input AS (
+          SELECT DISTINCT ON (t.message_id)
+                 t.message_id, m.created_at, m.chat_id, m.user_id, t.sentiment, t.detected_problem
+          FROM unnest($1::bigint[], $2::text[], $3::text[]) AS t(message_id, sentiment, detected_problem)
+          JOIN public.messages m ON m.message_id = t.message_id
+          ORDER BY t.message_id
+        ), old AS (
+          SELECT ar.message_id, ar.sentiment, ar.detected_problem
+          FROM public.analysis_results ar
+          JOIN input i ON i.message_id = ar.message_id AND i.created_at = ar.created_at
+          FOR UPDATE OF ar
+        ), upsert AS (
+          INSERT INTO public.analysis_results(
+            message_id, created_at, sentiment, detected_problem, model_version, analysis_date
+          )
+          SELECT message_id, created_at, sentiment, detected_problem, $4, NOW() FROM input
+          ON CONFLICT (message_id, created_at)
+          DO UPDATE SET
+            sentiment = EXCLUDED.sentiment,
+            detected_problem = EXCLUDED.detected_problem,
+            model_version = EXCLUDED.model_version,
+            analysis_date = NOW()
+          RETURNING message_id, sentiment, detected_problem
+        ), delta AS (
+          SELECT i.chat_id, (i.created_at AT TIME ZONE 'UTC')::date AS day, i.user_id,
+                 d.sentiment, d.detected_problem, SUM(d.cnt) AS cnt
+          FROM (
+            SELECT message_id, sentiment, detected_problem, 1 AS cnt FROM upsert
+            UNION ALL
+            SELECT message_id, sentiment, detected_problem, -1 AS cnt FROM old
+          ) d
+          JOIN input i ON i.message_id = d.message_id
+          GROUP BY 1, 2, 3, 4, 5
+          HAVING SUM(d.cnt) <> 0
+        ), bump AS (
+          INSERT INTO public.report_data_versions(chat_id, day)
+          SELECT DISTINCT chat_id, day FROM delta
+          ON CONFLICT (chat_id, day) DO UPDATE SET version = report_data_versions.version + 1
+        ), dequeued AS (
+          DELETE FROM public.analysis_queue q
+          USING input i
+          WHERE q.message_id = i.message_id
+        )
+        INSERT INTO public.analysis_rollup_daily(chat_id, day, user_id, sentiment, detected_problem, cnt)
+        SELECT chat_id, day, user_id, sentiment, detected_problem, cnt FROM delta
+        ON CONFLICT (chat_id, day, user_id, sentiment, detected_problem)
+        DO UPDATE SET
+          cnt = analysis_rollup_daily.cnt + EXCLUDED.cnt,
+          updated_at = NOW()
+        """
+        if not items:
+            return
+        # локи — в порядке ключей, чтобы пачки с общими сообщениями не ждали друг друга по кругу
+        keys = sorted({lock_key("analysis", int(i)) for i, _, _ in items})
+        async with acquire(self.pool) as con:
+            async with con.transaction():
+                await con.execute("SELECT pg_advisory_xact_lock(k) FROM unnest($1::bigint[]) AS k", keys)
+                # основной запрос — уже после локов: его снимок видит результат завершившегося соседа
+                await con.execute(
+                    q,
+                    [int(i) for i, _, _ in items],
+                    [sentiment for _, sentiment, _ in items],
+                    [problem for _, _, problem in items],
+                    model_version,
+                )
+
+    @observe_db
+    async def rebuild_rollups(self, chat_id: int | None = None) -> int:
+        # пересчёт агрегатов из сырых данных (после ручных правок, удаления сообщений и т.п.).
+        # Дни до самого старого хранимого сообщения не трогаем: их секции уже удалены по сроку хранения
+        q_del = """
+        DELETE FROM public.analysis_rollup_daily
+        WHERE ($1::bigint IS NULL OR chat_id = $1)
+          AND day >= COALESCE(
+            (SELECT MIN(created_at AT TIME ZONE 'UTC')::date FROM public.messages
+             WHERE $1::bigint IS NULL OR chat_id = $1),
+            'infinity'::date
+          )
+        """
+        q_ins = """
+        INSERT INTO public.analysis_rollup_daily(chat_id, day, user_id, sentiment, detected_problem, cnt)
+        SELECT m.chat_id, (m.created_at AT TIME ZONE 'UTC')::date, m.user_id,
+               ar.sentiment, ar.detected_problem, COUNT(*)
+        FROM public.analysis_results ar
+        JOIN public.messages m ON m.message_id = ar.message_id AND m.created_at = ar.created_at
+        WHERE $1::bigint IS NULL OR m.chat_id = $1
+        GROUP BY 1, 2, 3, 4, 5
+        """
+        async with acquire(self.pool) as con:
+            async with con.transaction():
+                # блокируем запись агрегатов на время пересчёта, чтобы не потерять параллельные дельты
+                await con.execute("LOCK TABLE public.analysis_rollup_daily IN EXCLUSIVE MODE")
+                await con.execute(q_del, chat_id)
+                status = await con.execute(q_ins, chat_id)
+                await self._drop_cached_reports(con, chat_id)
+        return int(status.split()[-1])
+
+    # ---------- очередь анализа ----------
+    @observe_db
+    async def claim_analysis_jobs(self, limit: int, lease_sec: float, max_attempts: int):
+        # забираем пачку задач под аренду: строки, заблокированные другими воркерами, пропускаются
+        # (SKIP LOCKED), а сдвиг available_at прячет задачу от остальных, пока идёт анализ.
+        # Если воркер упал, задача снова станет доступна после окончания аренды; если это была
+        # последняя попытка — задача помечается проваленной (failed_at) и больше не забирается
+        q = """
+        WITH dead AS (
+          UPDATE public.analysis_queue
+          SET failed_at = now(), last_error = COALESCE(last_error, 'lease expired')
+          WHERE failed_at IS NULL AND available_at <= now() AND attempts >= $3
+        ), c AS (
+          SELECT message_id
+          FROM public.analysis_queue
+          WHERE failed_at IS NULL AND available_at <= now() AND attempts < $3
+          ORDER BY available_at
+          LIMIT $1
+          FOR UPDATE SKIP LOCKED
+        ), upd AS (
+          UPDATE public.analysis_queue q
+          SET available_at = now() + make_interval(secs => $2), attempts = q.attempts + 1
+          FROM c
+          WHERE q.message_id = c.message_id
+          RETURNING q.message_id, q.created_at, q.attempts
+        )
+        SELECT upd.message_id, upd.attempts, m.chat_id, m.message_text, m.created_at
+        FROM upd
+        JOIN public.messages m ON m.message_id = upd.message_id AND m.created_at = upd.created_at
+        ORDER BY m.created_at
+        """
+        async with acquire(self.pool) as con:
+            return await con.fetch(q, limit, float(lease_sec), max_attempts)
+
+    @observe_db
+    async def complete_analysis_jobs(self, message_ids: list[int]) -> None:
+        if not message_ids:
+            return
+        q = "DELETE FROM public.analysis_queue WHERE message_id = ANY($1::bigint[])"
+        async with acquire(self.pool) as con:
+            await con.execute(q, message_ids)
+
+    @observe_db
+    async def release_analysis_jobs(
+        self,
+        message_ids: list[int],
+        error: str,
+        retry_in_sec: float,
+        count_attempt: bool = True,
+        max_attempts: int | None = None,
+    ) -> int:
+        # неудачная попытка: задача вернётся в работу через retry_in_sec.
+        # count_attempt=False — запрос в LLM не отправлялся (открыта цепь), попытка не засчитывается.
+        # Задачи, исчерпавшие max_attempts, помечаются проваленными; возвращается их число
+        if not message_ids:
+            return 0
+        q = """
+        WITH upd AS (
+          UPDATE public.analysis_queue
+          SET available_at = now() + make_interval(secs => $3), last_error = $2,
+              attempts = attempts - CASE WHEN $4 THEN 0 ELSE 1 END,
+              failed_at = CASE WHEN $4 AND attempts >= $5::int THEN now() END
+          WHERE message_id = ANY($1::bigint[])
+          RETURNING failed_at
+        )
+        SELECT count(*) FROM upd WHERE failed_at IS NOT NULL
+        """
+        async with acquire(self.pool) as con:
+            return await con.fetchval(q, message_ids, error, float(retry_in_sec), count_attempt, max_attempts)
+
+    @observe_db
+    async def count_failed_analysis_jobs(self) -> int:
+        q = "SELECT count(*) FROM public.analysis_queue WHERE failed_at IS NOT NULL"
+        async with acquire(self.pool) as con:
+            return await con.fetchval(q)
+
+    @observe_db
+    async def failed_analysis_jobs_summary(self, chat_id: int | None = None):
+        # проваленные задачи по последней ошибке (manage failed-jobs)
+        q = """
+        SELECT q.last_error, count(*) AS cnt, min(q.failed_at) AS first_failed, max(q.failed_at) AS last_failed
+        FROM public.analysis_queue q
+        JOIN public.messages m ON m.message_id = q.message_id AND m.created_at = q.created_at
+        WHERE q.failed_at IS NOT NULL AND ($1::bigint IS NULL OR m.chat_id = $1)
+        GROUP BY q.last_error
+        ORDER BY cnt DESC
+        """
+        async with acquire(self.pool) as con:
+            return await con.fetch(q, chat_id)
+
+    @observe_db
+    async def requeue_failed_analysis_jobs(self, chat_id: int | None = None) -> int:
+        # вернуть проваленные задачи в работу с нуля попыток (например, после починки LLM)
+        q = """
+        UPDATE public.analysis_queue q
+        SET failed_at = NULL, attempts = 0, available_at = now()
+        FROM public.messages m
+        WHERE q.failed_at IS NOT NULL
+          AND m.message_id = q.message_id AND m.created_at = q.created_at
+          AND ($1::bigint IS NULL OR m.chat_id = $1)
+        """
+        async with acquire(self.pool) as con:
+            status = await con.execute(q, chat_id)
+        return int(status.split()[-1])
+
+    @observe_db
+    async def purge_failed_analysis_jobs(self, chat_id: int | None = None) -> int:
+        q = """
+        DELETE FROM public.analysis_queue q
+        USING public.messages m
+        WHERE q.failed_at IS NOT NULL
+          AND m.message_id = q.message_id AND m.created_at = q.created_at
+          AND ($1::bigint IS NULL OR m.chat_id = $1)
+        """
+        async with acquire(self.pool) as con:
+            status = await con.execute(q, chat_id)
+        return int(status.split()[-1])
+
+    @observe_db
+    async def defer_analysis(self, message_ids: list[int], error: str, retry_in_sec: float) -> None:
+        # сообщения, не разобранные в /analyze, передаются фоновым воркерам
+        if not message_ids:
+            return
+        q = """
+        INSERT INTO public.analysis_queue(message_id, created_at, available_at, last_error)
+        SELECT m.message_id, m.created_at, now() + make_interval(secs => $3), $2
+        FROM public.messages m
+        WHERE m.message_id = ANY($1::bigint[])
+        ON CONFLICT (message_id) DO UPDATE SET
+          available_at = GREATEST(public.analysis_queue.available_at, EXCLUDED.available_at),
+          last_error = EXCLUDED.last_error
+        """
+        async with acquire(self.pool) as con:
+            await con.execute(q, message_ids, error, float(retry_in_sec))
+
+    # ---------- фоновые запуски /analyze ----------
+    @observe_db
+    async def create_analyze_run(
+        self,
+        chat_id: int,
+        started_by: int,
+        total: int,
+        date_from: datetime | None = None,
+        date_to: datetime | None = None,
+        sample_rate: float | None = None,
+    ) -> int:
+        # запуски этого чата, оставшиеся running, прерваны: новый запуск идёт под advisory-локом чата.
+        # sample_rate — доля выборки list_messages_sample за период (None — без выборки)
+        q = """
+        WITH lost AS (
+          UPDATE public.analyze_runs SET status = 'interrupted', finished_at = now()
+          WHERE chat_id = $1 AND status = 'running'
+        )
+        INSERT INTO public.analyze_runs(chat_id, started_by, total, date_from, date_to, sample_rate)
+        VALUES ($1, $2, $3, $4, $5, $6)
+        RETURNING run_id
+        """
+        async with acquire(self.pool) as con:
+            return int(await con.fetchval(q, chat_id, started_by, total, date_from, date_to, sample_rate))
+
+    @observe_db
+    async def update_analyze_run(self, run_id: int, processed: int, problems: int, failed: int) -> bool:
+        # ход запуска и heartbeat; возвращает True, если запрошена отмена (/cancel из любого экземпляра)
+        q = """
+        UPDATE public.analyze_runs
+        SET processed = $2, problems = $3, failed = $4, heartbeat_at = now()
+        WHERE run_id = $1
+        RETURNING cancel_requested
+        """
+        async with acquire(self.pool) as con:
+            return bool(await con.fetchval(q, run_id, processed, problems, failed))
+
+    @observe_db
+    async def finish_analyze_run(
+        self, run_id: int, status: str, processed: int, problems: int, failed: int
+    ) -> None:
+        q = """
+        UPDATE public.analyze_runs
+        SET status = $2, processed = $3, problems = $4, failed = $5, heartbeat_at = now(), finished_at = now()
+        WHERE run_id = $1
+        """
+        async with acquire(self.pool) as con:
+            await con.execute(q, run_id, status, processed, problems, failed)
+
+    @observe_db
+    async def request_analyze_cancel(self, run_id: int) -> bool:
+        q = """
+        UPDATE public.analyze_runs SET cancel_requested = true
+        WHERE run_id = $1 AND status = 'running'
+        RETURNING run_id
+        """
+        async with acquire(self.pool) as con:
+            return await con.fetchval(q, run_id) is not None
+
+    @observe_db
+    async def list_analyze_runs(self, limit: int = 10):
+        # идущие запуски всех чатов, затем последние завершённые; живой ход — с основной базы
+        q = """
+        SELECT r.run_id, r.chat_id, c.chat_name, r.status, r.total, r.processed, r.problems, r.failed,
+               r.cancel_requested, r.started_at, r.heartbeat_at, r.finished_at,
+               EXTRACT(EPOCH FROM (now() - r.heartbeat_at)) AS heartbeat_age
+        FROM public.analyze_runs r
+        JOIN public.chats c ON c.chat_id = r.chat_id
+        ORDER BY r.status = 'running' DESC, r.run_id DESC
+        LIMIT $1
+        """
+        async with acquire(self.pool) as con:
+            return await con.fetch(q, limit)
+
+    # ---------- кэш результатов ----------
+    @observe_db
+    async def get_cached_results(self, hashes: list[str], model_version: str, max_age_days: int = 0):
+        # записи старше max_age_days дней не используются (0 — без ограничения)
+        q = """
+        SELECT text_hash, sentiment, detected_problem
+        FROM public.analysis_cache
+        WHERE text_hash = ANY($1::text[]) AND model_version = $2
+          AND ($3::int <= 0 OR created_at >= now() - make_interval(days => $3::int))
+        """
+        async with acquire(self.pool) as con:
+            return await con.fetch(q, hashes, model_version, max_age_days)
+
+    @observe_db
+    async def put_cached_results(self, items: list[tuple[str, str, str]], model_version: str) -> None:
         q = """
-        INSERT INTO public.analysis_results(message_id, sentiment, detected_problem, analysis_date)
-        VALUES ($1, $2, $3, NOW())
-        ON CONFLICT (message_id)
+        INSERT INTO public.analysis_cache(text_hash, model_version, sentiment, detected_problem)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (text_hash, model_version)
         DO UPDATE SET
           sentiment = EXCLUDED.sentiment,
           detected_problem = EXCLUDED.detected_problem,
-          analysis_date = NOW()
+          created_at = NOW()
         """
-        async with self.pool.acquire() as con:
-            await con.execute(q, message_id, sentiment, detected_problem)
+        async with acquire(self.pool) as con:
+            await con.executemany(q, [(h, model_version, sentiment, problem) for h, sentiment, problem in items])
+
+    @observe_db
+    async def purge_analysis_cache(self, older_than_days: int) -> int:
+        if older_than_days <= 0:
+            return 0
+        q = "DELETE FROM public.analysis_cache WHERE created_at < now() - make_interval(days => $1)"
+        async with acquire(self.pool) as con:
+            status = await con.execute(q, older_than_days)
+        return int(status.split()[-1])
 
+    @observe_db
     async def list_issues(self, chat_id: int, date_from: datetime, date_to: datetime, limit: int = 30):
         q = """
         SELECT ar.analysis_date, ar.sentiment, ar.detected_problem,
                m.message_text, m.created_at, u.username
         FROM public.analysis_results ar
-        JOIN public.messages m ON m.message_id = ar.message_id
+        JOIN public.messages m ON m.message_id = ar.message_id AND m.created_at = ar.created_at
         JOIN public.users u ON u.user_id = m.user_id
         WHERE m.chat_id=$1
           AND m.created_at >= $2 AND m.created_at < $3
@@ -129,65 +886,356 @@ class Repo:
         ORDER BY ar.analysis_date DESC
         LIMIT $4
         """
-        async with self.pool.acquire() as con:
+        async with acquire(self.reader) as con:
             return await con.fetch(q, chat_id, date_from, date_to, limit)
 
+    @observe_db
     async def report(self, chat_id: int, date_from: datetime, date_to: datetime):
-        q_agg = """
-        SELECT
-          COUNT(*) AS total_analyzed,
-          SUM(CASE WHEN COALESCE(ar.detected_problem,'') <> '' AND ar.detected_problem <> 'ok'
-                   THEN 1 ELSE 0 END) AS problems
-        FROM public.analysis_results ar
-        JOIN public.messages m ON m.message_id = ar.message_id
-        WHERE m.chat_id=$1 AND m.created_at >= $2 AND m.created_at < $3
-        """
-        q_top = """
-        SELECT ar.detected_problem, COUNT(*) cnt
-        FROM public.analysis_results ar
-        JOIN public.messages m ON m.message_id = ar.message_id
-        WHERE m.chat_id=$1 AND m.created_at >= $2 AND m.created_at < $3
-          AND COALESCE(ar.detected_problem,'') <> ''
-          AND ar.detected_problem <> 'ok'
-        GROUP BY ar.detected_problem
+        # суммируем дневные агрегаты вместо сканирования analysis_results × messages.
+        # Один запрос: разбивка по detected_problem (единицы строк), итоги и топ — из неё
+        day_from, day_to = _day_bounds(date_from, date_to)
+        q = """
+        SELECT detected_problem, SUM(cnt) AS cnt
+        FROM public.analysis_rollup_daily
+        WHERE chat_id=$1 AND day >= $2 AND day < $3
+        GROUP BY detected_problem
+        HAVING SUM(cnt) > 0
         ORDER BY cnt DESC
-        LIMIT 5
         """
-        async with self.pool.acquire() as con:
-            agg = await con.fetchrow(q_agg, chat_id, date_from, date_to)
-            top = await con.fetch(q_top, chat_id, date_from, date_to)
-            return agg, top
+        async with acquire(self.reader) as con:
+            rows = await con.fetch(q, chat_id, day_from, day_to)
+        top = [r for r in rows if r["detected_problem"] not in ("", "ok")]
+        agg = {
+            "total_analyzed": sum(int(r["cnt"]) for r in rows),
+            "problems": sum(int(r["cnt"]) for r in top),
+        }
+        return agg, top[:5]
+
+    @observe_db
+    async def sample_strata(self, chat_id: int, date_from: datetime, date_to: datetime):
+        # слои для оценки доли проблемных по выборке: по дням — всего сообщений,
+        # проанализировано и проблемных (из дневных агрегатов)
+        day_from, day_to = _day_bounds(date_from, date_to)
+        q = """
+        WITH msg AS (
+          SELECT (created_at AT TIME ZONE 'UTC')::date AS day, count(*) AS messages
+          FROM public.messages
+          WHERE chat_id=$1 AND created_at >= $2::date::timestamp AT TIME ZONE 'UTC'
+            AND created_at < $3::date::timestamp AT TIME ZONE 'UTC'
+          GROUP BY 1
+        ), res AS (
+          SELECT day,
+                 SUM(cnt) AS analyzed,
+                 SUM(cnt) FILTER (WHERE detected_problem <> '' AND detected_problem <> 'ok') AS problems
+          FROM public.analysis_rollup_daily
+          WHERE chat_id=$1 AND day >= $2 AND day < $3
+          GROUP BY day
+        )
+        SELECT COALESCE(msg.day, res.day) AS day,
+               COALESCE(msg.messages, 0) AS messages,
+               COALESCE(res.analyzed, 0) AS analyzed,
+               COALESCE(res.problems, 0) AS problems
+        FROM msg
+        FULL JOIN res ON res.day = msg.day
+        ORDER BY 1
+        """
+        async with acquire(self.reader) as con:
+            return await con.fetch(q, chat_id, day_from, day_to)
 
+    @observe_db
+    async def covering_sample_rate(self, chat_id: int, date_from: datetime, date_to: datetime) -> float | None:
+        # доля самой полной завершённой выборки /analyze, период которой покрывает [date_from, date_to);
+        # None — такой нет (анализ первых сообщений периода или очередью — не случайная выборка)
+        q = """
+        SELECT MAX(sample_rate)
+        FROM public.analyze_runs
+        WHERE chat_id=$1 AND status = 'done' AND sample_rate IS NOT NULL
+          AND date_from <= $2 AND date_to >= $3
+        """
+        async with acquire(self.reader) as con:
+            rate = await con.fetchval(q, chat_id, date_from, date_to)
+        return None if rate is None else float(rate)
+
+    @observe_db
     async def response_time_stats(self, chat_id: int, start: datetime, end: datetime):
-        # “ответ” = первое следующее сообщение ДРУГОГО пользователя (не обязательно Reply)
+        # “ответ” = первое следующее сообщение ДРУГОГО пользователя (не обязательно Reply).
+        # Время ответа считается один раз при приёме сообщений (update_response_times),
+        # здесь только сливаются дневные гистограммы за период
+        day_from, day_to = _day_bounds(start, end)
+        q = """
+        SELECT bucket, SUM(cnt) AS cnt, SUM(sum_sec) AS sum_sec
+        FROM public.response_time_hist_daily
+        WHERE chat_id = $1 AND day >= $2 AND day < $3
+        GROUP BY bucket
+        """
+        async with acquire(self.reader) as con:
+            rows = await con.fetch(q, chat_id, day_from, day_to)
+
+        hist = Histogram()
+        for r in rows:
+            hist.add(int(r["bucket"]), int(r["cnt"]), float(r["sum_sec"]))
+        return {
+            "responded_cnt": hist.total,
+            "avg_sec": hist.mean,
+            "median_sec": hist.quantile(0.5),
+            "p90_sec": hist.quantile(0.9),
+            "p99_sec": hist.quantile(0.99),
+        }
+
+    @observe_db
+    async def update_response_times(self, chat_ids: list[int], horizon_sec: float = 7 * 86400) -> int:
+        # Оконный проход по новым сообщениям: сообщения чата идут «сериями» одного автора,
+        # ответ на каждое сообщение серии — первое сообщение следующей серии.
+        # Проход начинается с самого старого ещё не отвеченного сообщения (не старше horizon_sec),
+        # посчитанное время записывается в messages.response_sec и в дневную гистограмму
         q = """
-        WITH msgs AS (
-          SELECT message_id, user_id, created_at, message_text
+        WITH pending AS (
+          SELECT chat_id, MIN(created_at) AS since
           FROM public.messages
-          WHERE chat_id = $1
-            AND created_at >= $2 AND created_at < $3
+          WHERE chat_id = ANY($1::bigint[])
+            AND response_sec IS NULL
+            AND created_at >= now() - make_interval(secs => $2)
             AND message_text NOT LIKE '/%'
-        ),
-        paired AS (
-          SELECT
-            m1.message_id,
-            EXTRACT(EPOCH FROM (m2.created_at - m1.created_at)) AS response_sec
-          FROM msgs m1
-          LEFT JOIN LATERAL (
-            SELECT created_at
-            FROM msgs m2
-            WHERE m2.created_at > m1.created_at
-              AND m2.user_id <> m1.user_id
-            ORDER BY m2.created_at
-            LIMIT 1
-          ) m2 ON TRUE
-        )
-        SELECT
-          COUNT(*) FILTER (WHERE response_sec IS NOT NULL) AS responded_cnt,
-          AVG(response_sec) FILTER (WHERE response_sec IS NOT NULL) AS avg_sec,
-          PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY response_sec)
-            FILTER (WHERE response_sec IS NOT NULL) AS median_sec
-        FROM paired;
-        """
-        async with self.pool.acquire() as con:
-            return await con.fetchrow(q, chat_id, start, end)
+          GROUP BY chat_id
+        ), w AS (
+          SELECT m.message_id, m.chat_id, m.created_at,
+                 CASE WHEN m.user_id IS DISTINCT FROM LAG(m.user_id) OVER o THEN 1 ELSE 0 END AS run_start
+          FROM public.messages m
+          JOIN pending p ON p.chat_id = m.chat_id AND m.created_at >= p.since
+          WHERE m.message_text NOT LIKE '/%'
+          WINDOW o AS (PARTITION BY m.chat_id ORDER BY m.created_at, m.message_id)
+        ), runs AS (
+          SELECT message_id, chat_id, created_at,
+                 SUM(run_start) OVER (PARTITION BY chat_id ORDER BY created_at, message_id) AS run_id
+          FROM w
+        ), firsts AS (
+          SELECT chat_id, run_id, MIN(created_at) AS first_at
+          FROM runs
+          GROUP BY chat_id, run_id
+        ), upd AS (
+          UPDATE public.messages m
+          SET response_sec = EXTRACT(EPOCH FROM (f.first_at - r.created_at))
+          FROM runs r
+          JOIN firsts f ON f.chat_id = r.chat_id AND f.run_id = r.run_id + 1
+          WHERE m.message_id = r.message_id AND m.created_at = r.created_at AND m.response_sec IS NULL
+          RETURNING m.chat_id, m.created_at, m.response_sec
+        ), bump AS (
+          INSERT INTO public.report_data_versions(chat_id, day)
+          SELECT DISTINCT chat_id, (created_at AT TIME ZONE 'UTC')::date FROM upd
+          ON CONFLICT (chat_id, day) DO UPDATE SET version = report_data_versions.version + 1
+        )
+        INSERT INTO public.response_time_hist_daily(chat_id, day, bucket, cnt, sum_sec)
+        SELECT chat_id, (created_at AT TIME ZONE 'UTC')::date,
+               LEAST(FLOOR(LN(1 + GREATEST(response_sec, 0)) * $3)::int, $4),
+               COUNT(*), SUM(response_sec)
+        FROM upd
+        GROUP BY 1, 2, 3
+        ON CONFLICT (chat_id, day, bucket)
+        DO UPDATE SET
+          cnt = response_time_hist_daily.cnt + EXCLUDED.cnt,
+          sum_sec = response_time_hist_daily.sum_sec + EXCLUDED.sum_sec
+        """
+        if not chat_ids:
+            return 0
+        async with acquire(self.pool) as con:
+            status = await con.execute(q, list(chat_ids), float(horizon_sec), BUCKETS_PER_E, MAX_BUCKET)
+        return int(status.split()[-1])
+
+    @observe_db
+    async def rebuild_response_times(self, chat_id: int | None = None) -> None:
+        # полный пересчёт времени ответа и гистограмм (первичное заполнение, ручные правки)
+        async with acquire(self.pool) as con:
+            if chat_id is None:
+                chat_ids = [int(r["chat_id"]) for r in await con.fetch("SELECT chat_id FROM public.chats")]
+            else:
+                chat_ids = [chat_id]
+            async with con.transaction():
+                await con.execute(
+                    "UPDATE public.messages SET response_sec = NULL "
+                    "WHERE chat_id = ANY($1::bigint[]) AND response_sec IS NOT NULL",
+                    chat_ids,
+                )
+                # как и в rebuild_rollups, гистограммы месяцев, удалённых по сроку хранения, остаются
+                await con.execute(
+                    """
+                    DELETE FROM public.response_time_hist_daily h
+                    USING (
+                      SELECT chat_id, MIN(created_at AT TIME ZONE 'UTC')::date AS since
+                      FROM public.messages
+                      WHERE chat_id = ANY($1::bigint[])
+                      GROUP BY chat_id
+                    ) m
+                    WHERE h.chat_id = m.chat_id AND h.day >= m.since
+                    """,
+                    chat_ids,
+                )
+                for cid in chat_ids:
+                    await self._drop_cached_reports(con, cid)
+        for cid in chat_ids:
+            await self.update_response_times([cid], horizon_sec=100 * 365 * 86400)
+
+    # ---------- тренды (/trends, /user) ----------
+    @observe_db
+    async def problem_trend(
+        self, chat_id: int, day_from: date, day_to: date, user_ids: list[int] | None = None
+    ):
+        # по дням из analysis_rollup_daily: всего, проблемных и скользящие суммы за 7 и 30 дней.
+        # Окна считаются по сплошному ряду дней (generate_series), начиная за 29 дней до day_from,
+        # чтобы первые дни периода тоже имели полное окно
+        q = """
+        WITH days AS (
+          SELECT d::date AS day
+          FROM generate_series($2::date - 29, $3::date - 1, INTERVAL '1 day') AS d
+        ), agg AS (
+          SELECT day,
+                 SUM(cnt) AS total,
+                 SUM(cnt) FILTER (WHERE detected_problem <> '' AND detected_problem <> 'ok') AS problems
+          FROM public.analysis_rollup_daily
+          WHERE chat_id = $1 AND day >= $2::date - 29 AND day < $3
+            AND ($4::bigint[] IS NULL OR user_id = ANY($4::bigint[]))
+          GROUP BY day
+        ), w AS (
+          SELECT d.day,
+                 COALESCE(a.total, 0) AS total,
+                 COALESCE(a.problems, 0) AS problems,
+                 SUM(COALESCE(a.total, 0)) OVER w7 AS total_7d,
+                 SUM(COALESCE(a.problems, 0)) OVER w7 AS problems_7d,
+                 SUM(COALESCE(a.total, 0)) OVER w30 AS total_30d,
+                 SUM(COALESCE(a.problems, 0)) OVER w30 AS problems_30d
+          FROM days d
+          LEFT JOIN agg a ON a.day = d.day
+          WINDOW w7 AS (ORDER BY d.day ROWS BETWEEN 6 PRECEDING AND CURRENT ROW),
+                 w30 AS (ORDER BY d.day ROWS BETWEEN 29 PRECEDING AND CURRENT ROW)
+        )
+        SELECT * FROM w WHERE day >= $2 ORDER BY day
+        """
+        async with acquire(self.reader) as con:
+            return await con.fetch(q, chat_id, day_from, day_to, user_ids)
+
+    @observe_db
+    async def problem_trend_hourly(
+        self, chat_id: int, date_from: datetime, date_to: datetime, user_ids: list[int] | None = None
+    ):
+        # по часам дневных агрегатов нет — группировка сырых результатов за период
+        # (индекс (chat_id, created_at, message_id) и только секции нужных месяцев)
+        q = """
+        SELECT date_trunc('hour', m.created_at, 'UTC') AS hour,
+               COUNT(*) AS total,
+               COUNT(*) FILTER (WHERE ar.detected_problem <> '' AND ar.detected_problem <> 'ok') AS problems
+        FROM public.messages m
+        JOIN public.analysis_results ar ON ar.message_id = m.message_id AND ar.created_at = m.created_at
+        WHERE m.chat_id = $1 AND m.created_at >= $2 AND m.created_at < $3
+          AND ($4::bigint[] IS NULL OR m.user_id = ANY($4::bigint[]))
+        GROUP BY 1
+        ORDER BY 1
+        """
+        async with acquire(self.reader) as con:
+            return await con.fetch(q, chat_id, date_from, date_to, user_ids)
+
+    @observe_db
+    async def distribution(
+        self, chat_id: int, day_from: date, day_to: date, by: str, user_ids: list[int] | None = None
+    ):
+        # [(значение, cnt)] по sentiment или detected_problem за период, по убыванию
+        if by not in ("sentiment", "detected_problem"):
+            raise ValueError(f"unknown distribution column: {by}")
+        q = f"""
+        SELECT {by} AS value, SUM(cnt) AS cnt
+        FROM public.analysis_rollup_daily
+        WHERE chat_id = $1 AND day >= $2 AND day < $3
+          AND ($4::bigint[] IS NULL OR user_id = ANY($4::bigint[]))
+        GROUP BY {by}
+        HAVING SUM(cnt) > 0
+        ORDER BY cnt DESC
+        """
+        async with acquire(self.reader) as con:
+            return await con.fetch(q, chat_id, day_from, day_to, user_ids)
+
+    @observe_db
+    async def user_problem_counts(self, chat_id: int, day_from: date, day_to: date, limit: int = 10):
+        # пользователи с наибольшим числом проблемных сообщений за период
+        q = """
+        SELECT r.user_id, u.username,
+               SUM(r.cnt) AS total,
+               SUM(r.cnt) FILTER (WHERE r.detected_problem <> '' AND r.detected_problem <> 'ok') AS problems
+        FROM public.analysis_rollup_daily r
+        JOIN public.users u ON u.user_id = r.user_id
+        WHERE r.chat_id = $1 AND r.day >= $2 AND r.day < $3
+        GROUP BY r.user_id, u.username
+        HAVING SUM(r.cnt) FILTER (WHERE r.detected_problem <> '' AND r.detected_problem <> 'ok') > 0
+        ORDER BY problems DESC, total DESC
+        LIMIT $4
+        """
+        async with acquire(self.reader) as con:
+            return await con.fetch(q, chat_id, day_from, day_to, limit)
+
+    @observe_db
+    async def find_users(self, username: str):
+        # по имени без учёта регистра и ведущего @ (одно имя может быть у нескольких записей)
+        q = "SELECT user_id, tg_user_id, username FROM public.users WHERE lower(username) = lower($1)"
+        async with acquire(self.reader) as con:
+            return await con.fetch(q, username.lstrip("@"))
+
+    # ---------- кэш отчётов ----------
+    @observe_db
+    async def get_cached_report(self, chat_id: int, day_from: date, day_to: date) -> tuple[int, str | None]:
+        # текущая версия данных периода и готовый отчёт для неё (None — нет или устарел);
+        # один запрос: версия считается по report_data_versions, отчёт ищется по ней
+        q = """
+        WITH v AS (
+          SELECT COALESCE(SUM(version), 0)::bigint AS data_version
+          FROM public.report_data_versions
+          WHERE chat_id = $1 AND day >= $2 AND day < $3
+        )
+        SELECT v.data_version, c.payload
+        FROM v
+        LEFT JOIN public.report_cache c
+          ON c.chat_id = $1 AND c.day_from = $2 AND c.day_to = $3 AND c.data_version = v.data_version
+        """
+        async with acquire(self.reader) as con:
+            row = await con.fetchrow(q, chat_id, day_from, day_to)
+        return int(row["data_version"]), row["payload"]
+
+    @observe_db
+    async def put_cached_report(
+        self, chat_id: int, day_from: date, day_to: date, data_version: int, payload: str
+    ) -> None:
+        # записи того же периода с другой версией больше не нужны
+        q = """
+        WITH old AS (
+          DELETE FROM public.report_cache
+          WHERE chat_id = $1 AND day_from = $2 AND day_to = $3 AND data_version <> $4
+        )
+        INSERT INTO public.report_cache(chat_id, day_from, day_to, data_version, payload)
+        VALUES ($1, $2, $3, $4, $5::jsonb)
+        ON CONFLICT (chat_id, day_from, day_to, data_version) DO NOTHING
+        """
+        async with acquire(self.pool) as con:
+            await con.execute(q, chat_id, day_from, day_to, data_version, payload)
+
+    async def _drop_cached_reports(self, con, chat_id: int | None) -> None:
+        # после пересчёта агрегатов версии дней могут не измениться — кэш чата удаляется целиком
+        await con.execute(
+            "DELETE FROM public.report_cache WHERE $1::bigint IS NULL OR chat_id = $1", chat_id
+        )
+
+    @observe_db
+    async def purge_report_cache(self, older_than_days: int) -> int:
+        q = "DELETE FROM public.report_cache WHERE computed_at < now() - make_interval(days => $1)"
+        async with acquire(self.pool) as con:
+            status = await con.execute(q, older_than_days)
+        return int(status.split()[-1])
+
+    @observe_db
+    async def active_chats(self, since: datetime) -> list:
+        # чаты, в которых были сообщения после since (по индексу (chat_id, created_at, message_id))
+        q = """
+        SELECT c.chat_id, c.chat_name
+        FROM public.chats c
+        WHERE EXISTS (
+          SELECT 1 FROM public.messages m WHERE m.chat_id = c.chat_id AND m.created_at >= $1
+        )
+        ORDER BY c.chat_id
+        """
+        async with acquire(self.reader) as con:
+            return await con.fetch(q, since)
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import logging
+from datetime import date, datetime, time, timedelta
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramAPIError
+
+from .locks import run_exclusive
+from .repo import UTC, Repo
+from .sampling import stratified_estimate
+
+logger = logging.getLogger(__name__)
+
+SENTIMENT_RU = {
+    "positive": "положительная",
+    "neutral": "нейтральная",
+    "negative": "негативная",
+}
+
+PROBLEM_RU = {
+    "ok": "нет нарушений",
+    "aggressive_tone": "агрессивный тон",
+    "toxic": "токсичность",
+    "impolite": "невежливость",
+    "unclear": "неясное сообщение",
+    "off_topic": "не по теме",
+}
+
+# стандартные периоды: столько полных дней UTC, последний — вчера
+STANDARD_RANGES = {"day": 1, "week": 7}
+TEXT_LIMIT = 4000  # Telegram режет сообщения длиннее 4096 символов
+
+
+def standard_range(name: str, today: date | None = None) -> tuple[date, date]:
+    # [day_from, day_to) — day_to не включается
+    today = today or datetime.now(UTC).date()
+    return today - timedelta(days=STANDARD_RANGES[name]), today
+
+
+def _day_start(day: date) -> datetime:
+    return datetime.combine(day, time(0), UTC)
+
+
+async def compute_report(repo: Repo, chat_id: int, day_from: date, day_to: date) -> dict:
+    # данные отчёта в виде, пригодном для JSON (хранится в report_cache.payload)
+    # запросы идут параллельно на разных соединениях пула чтения — задержка одного round-trip
+    start, end = _day_start(day_from), _day_start(day_to)
+    (agg, top), rt, sample_rate = await asyncio.gather(
+        repo.report(chat_id, start, end),
+        repo.response_time_stats(chat_id, start, end),
+        repo.covering_sample_rate(chat_id, start, end),
+    )
+    # доля проблемных оценивается, только если период покрыт завершённой выборкой /analyze sample=…:
+    # первые сообщения периода или отставшая очередь — не случайная выборка. Сообщения по дням
+    # считаются лишь в этом случае
+    estimate = None
+    if sample_rate is not None:
+        strata = await repo.sample_strata(chat_id, start, end)
+        if sum(int(r["analyzed"]) for r in strata) < sum(int(r["messages"]) for r in strata):
+            estimate = stratified_estimate(
+                [(int(r["messages"]), int(r["analyzed"]), int(r["problems"])) for r in strata]
+            )
+    return {
+        "total": int(agg["total_analyzed"] or 0),
+        "problems": int(agg["problems"] or 0),
+        "top": [[r["detected_problem"], int(r["cnt"])] for r in top],
+        "responded": int(rt["responded_cnt"] or 0),
+        "avg_sec": rt["avg_sec"],
+        "median_sec": rt["median_sec"],
+        "p90_sec": rt["p90_sec"],
+        "p99_sec": rt["p99_sec"],
+        "estimate": estimate,
+    }
+
+
+async def get_report(repo: Repo, chat_id: int, day_from: date, day_to: date) -> tuple[dict, bool]:
+    # (отчёт, взят ли из кэша). Версия данных читается до расчёта: если за время расчёта
+    # придут новые результаты, сохранённая запись просто не совпадёт со следующей версией
+    version, payload = await repo.get_cached_report(chat_id, day_from, day_to)
+    if payload is not None:
+        return json.loads(payload), True
+    data = await compute_report(repo, chat_id, day_from, day_to)
+    await repo.put_cached_report(chat_id, day_from, day_to, version, json.dumps(data))
+    return data, False
+
+
+def format_report(data: dict, day_from: date, day_to: date, chat_name: str | None = None) -> str:
+    last = day_to - timedelta(days=1)
+    title = f"Отчёт за {day_from:%Y-%m-%d} — {last:%Y-%m-%d}"
+    if chat_name:
+        title += f" ({chat_name})"
+    lines = [
+        title,
+        f"Проанализировано: {data['total']}",
+        f"Проблемных: {data['problems']}",
+    ]
+    # в кэше могут быть отчёты, посчитанные до появления оценки
+    est = data.get("estimate")
+    if est:
+        lines += [
+            f"Сообщений за период: {est['messages']}, проанализировано {100.0 * est['analyzed'] / est['messages']:.1f}%",
+            f"Оценка доли проблемных: {100.0 * est['rate']:.1f}% "
+            f"({est['confidence']}% ДИ {100.0 * est['lo']:.1f}–{100.0 * est['hi']:.1f}%), "
+            f"≈ {round(est['rate'] * est['messages'])} сообщений",
+        ]
+        if est["covered"] < 1:
+            lines.append(f"Оценка по дням с анализом: {100.0 * est['covered']:.0f}% сообщений периода")
+    lines += ["", "Топ проблем:"]
+
+    if data["top"]:
+        for problem, cnt in data["top"]:
+            lines.append(f"- {PROBLEM_RU.get(problem, problem)}: {cnt}")
+    else:
+        lines.append("- (нет)")
+
+    lines += [
+        "",
+        "Скорость ответа (следующее сообщение от другого пользователя):",
+        f"Ответов найдено: {data['responded']}",
+    ]
+
+    if data["responded"] == 0:
+        lines += ["Среднее время ответа: нет данных", "Медиана времени ответа: нет данных"]
+    else:
+        lines += [
+            f"Среднее время ответа: {float(data['avg_sec']):.1f} сек",
+            f"Медиана времени ответа: {float(data['median_sec']):.1f} сек",
+            f"90-й / 99-й перцентиль: {float(data['p90_sec']):.1f} / {float(data['p99_sec']):.1f} сек",
+        ]
+    return "\n".join(lines)
+
+
+def split_messages(texts: list[str], sep: str = "\n\n") -> list[str]:
+    # склеивает куски текста в сообщения не длиннее TEXT_LIMIT
+    out, cur = [], ""
+    for t in texts:
+        if cur and len(cur) + len(sep) + len(t) > TEXT_LIMIT:
+            out.append(cur)
+            cur = ""
+        cur = cur + sep + t if cur else t
+    if cur:
+        out.append(cur)
+    return out
+
+
+class ReportScheduler:
+    # раз в сутки в hour:00 UTC (вне часов пик) считает отчёты за вчера и за неделю по всем чатам
+    # с сообщениями за неделю, кладёт их в report_cache и рассылает админам дайджест:
+    # дневной — каждый день, недельный — в день недели weekly_day (0 — понедельник)
+    def __init__(
+        self,
+        repo: Repo,
+        bot: Bot | None,
+        admin_ids: set[int],
+        hour: int = 3,
+        weekly_day: int = 0,
+        digest: bool = True,
+        keep_days: int = 30,
+        cache_days: int = 0,
+    ):
+        self.repo = repo
+        self.bot = bot
+        self.admin_ids = admin_ids
+        self.hour = hour
+        self.weekly_day = weekly_day
+        self.digest = digest and bot is not None
+        self.keep_days = keep_days
+        self.cache_days = cache_days
+
+    def next_run(self, now: datetime) -> datetime:
+        run_at = datetime.combine(now.date(), time(self.hour), UTC)
+        return run_at if run_at > now else run_at + timedelta(days=1)
+
+    async def run_once(self, today: date | None = None) -> int:
+        # возвращает число чатов, для которых посчитаны отчёты
+        today = today or datetime.now(UTC).date()
+        ranges = ["day", "week"]
+        pushed = ranges if today.weekday() == self.weekly_day else ["day"]
+        chats = await self.repo.active_chats(_day_start(today - timedelta(days=STANDARD_RANGES["week"])))
+
+        digests = []
+        for chat in chats:
+            for name in ranges:
+                day_from, day_to = standard_range(name, today)
+                try:
+                    data, _ = await get_report(self.repo, int(chat["chat_id"]), day_from, day_to)
+                except Exception:
+                    logger.exception("report precompute failed for chat_id=%s", chat["chat_id"])
+                    continue
+                if name in pushed and (data["total"] or data["responded"]):
+                    digests.append(format_report(data, day_from, day_to, chat["chat_name"]))
+
+        if self.digest and digests:
+            await self._push(digests)
+        purged = await self.repo.purge_report_cache(self.keep_days)
+        # заодно — устаревшие записи кэша результатов анализа (ANALYSIS_CACHE_DAYS)
+        expired = await self.repo.purge_analysis_cache(self.cache_days)
+        logger.info(
+            "reports precomputed for %d chat(s), %d digest(s), %d stale purged, %d cached results expired",
+            len(chats), len(digests), purged, expired,
+        )
+        return len(chats)
+
+    async def _push(self, digests: list[str]) -> None:
+        # админ должен хотя бы раз написать боту в личку, иначе Telegram не даст отправить сообщение
+        for admin_id in sorted(self.admin_ids):
+            for text in split_messages(digests):
+                try:
+                    await self.bot.send_message(admin_id, text)
+                except TelegramAPIError as e:
+                    logger.warning("digest to %s failed: %s", admin_id, e)
+                    break
+
+    async def run(self, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            now = datetime.now(UTC)
+            try:
+                await asyncio.wait_for(stop.wait(), (self.next_run(now) - now).total_seconds())
+                return
+            except asyncio.TimeoutError:
+                pass
+            # при нескольких экземплярах бота отчёты считает и рассылает один из них
+            today = datetime.now(UTC).date()
+            try:
+                await run_exclusive(self.repo.pool, "reports", today.isoformat(), lambda: self.run_once(today))
+            except Exception:
+                logger.exception("report scheduler run failed")
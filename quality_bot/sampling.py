@@ -0,0 +1,64 @@
+import math
+
+# z-квантили нормального распределения для двусторонних интервалов
+Z_SCORES = {90: 1.645, 95: 1.96, 99: 2.576}
+# доверие по умолчанию для /analyze margin=… и интервалов в /report
+DEFAULT_CONFIDENCE = 95
+
+
+def parse_percent(value: str) -> float:
+    # "5%", "5", "0.5%" -> доля 0..1
+    p = float(value.rstrip("%").replace(",", ".")) / 100
+    if not 0 < p <= 1:
+        raise ValueError(f"percent out of range: {value}")
+    return p
+
+
+def sample_size(population: int, margin: float, confidence: int = DEFAULT_CONFIDENCE, p: float = 0.5) -> int:
+    # объём выборки для оценки доли с погрешностью ±margin; p=0.5 — худший случай.
+    # С поправкой на конечную совокупность: для небольших периодов нужно заметно меньше сообщений
+    if population <= 0:
+        return 0
+    z = Z_SCORES[confidence]
+    n0 = z * z * p * (1 - p) / (margin * margin)
+    return min(population, math.ceil(n0 / (1 + (n0 - 1) / population)))
+
+
+def stratified_estimate(strata, confidence: int = DEFAULT_CONFIDENCE) -> dict | None:
+    # оценка доли проблемных по слоям (дням): strata — [(сообщений, проанализировано, проблемных)].
+    # Доля слоя взвешивается числом его сообщений, дисперсия — с поправкой на конечный слой.
+    # Слои без проанализированных сообщений в оценку не входят (covered — доля сообщений в покрытых слоях).
+    # Интервал — Вильсона по эффективному объёму выборки, чтобы не вырождаться при доле около 0
+    covered = [(N, n, k) for N, n, k in strata if n > 0 and N > 0]
+    total = sum(N for N, _, _ in strata)
+    covered_total = sum(N for N, _, _ in covered)
+    if not covered_total:
+        return None
+    rate, var = 0.0, 0.0
+    for N, n, k in covered:
+        n = min(n, N)
+        w = N / covered_total
+        p = min(k / n, 1.0)
+        rate += w * p
+        if n > 1:
+            var += w * w * (1 - n / N) * p * (1 - p) / (n - 1)
+    analyzed = sum(min(n, N) for N, n, _ in covered)
+
+    z = Z_SCORES[confidence]
+    n_eff = rate * (1 - rate) / var if var > 0 else analyzed
+    if analyzed >= covered_total:
+        lo = hi = rate
+    else:
+        denom = 1 + z * z / n_eff
+        center = (rate + z * z / (2 * n_eff)) / denom
+        half = z * math.sqrt(rate * (1 - rate) / n_eff + z * z / (4 * n_eff * n_eff)) / denom
+        lo, hi = max(0.0, center - half), min(1.0, center + half)
+    return {
+        "rate": rate,
+        "lo": lo,
+        "hi": hi,
+        "confidence": confidence,
+        "messages": total,
+        "analyzed": analyzed,
+        "covered": covered_total / total,
+    }
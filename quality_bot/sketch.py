@@ -0,0 +1,47 @@
+import math
+from collections import defaultdict
+
+# Логарифмические корзины для времени ответа: корзина i покрывает
+# [exp(i/K) - 1, exp((i+1)/K) - 1) секунд, т.е. относительная ширина ~5% при K=20.
+# Формула продублирована в SQL (Repo.update_response_times) — менять только вместе
+BUCKETS_PER_E = 20
+MAX_BUCKET = 300  # exp(300/20) - 1 ≈ 38 суток; всё, что дольше, попадает в последнюю корзину
+
+
+def bucket_of(sec: float) -> int:
+    return min(int(math.floor(math.log1p(max(sec, 0.0)) * BUCKETS_PER_E)), MAX_BUCKET)
+
+
+def bucket_bounds(bucket: int) -> tuple[float, float]:
+    return math.expm1(bucket / BUCKETS_PER_E), math.expm1((bucket + 1) / BUCKETS_PER_E)
+
+
+class Histogram:
+    # сливаемая гистограмма: дневные строки из БД складываются в одну за любой период
+    def __init__(self):
+        self.counts: dict[int, int] = defaultdict(int)
+        self.total = 0
+        self.sum = 0.0
+
+    def add(self, bucket: int, cnt: int, sum_sec: float) -> None:
+        self.counts[bucket] += cnt
+        self.total += cnt
+        self.sum += sum_sec
+
+    @property
+    def mean(self) -> float | None:
+        return self.sum / self.total if self.total else None
+
+    def quantile(self, q: float) -> float | None:
+        # линейная интерполяция внутри корзины
+        if not self.total:
+            return None
+        rank = q * self.total
+        seen = 0
+        for bucket in sorted(self.counts):
+            cnt = self.counts[bucket]
+            if seen + cnt >= rank:
+                lo, hi = bucket_bounds(bucket)
+                return lo + (hi - lo) * ((rank - seen) / cnt if cnt else 0.0)
+            seen += cnt
+        return bucket_bounds(max(self.counts))[1]
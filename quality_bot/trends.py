@@ -0,0 +1,87 @@
+from datetime import date, timedelta
+
+from .reports import PROBLEM_RU, SENTIMENT_RU
+
+# /trends и /user без дат — последние DEFAULT_DAYS дней, включая сегодня
+DEFAULT_DAYS = 30
+# почасовой ряд строится по сырым результатам, поэтому период ограничен
+MAX_HOURLY_DAYS = 7
+
+
+def _rate(problems: int, total: int) -> str:
+    return f"{100.0 * problems / total:.1f}%" if total else "—"
+
+
+def format_daily(rows, only_active: bool = False) -> list[str]:
+    # день: проблемных/всего (доля) и доля за скользящие 7 и 30 дней
+    lines = []
+    for r in rows:
+        total, problems = int(r["total"]), int(r["problems"])
+        if only_active and not total:
+            continue
+        lines.append(
+            f"{r['day']:%Y-%m-%d}: {problems}/{total} ({_rate(problems, total)})"
+            f" · 7 дн. {_rate(int(r['problems_7d']), int(r['total_7d']))}"
+            f" · 30 дн. {_rate(int(r['problems_30d']), int(r['total_30d']))}"
+        )
+    return lines
+
+
+def format_hourly(rows) -> list[str]:
+    return [
+        f"{r['hour']:%Y-%m-%d %H}:00: {int(r['problems'])}/{int(r['total'])}"
+        f" ({_rate(int(r['problems']), int(r['total']))})"
+        for r in rows
+    ]
+
+
+def format_distribution(rows, names: dict[str, str], skip: tuple[str, ...] = ()) -> list[str]:
+    rows = [r for r in rows if r["value"] not in skip]
+    total = sum(int(r["cnt"]) for r in rows)
+    if not rows:
+        return ["- (нет)"]
+    return [
+        f"- {names.get(r['value'], r['value'])}: {int(r['cnt'])} ({_rate(int(r['cnt']), total)})"
+        for r in rows
+    ]
+
+
+def format_users(rows) -> list[str]:
+    if not rows:
+        return ["- (нет)"]
+    out = []
+    for r in rows:
+        total, problems = int(r["total"]), int(r["problems"])
+        out.append(f"- {r['username']}: {problems} из {total} ({_rate(problems, total)})")
+    return out
+
+
+def trends_text(
+    day_from: date, day_to: date, series: list[str], sentiments, users, hourly: bool = False
+) -> list[str]:
+    last = day_to - timedelta(days=1)
+    lines = [
+        f"Тренды за {day_from:%Y-%m-%d} — {last:%Y-%m-%d}",
+        "",
+        "Проблемные / все по часам (UTC):" if hourly else "Проблемные / все по дням:",
+    ]
+    lines += series or ["- (нет данных)"]
+    lines += ["", "Тональность:"] + format_distribution(sentiments, SENTIMENT_RU)
+    lines += ["", "Больше всего проблем:"] + format_users(users)
+    return lines
+
+
+def user_text(username: str, day_from: date, day_to: date, daily, sentiments, problems) -> list[str]:
+    last = day_to - timedelta(days=1)
+    total = sum(int(r["total"]) for r in daily)
+    bad = sum(int(r["problems"]) for r in daily)
+    lines = [
+        f"{username} за {day_from:%Y-%m-%d} — {last:%Y-%m-%d}",
+        f"Проанализировано: {total}, проблемных: {bad} ({_rate(bad, total)})",
+        "",
+        "Тональность:",
+    ]
+    lines += format_distribution(sentiments, SENTIMENT_RU)
+    lines += ["", "Проблемы:"] + format_distribution(problems, PROBLEM_RU, skip=("ok", ""))
+    lines += ["", "По дням (с сообщениями):"] + (format_daily(daily, only_active=True) or ["- (нет)"])
+    return lines
@@ -0,0 +1,145 @@
+import asyncio
+import logging
+import signal
+import time
+
+from dotenv import load_dotenv
+
+from .analyzer import AnalyzerClient
+from .config import load_config
+from .db import create_pool
+from .metrics import ANALYSIS_JOBS_FAILED
+from .migrate import migrate
+from .pipeline import AnalysisPipeline, create_pipeline
+from .repo import Repo
+
+logger = logging.getLogger(__name__)
+
+# как часто простаивающий воркер обновляет метрику проваленных задач
+FAILED_GAUGE_INTERVAL = 60.0
+
+
+class AnalysisWorker:
+    # воркер очереди analysis_queue: забирает пачку задач под аренду, прогоняет через
+    # AnalysisPipeline и подтверждает. Несколько воркеров (в том числе в разных процессах)
+    # безопасно делят одну очередь благодаря FOR UPDATE SKIP LOCKED
+    def __init__(
+        self,
+        repo: Repo,
+        pipeline: AnalysisPipeline,
+        batch_size: int = 50,
+        poll_interval: float = 2.0,
+        lease_sec: float = 300.0,
+        max_attempts: int = 5,
+        retry_base_sec: float = 30.0,
+    ):
+        self.repo = repo
+        self.pipeline = pipeline
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.lease_sec = lease_sec
+        self.max_attempts = max_attempts
+        self.retry_base_sec = retry_base_sec
+        self._failed_checked_at = 0.0
+
+    async def run_once(self) -> int:
+        # при открытой цепи LLM задачи не забираются: иначе они будут тут же возвращены
+        breaker = self.pipeline.breaker
+        if breaker is not None and not breaker.available():
+            return 0
+
+        jobs = await self.repo.claim_analysis_jobs(self.batch_size, self.lease_sec, self.max_attempts)
+        if not jobs:
+            return 0
+
+        stats = await self.pipeline.run(jobs)
+        failed = set(stats.failed_ids)
+        deferred = set(stats.deferred_ids)
+        done = [int(j["message_id"]) for j in jobs if int(j["message_id"]) not in failed | deferred]
+        await self.repo.complete_analysis_jobs(done)
+        if failed:
+            attempts = max(int(j["attempts"]) for j in jobs if int(j["message_id"]) in failed)
+            dead = await self.repo.release_analysis_jobs(
+                sorted(failed),
+                "analysis failed",
+                min(self.retry_base_sec * 2 ** (attempts - 1), 3600),
+                max_attempts=self.max_attempts,
+            )
+            if dead:
+                logger.warning("%d analysis job(s) failed after %d attempts", dead, self.max_attempts)
+                await self.refresh_failed_count()
+        if deferred:
+            await self.repo.release_analysis_jobs(
+                sorted(deferred), "LLM circuit open", breaker.retry_after if breaker else 0, count_attempt=False
+            )
+        logger.info(
+            "analysis jobs: %d done, %d failed, %d deferred, %.1f msg/s",
+            len(done), len(failed), len(deferred), stats.rate,
+        )
+        return len(jobs)
+
+    async def refresh_failed_count(self) -> None:
+        self._failed_checked_at = time.monotonic()
+        ANALYSIS_JOBS_FAILED.set(await self.repo.count_failed_analysis_jobs())
+
+    async def run(self, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            try:
+                processed = await self.run_once()
+                # задачи с истёкшей арендой помечаются при claim, а manage failed-jobs — в другом процессе
+                if not processed and time.monotonic() - self._failed_checked_at >= FAILED_GAUGE_INTERVAL:
+                    await self.refresh_failed_count()
+            except Exception:
+                logger.exception("analysis worker iteration failed")
+                processed = 0
+            if processed:
+                continue
+            try:
+                await asyncio.wait_for(stop.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+def start_workers(worker: AnalysisWorker, count: int, stop: asyncio.Event) -> list[asyncio.Task]:
+    return [asyncio.create_task(worker.run(stop)) for _ in range(count)]
+
+
+async def main():
+    cfg = load_config(require_bot_token=False)
+    # воркер только пишет и забирает задания — пул чтения ему не нужен
+    pool = await create_pool(
+        cfg.database_url,
+        min_size=cfg.db_pool_min,
+        max_size=cfg.db_pool_max,
+        statement_cache_size=cfg.db_statement_cache_size,
+        command_timeout=cfg.db_command_timeout or None,
+    )
+    if cfg.migrate_on_start:
+        await migrate(pool)
+    repo = Repo(pool, identity_cache_size=cfg.identity_cache_size)
+    analyzer = AnalyzerClient.from_config(cfg)
+    worker = AnalysisWorker(
+        repo,
+        create_pipeline(cfg, repo, analyzer),
+        batch_size=cfg.analysis_job_batch,
+        poll_interval=cfg.analysis_poll_interval,
+        max_attempts=cfg.analysis_max_attempts,
+    )
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    logging.info("Analysis worker started.")
+    try:
+        await asyncio.gather(*start_workers(worker, max(1, cfg.analysis_workers), stop))
+    finally:
+        await analyzer.aclose()
+        await pool.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv()
+    asyncio.run(main())
@@ -0,0 +1,176 @@
+-- ==========================
+-- Telegram Dialog Quality Bot
+-- Базовая схема (миграция 0001). Скрипт идемпотентен: на существующей базе
+-- досоздаёт недостающее. Применяется через python -m quality_bot.migrate
+-- ==========================
+
+CREATE TABLE IF NOT EXISTS public.chats (
+  chat_id   BIGINT PRIMARY KEY,
+  chat_name TEXT NOT NULL,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS public.user_role (
+  role_id   BIGSERIAL PRIMARY KEY,
+  role_name VARCHAR(50) NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS public.users (
+  user_id    BIGSERIAL PRIMARY KEY,
+  tg_user_id BIGINT NOT NULL UNIQUE,
+  username   TEXT NOT NULL,
+  role_id    BIGINT NOT NULL REFERENCES public.user_role(role_id)
+    ON UPDATE CASCADE ON DELETE RESTRICT
+);
+
+-- Функция создания месячной секции: <parent>_pYYYYMM, границы — по UTC.
+-- Используется ниже для первых секций и в quality_bot/partitions.py
+CREATE OR REPLACE FUNCTION public.create_month_partition(parent TEXT, month DATE)
+RETURNS TEXT
+LANGUAGE plpgsql AS $$
+DECLARE
+  lo   DATE := date_trunc('month', month)::date;
+  part TEXT := parent || '_p' || to_char(lo, 'YYYYMM');
+BEGIN
+  EXECUTE format(
+    'CREATE TABLE IF NOT EXISTS public.%I PARTITION OF public.%I FOR VALUES FROM (%L) TO (%L)',
+    part, parent,
+    lo::timestamp AT TIME ZONE 'UTC',
+    (lo + INTERVAL '1 month')::timestamp AT TIME ZONE 'UTC'
+  );
+  RETURN part;
+END $$;
+
+-- Сообщения секционированы по месяцам created_at: выборки по периоду читают только
+-- нужные секции, а старые месяцы удаляются целиком (python -m quality_bot.manage partitions).
+-- Ключ секционирования входит во все уникальные ограничения
+CREATE TABLE IF NOT EXISTS public.messages (
+  message_id    BIGSERIAL,
+  chat_id       BIGINT NOT NULL REFERENCES public.chats(chat_id)
+    ON UPDATE CASCADE ON DELETE CASCADE,
+  user_id       BIGINT NOT NULL REFERENCES public.users(user_id)
+    ON UPDATE CASCADE ON DELETE RESTRICT,
+  tg_message_id BIGINT NOT NULL,
+  message_text  TEXT NOT NULL,
+  created_at    TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (message_id, created_at),
+  CONSTRAINT uq_messages_chat_tgmsg UNIQUE (chat_id, tg_message_id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- created_at — время сообщения (ключ секционирования), секции совпадают с секциями messages
+CREATE TABLE IF NOT EXISTS public.analysis_results (
+  analysis_id      BIGSERIAL,
+  message_id       BIGINT NOT NULL,
+  created_at       TIMESTAMPTZ NOT NULL,
+  sentiment        TEXT NOT NULL,
+  detected_problem TEXT NOT NULL,
+  analysis_date    TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (message_id, created_at),
+  CONSTRAINT fk_analysis_results_message FOREIGN KEY (message_id, created_at)
+    REFERENCES public.messages(message_id, created_at) ON DELETE CASCADE
+) PARTITION BY RANGE (created_at);
+
+-- версия модели/промпта, которой получен результат (пустая — до появления версий)
+ALTER TABLE public.analysis_results
+  ADD COLUMN IF NOT EXISTS model_version TEXT NOT NULL DEFAULT '';
+
+-- Кэш результатов анализа по хэшу нормализованного текста
+CREATE TABLE IF NOT EXISTS public.analysis_cache (
+  text_hash        TEXT NOT NULL,
+  model_version    TEXT NOT NULL,
+  sentiment        TEXT NOT NULL,
+  detected_problem TEXT NOT NULL,
+  created_at       TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (text_hash, model_version)
+);
+
+-- Очередь фонового анализа: новые сообщения попадают сюда из add_message/ingest,
+-- воркеры забирают задачи через SELECT ... FOR UPDATE SKIP LOCKED.
+-- Ссылку на messages(message_id, created_at) добавляет 0011_analysis_queue_fk: в базе до
+-- секционирования первичный ключ messages — один message_id
+CREATE TABLE IF NOT EXISTS public.analysis_queue (
+  message_id   BIGINT PRIMARY KEY,
+  created_at   TIMESTAMPTZ NOT NULL,
+  enqueued_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+  available_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  attempts     INT NOT NULL DEFAULT 0,
+  last_error   TEXT
+);
+
+-- для баз до секционирования; заполняется миграцией 0002_partition_messages
+ALTER TABLE public.analysis_queue
+  ADD COLUMN IF NOT EXISTS created_at TIMESTAMPTZ;
+
+CREATE INDEX IF NOT EXISTS idx_analysis_queue_available
+  ON public.analysis_queue(available_at);
+
+-- Дневные агрегаты результатов анализа (чат × день × пользователь × тональность × проблема).
+-- Обновляются в Repo.save_analyses, пересчитываются: python -m quality_bot.manage rebuild-rollups
+CREATE TABLE IF NOT EXISTS public.analysis_rollup_daily (
+  chat_id          BIGINT NOT NULL,
+  day              DATE NOT NULL,
+  user_id          BIGINT NOT NULL,
+  sentiment        TEXT NOT NULL,
+  detected_problem TEXT NOT NULL,
+  cnt              BIGINT NOT NULL DEFAULT 0,
+  updated_at       TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (chat_id, day, user_id, sentiment, detected_problem)
+);
+
+-- Время ответа (сек) до первого следующего сообщения другого пользователя;
+-- считается при приёме сообщений, NULL — ответа пока нет
+ALTER TABLE public.messages
+  ADD COLUMN IF NOT EXISTS response_sec DOUBLE PRECISION;
+
+-- Дневные гистограммы времени ответа (логарифмические корзины, см. quality_bot/sketch.py):
+-- p50/p90/p99 за любой период считаются слиянием нескольких строк на день
+CREATE TABLE IF NOT EXISTS public.response_time_hist_daily (
+  chat_id BIGINT NOT NULL,
+  day     DATE NOT NULL,
+  bucket  INT NOT NULL,
+  cnt     BIGINT NOT NULL,
+  sum_sec DOUBLE PRECISION NOT NULL,
+  PRIMARY KEY (chat_id, day, bucket)
+);
+
+-- Индексы под отчёты/выборки
+-- keyset-пагинация и выборки по периоду: (chat_id, created_at, message_id)
+DROP INDEX IF EXISTS public.idx_messages_chat_created;
+
+CREATE INDEX IF NOT EXISTS idx_messages_chat_created_id
+  ON public.messages(chat_id, created_at, message_id);
+
+CREATE INDEX IF NOT EXISTS idx_messages_user_created
+  ON public.messages(user_id, created_at DESC);
+
+-- ещё не отвеченные сообщения: с них начинается оконный проход update_response_times
+CREATE INDEX IF NOT EXISTS idx_messages_pending_response
+  ON public.messages(chat_id, created_at)
+  WHERE response_sec IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_analysis_date
+  ON public.analysis_results(analysis_date DESC);
+
+-- поиск по message_id покрывает первичный ключ (message_id, created_at)
+DROP INDEX IF EXISTS public.idx_analysis_message;
+
+-- секции на прошлый, текущий и два следующих месяца; дальше их создаёт бот при старте
+-- и python -m quality_bot.manage partitions (база до секционирования пропускается)
+DO $$
+BEGIN
+  IF (SELECT relkind FROM pg_class WHERE oid = 'public.messages'::regclass) = 'p' THEN
+    FOR i IN -1..2 LOOP
+      PERFORM public.create_month_partition(
+        'messages', (date_trunc('month', now() AT TIME ZONE 'UTC') + make_interval(months => i))::date);
+      PERFORM public.create_month_partition(
+        'analysis_results', (date_trunc('month', now() AT TIME ZONE 'UTC') + make_interval(months => i))::date);
+    END LOOP;
+  END IF;
+END $$;
+
+-- Дефолтные роли
+INSERT INTO public.user_role(role_name) VALUES ('admin')
+ON CONFLICT (role_name) DO NOTHING;
+
+INSERT INTO public.user_role(role_name) VALUES ('viewer')
+ON CONFLICT (role_name) DO NOTHING;
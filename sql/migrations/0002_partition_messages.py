@@ -0,0 +1,7 @@
+# База, созданная до секционирования: messages/analysis_results переводятся на месячные секции
+# (на новой базе таблицы уже секционированы, миграция ничего не делает)
+from quality_bot.partitions import migrate_to_partitioned
+
+
+async def upgrade(con) -> None:
+    await migrate_to_partitioned(con)
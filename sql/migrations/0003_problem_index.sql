@@ -0,0 +1,5 @@
+-- Проблемные результаты анализа (/issues, фильтры и подсчёты по detected_problem):
+-- частичный индекс содержит только строки с проблемой, их обычно единицы процентов
+CREATE INDEX IF NOT EXISTS idx_analysis_problems
+  ON public.analysis_results(detected_problem, created_at)
+  WHERE detected_problem <> 'ok';
@@ -0,0 +1,24 @@
+-- Версии данных отчётов: счётчик на (чат, день), увеличивается при каждой записи результатов анализа
+-- (Repo.save_analyses) и времени ответа (Repo.update_response_times) за этот день.
+-- Версия отчёта за период — сумма счётчиков его дней: растёт при любом изменении внутри периода
+CREATE TABLE IF NOT EXISTS public.report_data_versions (
+  chat_id BIGINT NOT NULL,
+  day     DATE NOT NULL,
+  version BIGINT NOT NULL DEFAULT 1,
+  PRIMARY KEY (chat_id, day)
+);
+
+-- Готовые отчёты: считаются планировщиком (quality_bot/reports.py) и при первом /report за период.
+-- Запись с устаревшей data_version не используется и заменяется при следующем расчёте
+CREATE TABLE IF NOT EXISTS public.report_cache (
+  chat_id      BIGINT NOT NULL,
+  day_from     DATE NOT NULL,
+  day_to       DATE NOT NULL,  -- не включая
+  data_version BIGINT NOT NULL,
+  payload      JSONB NOT NULL,
+  computed_at  TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (chat_id, day_from, day_to, data_version)
+);
+
+CREATE INDEX IF NOT EXISTS idx_report_cache_computed
+  ON public.report_cache(computed_at);
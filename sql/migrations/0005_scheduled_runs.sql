@@ -0,0 +1,8 @@
+-- Выполненные запуски задач по расписанию (quality_bot/locks.py, run_exclusive): при нескольких
+-- экземплярах бота задача за период выполняется одним из них и только один раз
+CREATE TABLE IF NOT EXISTS public.scheduled_runs (
+  job         TEXT NOT NULL,
+  run_key     TEXT NOT NULL,
+  finished_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  PRIMARY KEY (job, run_key)
+);
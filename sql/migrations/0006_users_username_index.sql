@@ -0,0 +1,3 @@
+-- /user @name: поиск пользователя по имени без учёта регистра
+CREATE INDEX IF NOT EXISTS idx_users_username_lower
+  ON public.users(lower(username));
@@ -0,0 +1,15 @@
+-- /search: полнотекстовый поиск (русская морфология) и нечёткий — по триграммам.
+-- Добавление вычисляемого столбца переписывает все секции messages; на большой базе
+-- миграцию лучше запускать вручную вне часов пик (python -m quality_bot.migrate).
+-- Для CREATE EXTENSION нужны права владельца базы
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE public.messages
+  ADD COLUMN IF NOT EXISTS text_tsv tsvector
+  GENERATED ALWAYS AS (to_tsvector('russian', coalesce(message_text, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_messages_text_tsv
+  ON public.messages USING gin (text_tsv);
+
+CREATE INDEX IF NOT EXISTS idx_messages_text_trgm
+  ON public.messages USING gin (message_text gin_trgm_ops);
@@ -0,0 +1,21 @@
+-- Фоновые запуски /analyze: ход выполнения для /jobs и флаг отмены для /cancel.
+-- Запуск выполняется в процессе, который принял команду; остальные экземпляры бота видят его здесь,
+-- heartbeat_at обновляется при каждом отчёте о ходе (давно не обновлявшийся запуск — прерван)
+CREATE TABLE IF NOT EXISTS public.analyze_runs (
+  run_id           BIGSERIAL PRIMARY KEY,
+  chat_id          BIGINT NOT NULL REFERENCES public.chats(chat_id) ON DELETE CASCADE,
+  started_by       BIGINT NOT NULL,  -- tg_user_id админа
+  status           TEXT NOT NULL DEFAULT 'running',  -- running / done / cancelled / interrupted / failed
+  total            INT NOT NULL,
+  processed        INT NOT NULL DEFAULT 0,
+  problems         INT NOT NULL DEFAULT 0,
+  failed           INT NOT NULL DEFAULT 0,
+  cancel_requested BOOLEAN NOT NULL DEFAULT false,
+  started_at       TIMESTAMPTZ NOT NULL DEFAULT now(),
+  heartbeat_at     TIMESTAMPTZ NOT NULL DEFAULT now(),
+  finished_at      TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS idx_analyze_runs_running
+  ON public.analyze_runs(chat_id)
+  WHERE status = 'running';
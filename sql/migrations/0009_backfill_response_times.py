@@ -0,0 +1,49 @@
+# Время ответа для истории, накопленной до messages.response_sec и дневных гистограмм: без него
+# /report показывал бы пустую статистику до ручного manage rebuild-response-times.
+# Выполняется, только пока гистограммы пусты (на новой базе сообщений нет — ничего не делает).
+# SQL зафиксирован здесь, а не взят из Repo: применённая миграция не должна меняться вместе с кодом
+
+# корзины гистограммы на момент миграции (quality_bot/sketch.py: BUCKETS_PER_E, MAX_BUCKET)
+BUCKETS_PER_E = 20
+MAX_BUCKET = 300
+
+# ответ на сообщение — первое сообщение следующей «серии» другого автора (команды не учитываются)
+BACKFILL_CHAT = """
+WITH w AS (
+  SELECT m.message_id, m.created_at,
+         CASE WHEN m.user_id IS DISTINCT FROM LAG(m.user_id) OVER o THEN 1 ELSE 0 END AS run_start
+  FROM public.messages m
+  WHERE m.chat_id = $1 AND m.message_text NOT LIKE '/%'
+  WINDOW o AS (ORDER BY m.created_at, m.message_id)
+), runs AS (
+  SELECT message_id, created_at, SUM(run_start) OVER (ORDER BY created_at, message_id) AS run_id
+  FROM w
+), firsts AS (
+  SELECT run_id, MIN(created_at) AS first_at
+  FROM runs
+  GROUP BY run_id
+), upd AS (
+  UPDATE public.messages m
+  SET response_sec = EXTRACT(EPOCH FROM (f.first_at - r.created_at))
+  FROM runs r
+  JOIN firsts f ON f.run_id = r.run_id + 1
+  WHERE m.message_id = r.message_id AND m.created_at = r.created_at
+  RETURNING m.created_at, m.response_sec
+)
+INSERT INTO public.response_time_hist_daily(chat_id, day, bucket, cnt, sum_sec)
+SELECT $1::bigint, (created_at AT TIME ZONE 'UTC')::date,
+       LEAST(FLOOR(LN(1 + GREATEST(response_sec, 0)) * $2::float8)::int, $3::int),
+       COUNT(*), SUM(response_sec)
+FROM upd
+GROUP BY 1, 2, 3
+"""
+
+
+async def upgrade(con) -> None:
+    if await con.fetchval("SELECT EXISTS (SELECT 1 FROM public.response_time_hist_daily)"):
+        return
+    # без гистограмм посчитанные ранее значения не учтены нигде — считаем заново
+    await con.execute("UPDATE public.messages SET response_sec = NULL WHERE response_sec IS NOT NULL")
+    for r in await con.fetch("SELECT chat_id FROM public.chats ORDER BY chat_id"):
+        await con.execute(BACKFILL_CHAT, r["chat_id"], BUCKETS_PER_E, MAX_BUCKET)
+    await con.execute("DELETE FROM public.report_cache")
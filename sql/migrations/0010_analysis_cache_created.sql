@@ -0,0 +1,4 @@
+-- Срок хранения кэша результатов (ANALYSIS_CACHE_DAYS): чтение отбрасывает старые записи,
+-- планировщик отчётов удаляет их раз в сутки по этому индексу
+CREATE INDEX IF NOT EXISTS idx_analysis_cache_created
+  ON public.analysis_cache(created_at);
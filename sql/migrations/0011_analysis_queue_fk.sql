@@ -0,0 +1,13 @@
+-- Ссылка очереди анализа на секционированные messages. На новой базе добавляется здесь;
+-- на базе до секционирования её уже добавила 0002_partition_messages после переноса данных
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM pg_constraint
+    WHERE conrelid = 'public.analysis_queue'::regclass AND conname = 'fk_analysis_queue_message'
+  ) THEN
+    ALTER TABLE public.analysis_queue
+      ADD CONSTRAINT fk_analysis_queue_message FOREIGN KEY (message_id, created_at)
+      REFERENCES public.messages(message_id, created_at) ON DELETE CASCADE;
+  END IF;
+END $$;
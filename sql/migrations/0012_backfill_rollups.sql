@@ -0,0 +1,20 @@
+-- Дневные агрегаты по всей сохранённой истории: /report, /trends и /user читают только их,
+-- а до этой миграции агрегаты копились лишь с момента обновления.
+-- Пересчёт как в manage rebuild-rollups: дни до самого старого хранимого сообщения
+-- (секции удалены по сроку хранения) не трогаются, кэш отчётов сбрасывается
+LOCK TABLE public.analysis_rollup_daily IN EXCLUSIVE MODE;
+
+DELETE FROM public.analysis_rollup_daily
+WHERE day >= COALESCE(
+  (SELECT MIN(created_at AT TIME ZONE 'UTC')::date FROM public.messages),
+  'infinity'::date
+);
+
+INSERT INTO public.analysis_rollup_daily(chat_id, day, user_id, sentiment, detected_problem, cnt)
+SELECT m.chat_id, (m.created_at AT TIME ZONE 'UTC')::date, m.user_id,
+       ar.sentiment, ar.detected_problem, COUNT(*)
+FROM public.analysis_results ar
+JOIN public.messages m ON m.message_id = ar.message_id AND m.created_at = ar.created_at
+GROUP BY 1, 2, 3, 4, 5;
+
+DELETE FROM public.report_cache;
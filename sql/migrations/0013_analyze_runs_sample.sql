@@ -0,0 +1,11 @@
+-- Период и доля выборки запуска /analyze (sample=/margin=; NULL — без выборки).
+-- /report строит оценку доли проблемных, только если период отчёта покрыт завершённой выборкой,
+-- и не пересчитывает это по сообщениям
+ALTER TABLE public.analyze_runs
+  ADD COLUMN IF NOT EXISTS date_from   TIMESTAMPTZ,
+  ADD COLUMN IF NOT EXISTS date_to     TIMESTAMPTZ,
+  ADD COLUMN IF NOT EXISTS sample_rate DOUBLE PRECISION;
+
+CREATE INDEX IF NOT EXISTS idx_analyze_runs_sampled
+  ON public.analyze_runs(chat_id, date_from)
+  WHERE sample_rate IS NOT NULL AND status = 'done';
@@ -0,0 +1,13 @@
+-- Задачи, исчерпавшие ANALYSIS_MAX_ATTEMPTS, помечаются failed_at и больше не забираются воркерами.
+-- Они остаются в analysis_queue с last_error до manage failed-jobs --requeue/--purge
+ALTER TABLE public.analysis_queue
+  ADD COLUMN IF NOT EXISTS failed_at TIMESTAMPTZ;
+
+-- воркеры ищут только живые задачи; проваленные считаются для метрики по отдельному индексу
+DROP INDEX IF EXISTS public.idx_analysis_queue_available;
+CREATE INDEX IF NOT EXISTS idx_analysis_queue_pending
+  ON public.analysis_queue(available_at)
+  WHERE failed_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_analysis_queue_failed
+  ON public.analysis_queue(failed_at)
+  WHERE failed_at IS NOT NULL;
@@ -0,0 +1,148 @@
+import json
+
+import pytest
+
+from quality_bot.analyzer import Prefilter, _normalize_item, _parse_batch_content
+
+
+def _response(content) -> dict:
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    return {"choices": [{"message": {"content": content}}]}
+
+
+def _item(item_id, sentiment="neutral", problem="ok") -> dict:
+    return {"id": item_id, "sentiment": sentiment, "problem": problem}
+
+
+# ---------- пакетный ответ ----------
+
+@pytest.mark.parametrize(
+    "obj, expected",
+    [
+        ({"sentiment": "negative", "problem": "toxic"}, ("negative", "toxic")),
+        ({"sentiment": "негативная", "problem": "агрессивный тон"}, ("negative", "aggressive_tone")),
+        ({"sentiment": "positive", "problem": "ок"}, ("positive", "ok")),
+        ({"sentiment": "positive"}, None),
+        ({"problem": "ok"}, None),
+        ({"sentiment": "angry", "problem": "ok"}, None),
+        ({"sentiment": "neutral", "problem": "spam"}, None),
+        ({"sentiment": None, "problem": "ok"}, None),
+        (["neutral", "ok"], None),
+        ("neutral", None),
+    ],
+)
+def test_normalize_item(obj, expected):
+    assert _normalize_item(obj) == expected
+
+
+@pytest.mark.parametrize(
+    "content, ids, expected",
+    [
+        # все id на месте
+        (
+            {"results": [_item(1, "negative", "toxic"), _item(2)]},
+            {1, 2},
+            {1: ("negative", "toxic"), 2: ("neutral", "ok")},
+        ),
+        # массив без обёртки и id строкой
+        ([_item("1"), _item(2, "positive")], {1, 2}, {1: ("neutral", "ok"), 2: ("positive", "ok")}),
+        # ответ в ```json``` блоке
+        ('```json\n{"results": [{"id": 1, "sentiment": "neutral", "problem": "ok"}]}\n```', {1}, {1: ("neutral", "ok")}),
+        # пропущенный id не подменяется на "ok"
+        ({"results": [_item(1)]}, {1, 2}, {1: ("neutral", "ok")}),
+        # лишний id из чужого пакета отбрасывается
+        ({"results": [_item(1), _item(3, "negative", "toxic")]}, {1, 2}, {1: ("neutral", "ok")}),
+        # повтор с тем же ответом принимается
+        ({"results": [_item(1), _item(1)]}, {1}, {1: ("neutral", "ok")}),
+        # повтор с разными ответами — на одиночный анализ
+        ({"results": [_item(1), _item(1, "negative", "toxic"), _item(2)]}, {1, 2}, {2: ("neutral", "ok")}),
+        # повтор, где одна из копий неразборчива, — берётся разборчивая
+        ({"results": [_item(1, "angry"), _item(1, "negative", "toxic")]}, {1}, {1: ("negative", "toxic")}),
+        # недопустимые значения и битые элементы пропускаются
+        (
+            {"results": [_item(1, "angry"), _item(2, problem="spam"), {"id": 3}, {"sentiment": "neutral"}, "x", _item(4)]},
+            {1, 2, 3, 4},
+            {4: ("neutral", "ok")},
+        ),
+        ({"results": [{"id": "abc", "sentiment": "neutral", "problem": "ok"}, {"id": None}]}, {1}, {}),
+        # results не список
+        ({"results": {"id": 1, "sentiment": "neutral", "problem": "ok"}}, {1}, {}),
+        ({}, {1}, {}),
+    ],
+)
+def test_parse_batch_content(content, ids, expected):
+    assert _parse_batch_content(_response(content), ids) == expected
+
+
+def test_parse_batch_content_invalid_json():
+    with pytest.raises(json.JSONDecodeError):
+        _parse_batch_content(_response("results: ok"), {1})
+
+
+# ---------- префильтр ----------
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("Ок", ("neutral", "ok")),
+        ("ок!", ("neutral", "ok")),
+        ("  ok  ", ("neutral", "ok")),
+        ("+", ("neutral", "ok")),
+        ("Спасибо большое!", ("positive", "ok")),
+        ("Хорошо", ("positive", "ok")),
+        ("Всем привет", ("neutral", "ok")),
+        ("👍", ("neutral", "ok")),
+        ("👍 ок", ("neutral", "ok")),
+        ("...", ("neutral", "ok")),
+        ("https://example.com/a?b=1", ("neutral", "ok")),
+        ("бля", ("negative", "toxic")),
+        ("Блядь, опять", ("negative", "toxic")),
+        ("сука", ("negative", "toxic")),
+        ("ну пиздец", ("negative", "toxic")),
+        ("ёбаный сервис", ("negative", "toxic")),
+        ("заебал уже", ("negative", "toxic")),
+        ("хуйня какая-то", ("negative", "toxic")),
+        ("мудак", ("negative", "toxic")),
+    ],
+)
+def test_prefilter_resolves(text, expected):
+    assert Prefilter().classify(text) == expected
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        # похожие на мат слова
+        "ребята, посмотрите",
+        "небольшой вопрос",
+        "два рубля",
+        "100 рублей",
+        "употреблять",
+        "сукно",
+        "страхуй",
+        "хлеба",
+        # подтверждение с продолжением — решает LLM
+        "спасибо, но не работает",
+        "да, но",
+        "ок, а когда починят?",
+        "смотрите https://example.com",
+    ],
+)
+def test_prefilter_passes_to_llm(text):
+    assert Prefilter().classify(text) is None
+
+
+def test_prefilter_long_acknowledgement_goes_to_llm():
+    assert Prefilter(max_ack_len=5).classify("спасибо") is None
+
+
+def test_prefilter_model_threshold_and_stats():
+    verdicts = {"медленно": ("negative", "unclear", 0.95), "может быть": ("neutral", "ok", 0.5)}
+    prefilter = Prefilter(threshold=0.9, model=verdicts.get)
+    assert prefilter.classify("медленно") == ("negative", "unclear")
+    assert prefilter.classify("может быть") is None
+    assert prefilter.classify("ок") == ("neutral", "ok")
+    assert prefilter.classify("что-то другое") is None
+    stats = prefilter.stats
+    assert (stats.total, stats.resolved_ok, stats.flagged, stats.passed) == (4, 1, 1, 2)
@@ -0,0 +1,323 @@
+import asyncio
+
+import pytest
+
+from quality_bot import limits
+from quality_bot.limits import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, TokenBucket
+from quality_bot.pipeline import AnalysisPipeline, PipelineStats
+
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # asyncio.sleep в limits не ждёт, а сдвигает часы; длительности сохраняются в clock.sleeps
+    c = FakeClock()
+    c.sleeps = []
+
+    async def fake_sleep(seconds):
+        c.sleeps.append(seconds)
+        c.now += seconds
+
+    monkeypatch.setattr(limits.asyncio, "sleep", fake_sleep)
+    return c
+
+
+def _acquire(bucket: TokenBucket, n: int = 1) -> None:
+    async def run():
+        for _ in range(n):
+            await bucket.acquire()
+
+    asyncio.run(run())
+
+
+# ---------- TokenBucket ----------
+
+def test_bucket_burst_then_rate(clock):
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+    _acquire(bucket, 3)
+    assert clock.sleeps == []
+    _acquire(bucket)
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_bucket_refill_capped_by_burst(clock):
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+    _acquire(bucket, 3)
+    clock.now += 1.0  # +2 токена
+    _acquire(bucket, 2)
+    assert clock.sleeps == []
+    clock.now += 60.0  # не больше burst
+    _acquire(bucket, 3)
+    assert clock.sleeps == []
+    _acquire(bucket)
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_bucket_default_burst_is_rate(clock):
+    bucket = TokenBucket(rate=5, clock=clock)
+    assert bucket.capacity == 5
+    _acquire(bucket, 5)
+    assert clock.sleeps == []
+
+
+def test_bucket_pause_after_429(clock):
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+    bucket.pause(5.0)
+    _acquire(bucket)
+    # сначала ждём конца паузы, за это время бакет снова наполняется
+    assert clock.sleeps == [pytest.approx(5.0)]
+    _acquire(bucket, 2)
+    assert clock.sleeps == [pytest.approx(5.0)]
+
+
+def test_bucket_pause_keeps_longer_deadline(clock):
+    bucket = TokenBucket(rate=2, burst=3, clock=clock)
+    bucket.pause(10.0)
+    bucket.pause(1.0)
+    _acquire(bucket)
+    assert sum(clock.sleeps) == pytest.approx(10.0)
+
+
+def test_bucket_unlimited(clock):
+    bucket = TokenBucket(rate=0, clock=clock)
+    _acquire(bucket, 100)
+    assert clock.sleeps == []
+
+
+# ---------- CircuitBreaker ----------
+
+def _open(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        assert breaker.before_call() is False
+        breaker.on_failure()
+
+
+def test_breaker_opens_after_threshold():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, max_reset_timeout=40, clock=clock)
+    breaker.on_failure()
+    breaker.on_failure()
+    assert breaker.state == CLOSED
+    breaker.on_success()  # успех сбрасывает счётчик подряд идущих сбоев
+    breaker.on_failure()
+    breaker.on_failure()
+    assert breaker.state == CLOSED
+    breaker.on_failure()
+    assert breaker.state == OPEN
+    assert not breaker.available()
+    with pytest.raises(CircuitOpenError) as e:
+        breaker.before_call()
+    assert e.value.retry_after == pytest.approx(10)
+
+
+def test_breaker_half_open_single_probe_then_close():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, max_reset_timeout=40, clock=clock)
+    _open(breaker)
+    clock.now += 10
+    assert breaker.state == HALF_OPEN
+    assert breaker.available()
+    assert breaker.before_call() is True
+    # второй пробный запрос не пропускается, пока идёт первый
+    assert not breaker.available()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.on_success()
+    assert breaker.state == CLOSED
+    assert breaker.before_call() is False
+
+
+def test_breaker_failed_probe_doubles_timeout_up_to_max():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, max_reset_timeout=40, clock=clock)
+    _open(breaker)
+    for expected in (20, 40, 40):
+        clock.now += breaker.retry_after
+        assert breaker.before_call() is True
+        breaker.on_failure()
+        assert breaker.state == OPEN
+        assert breaker.retry_after == pytest.approx(expected)
+    # после успешной пробы таймаут снова начальный
+    clock.now += breaker.retry_after
+    breaker.before_call()
+    breaker.on_success()
+    _open(breaker)
+    assert breaker.retry_after == pytest.approx(10)
+
+
+def test_breaker_release_frees_probe():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    _open(breaker)
+    clock.now += 10
+    assert breaker.before_call() is True
+    breaker.release()
+    assert breaker.available()
+    assert breaker.before_call() is True
+
+
+def test_cancelled_non_probe_call_keeps_probe_slot():
+    # запрос ушёл при закрытой цепи; пока он идёт, цепь открылась и ушла проба.
+    # Отмена первого запроса не должна пропустить вторую пробу
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+
+    async def run():
+        started = asyncio.Event()
+
+        async def slow(_):
+            started.set()
+            await asyncio.Event().wait()
+
+        pipeline = AnalysisPipeline(None, slow, rps=0, breaker=breaker)
+        task = asyncio.create_task(pipeline._call_with_retry(slow, "text", PipelineStats(chat_id=1)))
+        await started.wait()
+        breaker.on_failure()
+        clock.now += 10
+        assert breaker.before_call() is True
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert not breaker.available()
+
+    asyncio.run(run())
+
+
+# ---------- FairScheduler ----------
+
+def _assert_idle(scheduler: limits.FairScheduler) -> None:
+    assert scheduler._busy == 0
+    assert scheduler._waiters == {}
+    assert not scheduler._order
+
+
+def test_scheduler_round_robin_across_keys():
+    async def run():
+        scheduler = limits.FairScheduler(1)
+        order = []
+        gate = asyncio.Event()
+
+        async def holder():
+            async with scheduler.slot("a"):
+                await gate.wait()
+
+        async def job(key):
+            async with scheduler.slot(key):
+                order.append(key)
+                await asyncio.sleep(0)
+
+        first = asyncio.create_task(holder())
+        await asyncio.sleep(0)
+        # большой чат встал в очередь первым, но не забирает все слоты
+        tasks = [asyncio.create_task(job(k)) for k in ("a", "a", "a", "b", "b", "c")]
+        await asyncio.sleep(0)
+        assert scheduler.waiting == 6
+        gate.set()
+        await asyncio.gather(first, *tasks)
+        assert order == ["a", "b", "c", "a", "b", "a"]
+        _assert_idle(scheduler)
+
+    asyncio.run(run())
+
+
+def test_scheduler_cancelled_waiter_leaves_queue():
+    async def run():
+        scheduler = limits.FairScheduler(1)
+        gate = asyncio.Event()
+        got = []
+
+        async def job(key, wait=False):
+            async with scheduler.slot(key):
+                got.append(key)
+                if wait:
+                    await gate.wait()
+
+        first = asyncio.create_task(job("a", wait=True))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(job("b"))
+        other = asyncio.create_task(job("c"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        assert scheduler.waiting == 1
+        assert list(scheduler._order) == ["c"]
+        gate.set()
+        await asyncio.gather(first, other)
+        assert cancelled.cancelled()
+        assert got == ["a", "c"]
+        _assert_idle(scheduler)
+
+    asyncio.run(run())
+
+
+def test_scheduler_release_after_waiter_cancelled():
+    # ожидание отменено, и до пробуждения задачи _release снял его future с очереди:
+    # слот уходит следующему, а отменённая задача не ломает очередь
+    async def run():
+        scheduler = limits.FairScheduler(1)
+        got = []
+
+        async def job(key):
+            async with scheduler.slot(key):
+                got.append(key)
+
+        await scheduler._acquire("a")
+        cancelled = asyncio.create_task(job("b"))
+        other = asyncio.create_task(job("c"))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        scheduler._release()
+        await asyncio.gather(other)
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        assert got == ["c"]
+        _assert_idle(scheduler)
+
+    asyncio.run(run())
+
+
+def test_scheduler_cancel_after_slot_handed_over():
+    # слот уже передан ожидающему, но задачу отменили раньше, чем она проснулась:
+    # слот должен уйти следующему, а не потеряться
+    async def run():
+        scheduler = limits.FairScheduler(1)
+        got = []
+
+        async def job(key):
+            async with scheduler.slot(key):
+                got.append(key)
+
+        await scheduler._acquire("a")
+        cancelled = asyncio.create_task(job("b"))
+        other = asyncio.create_task(job("c"))
+        await asyncio.sleep(0)
+        scheduler._release()
+        cancelled.cancel()
+        await asyncio.gather(other)
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        assert got == ["c"]
+        _assert_idle(scheduler)
+
+    asyncio.run(run())
+
+
+def test_scheduler_free_slots_without_queue():
+    async def run():
+        scheduler = limits.FairScheduler(2)
+        await scheduler._acquire("a")
+        await scheduler._acquire("a")
+        assert scheduler._busy == 2
+        assert scheduler.waiting == 0
+        scheduler._release()
+        scheduler._release()
+        _assert_idle(scheduler)
+
+    asyncio.run(run())
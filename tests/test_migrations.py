@@ -0,0 +1,112 @@
+import asyncio
+import os
+import uuid
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import asyncpg
+import pytest
+
+from quality_bot.db import create_pool
+from quality_bot.migrate import discover, migrate
+
+# сервер Postgres, на котором можно создавать базы (CREATEDB); каждый тест — в своей временной базе
+TEST_DATABASE_URL = os.getenv("TEST_DATABASE_URL", "")
+# схема из sql/init.sql до версионированных миграций — с неё обновляются существующие базы
+BASELINE_SQL = Path(__file__).resolve().parent / "baseline_init.sql"
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL is not set")
+
+
+@asynccontextmanager
+async def temp_database():
+    name = f"qb_test_{uuid.uuid4().hex[:12]}"
+    admin = await asyncpg.connect(TEST_DATABASE_URL)
+    try:
+        await admin.execute(f'CREATE DATABASE "{name}"')
+        pool = await create_pool(TEST_DATABASE_URL, database=name, min_size=1, max_size=2)
+        try:
+            yield pool
+        finally:
+            await pool.close()
+            await admin.execute(f'DROP DATABASE IF EXISTS "{name}"')
+    finally:
+        await admin.close()
+
+
+async def _constraints(con, table: str) -> set[str]:
+    rows = await con.fetch("SELECT conname FROM pg_constraint WHERE conrelid = $1::regclass", f"public.{table}")
+    return {r["conname"] for r in rows}
+
+
+def test_fresh_database():
+    async def run():
+        async with temp_database() as pool:
+            done = await migrate(pool)
+            assert [m.version for m in done] == [m.version for m in discover()]
+            async with pool.acquire() as con:
+                assert "fk_analysis_queue_message" in await _constraints(con, "analysis_queue")
+                # воркеры ищут задачи по частичному индексу без проваленных
+                assert await con.fetchval("SELECT to_regclass('public.idx_analysis_queue_pending')") is not None
+                assert await con.fetchval("SELECT to_regclass('public.idx_analysis_queue_available')") is None
+            # повторный запуск ничего не применяет
+            assert await migrate(pool) == []
+
+    asyncio.run(run())
+
+
+BASELINE_DATA = """
+INSERT INTO public.chats(chat_id, chat_name) VALUES (-100, 'support');
+INSERT INTO public.users(tg_user_id, username, role_id)
+SELECT 1, 'client', role_id FROM public.user_role WHERE role_name = 'viewer';
+INSERT INTO public.messages(chat_id, user_id, tg_message_id, message_text, created_at)
+SELECT -100, u.user_id, n, 'message ' || n, TIMESTAMPTZ '2024-01-15 10:00Z' + make_interval(days => n * 35)
+FROM public.users u, generate_series(1, 3) AS n;
+INSERT INTO public.users(tg_user_id, username, role_id)
+SELECT 2, 'agent', role_id FROM public.user_role WHERE role_name = 'viewer';
+INSERT INTO public.messages(chat_id, user_id, tg_message_id, message_text, created_at)
+SELECT -100, u.user_id, 10, 'reply', m.created_at + INTERVAL '90 seconds'
+FROM public.users u, public.messages m
+WHERE u.tg_user_id = 2 AND m.tg_message_id = 1;
+INSERT INTO public.analysis_results(message_id, sentiment, detected_problem)
+SELECT message_id, 'negative', 'delay' FROM public.messages WHERE tg_message_id <= 2;
+"""
+
+
+def test_upgrade_from_baseline_schema():
+    async def run():
+        async with temp_database() as pool:
+            async with pool.acquire() as con:
+                await con.execute(BASELINE_SQL.read_text(encoding="utf-8"))
+                await con.execute(BASELINE_DATA)
+                max_id = await con.fetchval("SELECT MAX(message_id) FROM public.messages")
+            await migrate(pool)
+            async with pool.acquire() as con:
+                kind = await con.fetchval("SELECT relkind FROM pg_class WHERE oid = 'public.messages'::regclass")
+                assert kind == "p"
+                assert await con.fetchval("SELECT to_regclass('public.messages_legacy')") is None
+                assert "fk_analysis_queue_message" in await _constraints(con, "analysis_queue")
+                # данные перенесены в месячные секции, результаты анализа — с created_at сообщения
+                assert await con.fetchval("SELECT count(*) FROM public.messages") == 4
+                assert await con.fetchval("SELECT count(DISTINCT tableoid) FROM public.messages") == 3
+                assert await con.fetchval(
+                    "SELECT count(*) FROM public.analysis_results ar "
+                    "JOIN public.messages m ON m.message_id = ar.message_id AND m.created_at = ar.created_at"
+                ) == 2
+                # дневные агрегаты отчётов заполнены по перенесённым результатам
+                assert await con.fetchval(
+                    "SELECT SUM(cnt) FROM public.analysis_rollup_daily WHERE detected_problem = 'delay'"
+                ) == 2
+                # время ответа посчитано для истории: ответ агента через 90 сек и ответ клиента агенту
+                assert await con.fetchval(
+                    "SELECT response_sec FROM public.messages WHERE tg_message_id = 1"
+                ) == 90
+                assert await con.fetchval("SELECT SUM(cnt) FROM public.response_time_hist_daily") == 2
+                # последовательности продолжают нумерацию старых таблиц
+                new_id = await con.fetchval(
+                    "INSERT INTO public.messages(chat_id, user_id, tg_message_id, message_text) "
+                    "SELECT -100, user_id, 4, 'new' FROM public.users WHERE tg_user_id = 1 RETURNING message_id"
+                )
+                assert new_id > max_id
+
+    asyncio.run(run())
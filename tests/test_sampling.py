@@ -0,0 +1,85 @@
+import pytest
+
+from quality_bot.sampling import parse_percent, sample_size, stratified_estimate
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("5%", 0.05), ("5", 0.05), ("0,5%", 0.005), ("100%", 1.0)],
+)
+def test_parse_percent(value, expected):
+    assert parse_percent(value) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("value", ["0", "0%", "150%", "-1", "abc"])
+def test_parse_percent_rejects(value):
+    with pytest.raises(ValueError):
+        parse_percent(value)
+
+
+@pytest.mark.parametrize(
+    "population, margin, confidence, expected",
+    [
+        (10**9, 0.05, 95, 385),   # классические 385 для ±5% при 95%
+        (1000, 0.05, 95, 278),    # поправка на конечную совокупность
+        (10**9, 0.03, 99, 1844),
+        (100, 0.05, 95, 80),
+        (10, 0.01, 95, 10),       # не больше совокупности
+        (0, 0.05, 95, 0),
+    ],
+)
+def test_sample_size(population, margin, confidence, expected):
+    assert sample_size(population, margin, confidence) == expected
+
+
+# Интервал Вильсона, эталонные значения: n=100, k=10 — [0.0552, 0.1744];
+# k=0 — верхняя граница z²/(n+z²), k=n — нижняя n/(n+z²)
+@pytest.mark.parametrize(
+    "strata, rate, lo, hi",
+    [
+        # слой 10000 сообщений, выборка 100: эффективный объём ровно 100
+        ([(10000, 100, 10)], 0.1, 0.05523, 0.17437),
+        ([(10**6, 10, 0)], 0.0, 0.0, 0.27754),
+        ([(10**6, 10, 10)], 1.0, 0.72246, 1.0),
+        ([(10**6, 1, 0)], 0.0, 0.0, 0.79346),
+        ([(10**6, 1, 1)], 1.0, 0.20654, 1.0),
+    ],
+)
+def test_wilson_interval(strata, rate, lo, hi):
+    est = stratified_estimate(strata, 95)
+    assert est["rate"] == pytest.approx(rate)
+    assert est["lo"] == pytest.approx(lo, abs=1e-5)
+    assert est["hi"] == pytest.approx(hi, abs=1e-5)
+
+
+def test_wilson_widens_with_confidence():
+    strata = [(10000, 100, 10)]
+    widths = [stratified_estimate(strata, c)["hi"] - stratified_estimate(strata, c)["lo"] for c in (90, 95, 99)]
+    assert widths == sorted(widths)
+
+
+def test_fully_analyzed_is_exact():
+    est = stratified_estimate([(50, 50, 5), (150, 150, 30)])
+    assert est["rate"] == pytest.approx(35 / 200)
+    assert est["lo"] == est["hi"] == est["rate"]
+
+
+def test_strata_weighted_by_size():
+    # день с 900 сообщениями весит в 9 раз больше дня со 100
+    est = stratified_estimate([(900, 90, 9), (100, 50, 25)])
+    assert est["rate"] == pytest.approx(0.9 * 0.1 + 0.1 * 0.5)
+    assert est["lo"] < est["rate"] < est["hi"]
+    assert est["analyzed"] == 140
+    assert est["messages"] == 1000
+
+
+def test_uncovered_strata_excluded():
+    est = stratified_estimate([(300, 30, 3), (100, 0, 0)])
+    assert est["rate"] == pytest.approx(0.1)
+    assert est["covered"] == pytest.approx(0.75)
+    assert est["messages"] == 400
+
+
+def test_nothing_analyzed():
+    assert stratified_estimate([(100, 0, 0)]) is None
+    assert stratified_estimate([]) is None
@@ -0,0 +1,73 @@
+import math
+import random
+
+import pytest
+
+from quality_bot.sketch import BUCKETS_PER_E, MAX_BUCKET, Histogram, bucket_bounds, bucket_of
+
+
+def _histogram(values) -> Histogram:
+    hist = Histogram()
+    for v in values:
+        hist.add(bucket_of(v), 1, v)
+    return hist
+
+
+def _exact(values, q: float) -> float:
+    # перцентиль по ближайшему рангу
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q * len(ordered)), 1) - 1]
+
+
+def test_bucket_bounds_contain_value():
+    for sec in (0.0, 0.4, 1.0, 59.9, 60.0, 3600.0, 86400.0):
+        lo, hi = bucket_bounds(bucket_of(sec))
+        assert lo <= sec < hi
+
+
+def test_bucket_of_clamps():
+    assert bucket_of(-5) == 0
+    assert bucket_of(1e12) == MAX_BUCKET
+
+
+@pytest.mark.parametrize("seed", [1, 2, 3])
+@pytest.mark.parametrize("q", [0.01, 0.25, 0.5, 0.9, 0.95, 0.99, 1.0])
+def test_quantile_within_one_bucket(seed, q):
+    # оценка лежит в той же корзине, что и точный перцентиль:
+    # ошибка по log(1 + sec) не больше ширины корзины 1/BUCKETS_PER_E (~5%)
+    rnd = random.Random(seed)
+    values = [rnd.lognormvariate(4, 1.5) for _ in range(5000)]
+    estimate = _histogram(values).quantile(q)
+    exact = _exact(values, q)
+    assert abs(math.log1p(estimate) - math.log1p(exact)) <= 1 / BUCKETS_PER_E + 1e-9
+
+
+def test_quantile_merges_daily_rows():
+    rnd = random.Random(7)
+    days = [[rnd.expovariate(1 / 300) for _ in range(200)] for _ in range(5)]
+    merged = Histogram()
+    for day in days:
+        for bucket, cnt in _histogram(day).counts.items():
+            merged.add(bucket, cnt, 0.0)
+    whole = _histogram([v for day in days for v in day])
+    assert merged.total == whole.total
+    for q in (0.5, 0.9, 0.99):
+        assert merged.quantile(q) == pytest.approx(whole.quantile(q))
+
+
+def test_mean_is_exact():
+    values = [1.0, 10.0, 100.0, 1000.0]
+    assert _histogram(values).mean == pytest.approx(277.75)
+
+
+def test_empty_histogram():
+    hist = Histogram()
+    assert hist.mean is None
+    assert hist.quantile(0.5) is None
+
+
+def test_quantile_single_value():
+    hist = _histogram([90.0])
+    lo, hi = bucket_bounds(bucket_of(90.0))
+    for q in (0.01, 0.5, 1.0):
+        assert lo <= hist.quantile(q) <= hi
@@ -0,0 +1,69 @@
+import asyncio
+
+from quality_bot.metrics import ANALYSIS_JOBS_FAILED
+from quality_bot.pipeline import PipelineStats
+from quality_bot.worker import AnalysisWorker
+
+
+class FakeRepo:
+    # очередь в памяти с семантикой claim/release из Repo
+    def __init__(self, ids, max_attempts):
+        self.jobs = {i: {"attempts": 0, "failed": False, "error": None} for i in ids}
+        self.max_attempts = max_attempts
+        self.completed = []
+
+    async def claim_analysis_jobs(self, limit, lease_sec, max_attempts):
+        rows = []
+        for i, job in self.jobs.items():
+            if not job["failed"] and job["attempts"] < max_attempts and len(rows) < limit:
+                job["attempts"] += 1
+                rows.append({"message_id": i, "attempts": job["attempts"], "chat_id": 1, "message_text": "x"})
+        return rows
+
+    async def complete_analysis_jobs(self, message_ids):
+        for i in message_ids:
+            self.completed.append(i)
+            del self.jobs[i]
+
+    async def release_analysis_jobs(self, message_ids, error, retry_in_sec, count_attempt=True, max_attempts=None):
+        dead = 0
+        for i in message_ids:
+            job = self.jobs[i]
+            job["error"] = error
+            if not count_attempt:
+                job["attempts"] -= 1
+            elif max_attempts is not None and job["attempts"] >= max_attempts:
+                job["failed"] = True
+                dead += 1
+        return dead
+
+    async def count_failed_analysis_jobs(self):
+        return sum(job["failed"] for job in self.jobs.values())
+
+
+class FailingPipeline:
+    # сообщения из bad всегда заканчиваются ошибкой анализа
+    breaker = None
+
+    def __init__(self, bad):
+        self.bad = set(bad)
+
+    async def run(self, rows, stats=None):
+        stats = PipelineStats()
+        stats.failed_ids = [r["message_id"] for r in rows if r["message_id"] in self.bad]
+        return stats
+
+
+def test_exhausted_jobs_are_marked_failed():
+    async def run():
+        repo = FakeRepo([1, 2, 3], max_attempts=3)
+        worker = AnalysisWorker(repo, FailingPipeline({2}), max_attempts=3)
+        for _ in range(5):
+            await worker.run_once()
+        assert repo.completed == [1, 3]
+        assert repo.jobs == {2: {"attempts": 3, "failed": True, "error": "analysis failed"}}
+        # проваленная задача больше не забирается
+        assert await worker.run_once() == 0
+        assert ANALYSIS_JOBS_FAILED._value.get() == 1
+
+    asyncio.run(run())